@@ -1,11 +1,105 @@
 from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import gc
+import logging
 import os
+import time
 from fastapi import FastAPI
+from img2textsemengine.api.batcher import QueryEmbeddingBatcher
 from img2textsemengine.api.config import load_config
-from img2textsemengine.vector_db.qdrant_util import Searcher
+from img2textsemengine.api.executor import ExecutorOverloaded, InferenceExecutor
+from img2textsemengine.api.image_proxy import ImageProxy
+from img2textsemengine.api.profiler import SamplingProfiler
+from img2textsemengine.utils.metrics import WORKER_MEMORY_BYTES, WORKER_STARTUP_SECONDS
+from img2textsemengine.utils.process_memory import read_process_memory
+from img2textsemengine.vector_db.encoders import build_text_encoder
+from img2textsemengine.vector_db.searcher import Searcher
 
+logger = logging.getLogger(__name__)
 
+shared_text_encoders = {}  # the text encoders loaded by the gunicorn master, before the workers are forked
 searchers = {}
+executors = {}
+batchers = {}
+configurations = {}
+image_proxies = {}
+profilers = {}
+readiness = {}  # whether the worker has warmed up and can be sent traffic
+
+WARMUP_TEXTS = ["a photo of a dog", "two people riding bicycles down a busy city street next to parked cars"]
+WARMUP_RETRY_SECONDS = (0.5, 30.0)  # the first and the longest wait before a failed warmup step is retried
+
+
+def preload_text_encoder() -> None:
+    """
+    Load the text encoder in the gunicorn master, before it forks the workers, if the model is shared across them.
+    The workers then share the pages of the weights copy-on-write instead of loading a copy each. The loaded objects
+    are frozen out of the garbage collector, whose bookkeeping would otherwise write to, and so copy, their pages.
+    Nothing runs the model here, so no intra-op thread pool is started before the fork
+    :return: None
+    """
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    if not configs.model.share_across_workers:
+        return
+    start = time.perf_counter()
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")  # the tokenizer threads do not survive a fork
+    shared_text_encoders["base_searcher"] = build_text_encoder(backend=configs.model.backend,
+                                                               hf_model=configs.model.hf_model,
+                                                               onnx_model_dir=configs.model.onnx_model_dir,
+                                                               prepared_model_dir=configs.model.prepared_model_dir,
+                                                               dtype=configs.model.dtype,
+                                                               num_threads=configs.executor.torch_threads)
+    gc.collect()
+    gc.freeze()
+    logger.info("Preloaded the '%s' text encoder in %.1fs, shared by the workers", configs.model.backend,
+                time.perf_counter() - start)
+
+
+async def warm_up(searcher: Searcher, executor: InferenceExecutor) -> None:
+    """
+    Run the first forward passes of the text encoder before the worker reports itself ready, so their one-off costs,
+    e.g. the allocation of the buffers and the start of the intra-op threads, are not paid by the first queries. The
+    first connection to QDrant is opened too. It runs in the background: the worker is alive, i.e. /health answers,
+    while it warms up. A step that fails for a transient reason, i.e. QDrant is not reachable yet or the executor is
+    full, is retried with an exponential backoff until it succeeds. A failure of the text encoder itself, e.g. a broken
+    model artifact, is not retried and the worker never reports itself ready
+    :param searcher: the searcher whose text encoder is warmed up
+    :param executor: the executor the queries run on
+    :return: None
+    """
+    start = time.perf_counter()
+    delay = WARMUP_RETRY_SECONDS[0]
+    for texts in (WARMUP_TEXTS[:1], WARMUP_TEXTS):  # a single query and a batch of queries with padding
+        while True:
+            try:
+                await executor.run("warmup", partial(searcher.text_encoder.embed, texts))
+                break
+            except ExecutorOverloaded:
+                delay = await _wait_before_retry("the executor is full", delay)
+            except Exception:
+                logger.exception("The text encoder failed to warm up, the worker will not report itself ready")
+                return
+    while True:
+        try:
+            await searcher.collection_version_async()
+            break
+        except Exception as e:
+            delay = await _wait_before_retry(f"QDrant is not reachable ({e!r})", delay)
+    readiness["base_searcher"] = True
+    logger.info("Worker %s warmed up in %.2fs", os.getpid(), time.perf_counter() - start)
+
+
+async def _wait_before_retry(reason: str, delay: float) -> float:
+    """
+    Wait before a failed warmup step is retried
+    :param reason: why the step failed
+    :param delay: how long to wait
+    :return: how long to wait before the next retry, twice as long up to WARMUP_RETRY_SECONDS[1]
+    """
+    logger.warning("The warmup of worker %s failed, %s. Retrying in %.1fs", os.getpid(), reason, delay)
+    await asyncio.sleep(delay)
+    return min(delay * 2, WARMUP_RETRY_SECONDS[1])
 
 
 @asynccontextmanager
@@ -15,14 +109,83 @@ async def lifespan(fastapi_app: FastAPI) -> None:
     :param fastapi_app: the fastAPI application to startup. Not used, however, if we delete it we will receive
     an error message like 'application startup failed. Exiting'
     """
+    start = time.perf_counter()
     configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))  # it can be defined as an
     # env variable. If there is not such an env var, then use the default config file
+    # the QDrant client is always created here, after the fork, since its connections can't be shared by the workers
     searcher = Searcher(host=configs.qdrant.host,
                         port=configs.qdrant.port,
                         collection_name=configs.qdrant.collection_name,
                         text_vector_name=configs.vector_names.text_vector_name,
                         img_vector_name=configs.vector_names.img_vector_name,
-                        hf_model=configs.model.hf_model)
+                        hf_model=configs.model.hf_model,
+                        encoder_backend=configs.model.backend,
+                        onnx_model_dir=configs.model.onnx_model_dir,
+                        prepared_model_dir=configs.model.prepared_model_dir,
+                        model_dtype=configs.model.dtype,
+                        encoder_threads=configs.executor.torch_threads,
+                        text_encoder=shared_text_encoders.get("base_searcher"),
+                        embedding_cache_size=configs.cache.embedding.max_size,
+                        embedding_cache_ttl=configs.cache.embedding.ttl_seconds,
+                        result_cache_size=configs.cache.results.max_size,
+                        result_cache_ttl=configs.cache.results.ttl_seconds,
+                        semantic_cache_size=configs.cache.semantic.max_size,
+                        semantic_cache_ttl=configs.cache.semantic.ttl_seconds,
+                        semantic_cache_threshold=configs.cache.semantic.similarity_threshold,
+                        version_check_interval=configs.cache.version_check_interval_seconds,
+                        search_backend=configs.search.backend,
+                        local_index_dir=configs.search.local_index_dir,
+                        hnsw_ef=configs.search.hnsw_ef,
+                        oversampling=configs.search.oversampling,
+                        rescore=configs.search.rescore,
+                        prefer_grpc=configs.qdrant.prefer_grpc,
+                        grpc_port=configs.qdrant.grpc_port,
+                        max_connections=configs.qdrant.max_connections,
+                        max_keepalive_connections=configs.qdrant.max_keepalive_connections,
+                        keepalive_expiry_seconds=configs.qdrant.keepalive_expiry_seconds)
     searchers["base_searcher"] = searcher
+    configurations["base_searcher"] = configs
+    executor = InferenceExecutor(workers=configs.executor.workers,
+                                 max_queue_size=configs.executor.max_queue_size,
+                                 retry_after_seconds=configs.executor.retry_after_seconds)
+    executors["base_searcher"] = executor
+    batcher = QueryEmbeddingBatcher(embed_fn=searcher.embed_texts,
+                                    executor=executor,
+                                    max_batch_size=configs.batching.max_batch_size,
+                                    max_wait_ms=configs.batching.max_wait_ms,
+                                    max_queued_queries=configs.batching.max_queued_queries)
+    await batcher.start()
+    batchers["base_searcher"] = batcher
+    image_proxies["base_searcher"] = ImageProxy(cache_dir=configs.image_proxy.cache_dir,
+                                                max_cache_bytes=configs.image_proxy.max_cache_mb * 1024 * 1024,
+                                                thumbnail_sizes=configs.image_proxy.thumbnail_sizes,
+                                                timeout_seconds=configs.image_proxy.timeout_seconds,
+                                                max_connections=configs.image_proxy.max_connections,
+                                                allowed_hosts=configs.image_proxy.allowed_hosts,
+                                                max_image_bytes=int(configs.image_proxy.max_image_mb * 1024 * 1024),
+                                                max_image_pixels=configs.image_proxy.max_image_pixels)
+    if configs.profiling.enabled:
+        profilers["base_searcher"] = SamplingProfiler(interval_ms=configs.profiling.interval_ms,
+                                                      max_requests=configs.profiling.max_requests)
+    pid = str(os.getpid())
+    for kind in ("rss", "pss", "shared", "private"):
+        WORKER_MEMORY_BYTES.labels(pid=pid, kind=kind).set_function(lambda kind=kind: read_process_memory().get(kind, 0))
+    WORKER_STARTUP_SECONDS.labels(pid=pid).set(time.perf_counter() - start)
+    memory = read_process_memory()
+    logger.info("Worker %s ready in %.1fs, rss %.0fMB, pss %.0fMB, shared text encoder: %s", pid,
+                time.perf_counter() - start, memory.get("rss", 0) / 2 ** 20, memory.get("pss", 0) / 2 ** 20,
+                "base_searcher" in shared_text_encoders)
+    warmup = asyncio.create_task(warm_up(searcher, executor))
     yield
+    warmup.cancel()
+    readiness.clear()
+    profilers.clear()
+    await image_proxies["base_searcher"].close()
+    image_proxies.clear()
+    await batcher.stop()
+    batchers.clear()
+    executor.shutdown()
+    executors.clear()
+    configurations.clear()
+    await searcher.close()
     searchers.clear()
@@ -72,7 +72,17 @@ backlog = 2048
 
 timeout = app_props.get_timeout()
 workers = app_props.get_workers()
-preload = True
+# import the app in the master before forking the workers. The setting is 'preload_app', gunicorn ignores 'preload'
+preload_app = True
+
+
+def on_starting(server):
+    """
+    Runs in the master, before the workers are forked: load the text encoder once, so that the workers share the
+    pages of its weights instead of loading a copy each
+    """
+    from img2textsemengine.api import preload_text_encoder
+    preload_text_encoder()
 
 # Use this instead to use async workers.
 # worker_class = 'gevent'
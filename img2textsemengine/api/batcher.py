@@ -0,0 +1,138 @@
+import asyncio
+import time
+from functools import partial
+from typing import Callable, Optional
+from img2textsemengine.api.executor import DeadlineExceeded, ExecutorOverloaded, InferenceExecutor
+from img2textsemengine.utils.metrics import (EXECUTOR_EXPIRED, EXECUTOR_REJECTED, QUERY_EMBEDDING_BATCH_SIZE,
+                                             QUERY_EMBEDDING_BATCH_WAIT)
+
+
+class QueryEmbeddingBatcher(object):
+    """
+    A class that coalesces the text queries of concurrent requests, so that the text encoder runs one
+    batched forward pass instead of many single-row ones
+    """
+    def __init__(self,
+                 embed_fn: Callable[[list[str]], list[list[float]]],
+                 executor: InferenceExecutor,
+                 max_batch_size: int,
+                 max_wait_ms: float,
+                 max_queued_queries: int = 1024):
+        """
+        :param embed_fn: a blocking function that returns the embedding of each given text
+        :param executor: the executor that runs embed_fn
+        :param max_batch_size: the maximum number of queries embedded in a single forward pass
+        :param max_wait_ms: the maximum time to wait for more queries after the first one of a batch arrives
+        :param max_queued_queries: the maximum number of queries waiting for a batch. Beyond it the queries are
+        rejected with a 503, like the calls of a full executor
+        """
+        self.embed_fn = embed_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queued_queries = max_queued_queries
+        self._queue: Optional[asyncio.Queue] = None
+        self._getter: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Start the background task that forms and embeds the batches. It must be called from the event loop
+        that serves the requests
+        """
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        """
+        Stop the background task and fail the queries that are still waiting
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            _, future, _, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("The query embedding batcher has been stopped"))
+
+    async def embed(self, text: str, deadline: Optional[float] = None) -> list[float]:
+        """
+        Embed a text query together with the other queries that arrive within the batching window
+        :param text: the user query
+        :param deadline: the time.monotonic() after which the embedding is useless, None for no deadline. An expired
+        query is dropped from its batch
+        :return: the embedding of the query
+        """
+        if self._queue.qsize() >= self.max_queued_queries:
+            EXECUTOR_REJECTED.labels(task="embed").inc()
+            raise ExecutorOverloaded(retry_after_seconds=self.executor.retry_after_seconds)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future, time.perf_counter(), deadline))
+        return await future
+
+    async def __next_item(self, timeout: Optional[float] = None) -> Optional[tuple]:
+        """
+        Wait for the next queued query. A pending get is kept across calls instead of being cancelled on timeout,
+        so an item is never lost between a timeout and the get completing
+        :param timeout: the maximum time to wait in seconds, None to wait forever
+        :return: the queued item, or None if the timeout expired
+        """
+        if self._getter is None:
+            self._getter = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait({self._getter}, timeout=timeout)
+        if not done:
+            return None
+        item = self._getter.result()
+        self._getter = None
+        return item
+
+    async def __run(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                batch = [await self.__next_item()]
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    if not self._queue.empty() and self._getter is None:
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    item = await self.__next_item(timeout=remaining)
+                    if item is None:
+                        break
+                    batch.append(item)
+                await self.__embed_batch(batch)
+        finally:
+            if self._getter is not None:
+                self._getter.cancel()
+
+    async def __embed_batch(self, batch: list[tuple]) -> None:
+        now = time.monotonic()
+        expired = [item for item in batch if item[3] is not None and item[3] <= now]
+        if expired:
+            EXECUTOR_EXPIRED.labels(task="embed").inc(len(expired))
+        for _, future, _, _ in expired:
+            if not future.done():
+                future.set_exception(DeadlineExceeded("The deadline of the query expired before it was embedded"))
+        batch = [item for item in batch if item[3] is None or item[3] > now]
+        if not batch:
+            return
+        texts, futures, enqueued_at, deadlines = zip(*batch)
+        QUERY_EMBEDDING_BATCH_SIZE.observe(len(batch))
+        QUERY_EMBEDDING_BATCH_WAIT.observe(time.perf_counter() - min(enqueued_at))
+        # the batch is useful until the last deadline of its queries
+        deadline = None if None in deadlines else max(deadlines)
+        try:
+            vectors = await self.executor.run("embed", partial(self.embed_fn, list(texts)), deadline=deadline)
+        except Exception as error:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for future, vector in zip(futures, vectors):
+            if not future.done():  # the request may have been cancelled meanwhile
+                future.set_result(vector)
@@ -1,4 +1,5 @@
 import yaml
+from typing import Optional
 from os.path import expandvars
 from pydantic import BaseModel
 
@@ -10,6 +11,11 @@ class QdrantParams(BaseModel):
     host: str
     port: int
     collection_name: str
+    prefer_grpc: bool = False  # send the requests over gRPC instead of REST
+    grpc_port: int = 6334
+    max_connections: int = 100  # the concurrent REST connections of a worker
+    max_keepalive_connections: int = 20  # the idle REST connections kept open
+    keepalive_expiry_seconds: float = 30  # how long an idle connection is kept open
 
 
 class Model(BaseModel):
@@ -17,6 +23,11 @@ class Model(BaseModel):
     A class to define the HF model will be used to extract the embeddings of texts/images
     """
     hf_model: str
+    backend: str = "torch"  # the inference backend of the text encoder: torch, onnx or onnx_int8
+    onnx_model_dir: Optional[str] = None  # the ONNX export of the text encoder, used by the onnx backends
+    prepared_model_dir: Optional[str] = None  # the local text encoder of hf_model, loaded by torch if it exists
+    dtype: str = "float32"  # the dtype of the weights of the torch backend: float32 or bfloat16
+    share_across_workers: bool = False  # load the encoder once in the gunicorn master, the workers share its pages
 
 
 class VectorNames(BaseModel):
@@ -27,6 +38,88 @@ class VectorNames(BaseModel):
     img_vector_name: str
 
 
+class Batching(BaseModel):
+    """
+    A class to define how the text queries of concurrent requests are coalesced into a single forward pass
+    """
+    max_batch_size: int = 32  # the maximum number of queries embedded together
+    max_wait_ms: float = 5  # the maximum time to wait for more queries after the first one of a batch
+    max_queries_per_request: int = 64  # the maximum number of queries of a single /query/batch request
+    max_queued_queries: int = 1024  # the maximum number of queries waiting for a batch, beyond it they get a 503
+
+
+class Executor(BaseModel):
+    """
+    A class to define the thread pool that runs the text encoder and the searches, and its admission control
+    """
+    workers: int = 2  # the threads running the blocking calls
+    torch_threads: int = 2  # the intra-op threads of each forward pass, also used by the ONNX Runtime backends
+    max_queue_size: int = 32  # the maximum number of calls waiting for a free worker, beyond it they get a 503
+    retry_after_seconds: int = 1  # the Retry-After of a 503
+    deadline_seconds: float = 10  # the work of a request still queued after it is dropped with a 504
+
+
+class CacheParams(BaseModel):
+    """
+    A class to define the size and the time to live of a Searcher cache. A max_size of 0 disables the cache
+    """
+    max_size: int = 0
+    ttl_seconds: float = 300
+
+
+class SemanticCacheParams(CacheParams):
+    """
+    A class to define the semantic cache of the Searcher, which serves the results of a cached query to the queries
+    whose embedding is similar enough
+    """
+    similarity_threshold: float = 0.95  # the minimum cosine similarity between the two query embeddings
+
+
+class Cache(BaseModel):
+    """
+    A class to define the text->embedding, the search results and the semantic caches of the Searcher
+    """
+    embedding: CacheParams = CacheParams()
+    results: CacheParams = CacheParams()
+    semantic: SemanticCacheParams = SemanticCacheParams()
+    version_check_interval_seconds: float = 5  # how often the collection version is checked to invalidate results
+
+
+class Search(BaseModel):
+    """
+    A class to define the backend that answers the vector searches
+    """
+    backend: str = "qdrant"  # qdrant, or local for an exact search over a memory-mapped copy of the vectors
+    local_index_dir: Optional[str] = None  # the folder of the local index, used by the local backend
+    local_index_dtype: str = "float32"  # the dtype of the vectors of the local index: float32 or float16
+    hnsw_ef: Optional[int] = None  # the candidates list of the HNSW search, higher is a better recall but slower
+    oversampling: Optional[float] = None  # with quantized vectors, the candidates rescored per result
+    rescore: Optional[bool] = None  # with quantized vectors, rescore the candidates with the original vectors
+
+
+class ImageProxyParams(BaseModel):
+    """
+    A class to define the on-disk cache and the upstream connections of the /get_image proxy
+    """
+    cache_dir: str = "data/image_cache"
+    max_cache_mb: int = 1024  # the least recently used images are evicted above it
+    thumbnail_sizes: list[int] = [128, 256, 512]  # the allowed values of the 'size' parameter
+    timeout_seconds: float = 30
+    max_connections: int = 100  # the size of the pool of upstream connections
+    allowed_hosts: list[str] = ["images.cocodataset.org"]  # the only hosts proxied, redirects included
+    max_image_mb: float = 20  # the larger upstream images are rejected
+    max_image_pixels: int = 50_000_000  # the larger images are not decoded into thumbnails
+
+
+class Profiling(BaseModel):
+    """
+    A class to define the on-demand sampling profiler of the /admin/profile routes
+    """
+    enabled: bool = False  # the admin routes answer with an error while it is disabled
+    interval_ms: float = 5  # the sampling interval
+    max_requests: int = 1000  # the maximum number of requests a single profile can capture
+
+
 class Config(BaseModel):
     """
     A class that stores the configs of the Searcher class
@@ -34,6 +127,12 @@ class Config(BaseModel):
     qdrant: QdrantParams
     vector_names: VectorNames
     model: Model
+    batching: Batching = Batching()
+    executor: Executor = Executor()
+    cache: Cache = Cache()
+    search: Search = Search()
+    image_proxy: ImageProxyParams = ImageProxyParams()
+    profiling: Profiling = Profiling()
 
 
 def load_config(path: str) -> Config:
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional, TypeVar
+from img2textsemengine.utils.metrics import (EXECUTOR_EXPIRED, EXECUTOR_QUEUE_DEPTH, EXECUTOR_REJECTED,
+                                             EXECUTOR_WAIT_SECONDS)
+
+T = TypeVar("T")
+
+
+class ExecutorOverloaded(Exception):
+    """
+    Raised when a call is rejected because the queue of the executor is full. The API answers with a 503
+    """
+    def __init__(self, retry_after_seconds: int):
+        super().__init__("The service is overloaded, retry later")
+        self.retry_after_seconds = retry_after_seconds
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the deadline of a request expires before its call is computed. The API answers with a 504
+    """
+
+
+async def await_with_deadline(task: str, awaitable: Awaitable[T], deadline: Optional[float] = None) -> T:
+    """
+    Await a non-blocking call, e.g. a search of the async QDrant client, until the deadline of its request
+    :param task: the name of the call, used as the 'task' label of the metrics
+    :param awaitable: the call
+    :param deadline: the time.monotonic() after which the result is useless, None for no deadline
+    :return: the result of the call
+    """
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+    try:
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        EXECUTOR_EXPIRED.labels(task=task).inc()
+        raise DeadlineExceeded(f"The deadline of the '{task}' call expired") from None
+
+
+class InferenceExecutor(object):
+    """
+    A class to run the blocking calls of the routes, i.e. the text encoder and the searches, on a dedicated pool of
+    threads. The pool is small, so the intra-op threads of the model do not compete for the cores, and its queue is
+    bounded: when it is full a call is rejected at once instead of waiting behind the others. A call whose deadline
+    expires while it is queued is dropped before it is computed, since its client has already given up
+    """
+    def __init__(self, workers: int, max_queue_size: int, retry_after_seconds: int = 1):
+        """
+        :param workers: the number of threads running the calls
+        :param max_queue_size: the maximum number of calls waiting for a free thread
+        :param retry_after_seconds: the Retry-After advertised to the clients of a rejected call
+        """
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.retry_after_seconds = retry_after_seconds
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._pending = 0  # the calls that are queued or running
+        self._lock = threading.Lock()
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __admit(self, task: str) -> None:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue_size:
+                EXECUTOR_REJECTED.labels(task=task).inc()
+                raise ExecutorOverloaded(retry_after_seconds=self.retry_after_seconds)
+            self._pending += 1
+
+    def __release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, task: str, func: Callable[[], T], deadline: Optional[float] = None) -> T:
+        """
+        Run a blocking call on the pool, exporting how many calls are waiting for a free thread and how long they waited
+        :param task: the name of the call, used as the 'task' label of the metrics
+        :param func: the blocking call
+        :param deadline: the time.monotonic() after which the result is useless, None for no deadline
+        :return: the result of the call
+        """
+        self.__admit(task)
+        submitted_at = time.perf_counter()
+        queue_depth = EXECUTOR_QUEUE_DEPTH.labels(task=task)
+        state = "queued"  # then either 'running', or 'abandoned' if the caller stopped waiting before it started
+        lock = threading.Lock()
+
+        def run() -> T:
+            nonlocal state
+            with lock:
+                if state == "abandoned":
+                    raise DeadlineExceeded(f"The '{task}' call was abandoned before it started")
+                state = "running"
+            queue_depth.dec()
+            EXECUTOR_WAIT_SECONDS.labels(task=task).observe(time.perf_counter() - submitted_at)
+            try:
+                if deadline is not None and time.monotonic() >= deadline:
+                    EXECUTOR_EXPIRED.labels(task=task).inc()
+                    raise DeadlineExceeded(f"The deadline of the '{task}' call expired before it started")
+                return func()
+            finally:
+                self.__release()
+
+        queue_depth.inc()
+        future = self._pool.submit(run)
+        try:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"The deadline of the '{task}' call expired") from None
+        finally:
+            with lock:
+                abandoned = state == "queued"
+                if abandoned:
+                    state = "abandoned"
+            if abandoned:  # it will never run, so it leaves the queue and releases its slot here
+                future.cancel()
+                queue_depth.dec()
+                self.__release()
+                EXECUTOR_EXPIRED.labels(task=task).inc()
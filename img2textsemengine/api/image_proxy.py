@@ -0,0 +1,350 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import uuid
+from io import BytesIO
+from typing import AsyncIterator, BinaryIO, Iterable, Optional
+import httpx
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+CACHE_CONTROL = "public, max-age=86400"  # the proxied images are immutable, as the ones of the COCO dataset
+# the browsers must not guess another type than the image one of the responses, e.g. run an html page as the API origin
+NOSNIFF = {"X-Content-Type-Options": "nosniff"}
+# the cache stores every image and thumbnail once, under the hash of its bytes, in 'blobs', and the hash of the bytes of
+# each url and thumbnail size in 'refs'. The hash of the bytes is the ETag of the image
+BLOBS_DIR = "blobs"
+REFS_DIR = "refs"
+
+
+class ImageProxyError(Exception):
+    """
+    Raised when an image cannot be proxied, because of its host or because it cannot be decoded. The API answers with
+    its status code
+    """
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ImageProxy(object):
+    """
+    A class to proxy the images of the dataset. The upstream bytes are streamed to the client without decoding them,
+    and kept in a content-addressed on-disk LRU cache with a size cap, together with the thumbnails generated from them.
+    The cache is read and written in threads, never on the event loop. Only the images of the allowed hosts are
+    proxied, so the API never serves anything else, e.g. the internal services it can reach, under its own origin
+    """
+    def __init__(self,
+                 cache_dir: str,
+                 max_cache_bytes: int,
+                 thumbnail_sizes: list[int],
+                 timeout_seconds: float = 30,
+                 max_connections: int = 100,
+                 allowed_hosts: Iterable[str] = ("images.cocodataset.org",),
+                 max_image_bytes: int = 20 * 1024 * 1024,
+                 max_image_pixels: int = 50_000_000):
+        """
+        :param cache_dir: the folder of the cache
+        :param max_cache_bytes: the maximum size of the cache. The least recently used files are evicted above it
+        :param thumbnail_sizes: the allowed thumbnail sizes, i.e. the maximum width/height of a thumbnail
+        :param timeout_seconds: the timeout of an upstream request
+        :param max_connections: the size of the pool of upstream connections
+        :param allowed_hosts: the hosts the images are proxied from. The requests to any other host, redirects
+        included, are rejected
+        :param max_image_bytes: the maximum size of an upstream image
+        :param max_image_pixels: the maximum number of pixels of an image decoded into a thumbnail
+        """
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.thumbnail_sizes = set(thumbnail_sizes)
+        self.allowed_hosts = {host.lower() for host in allowed_hosts}
+        self.max_image_bytes = max_image_bytes
+        self.max_image_pixels = max_image_pixels
+        self.client = httpx.AsyncClient(timeout=timeout_seconds,
+                                        follow_redirects=True,
+                                        limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections),
+                                        event_hooks={"request": [self.__check_host]})
+        os.makedirs(cache_dir, exist_ok=True)
+        # the size is scanned once, at startup, then tracked as the files are stored and evicted
+        self._cache_bytes = sum(os.path.getsize(path) for path in self.__cached_files())
+        self._eviction: Optional[asyncio.Future] = None
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def __check_url(self, url: httpx.URL) -> None:
+        """
+        reject the urls of the hosts that are not allowed
+        """
+        if url.scheme not in ("http", "https") or url.host.lower() not in self.allowed_hosts:
+            raise ImageProxyError(403, f"The images of '{url.scheme}://{url.host}' are not proxied")
+
+    async def __check_host(self, request: httpx.Request) -> None:
+        """
+        the request hook of the upstream client, called for every request, redirects included
+        """
+        self.__check_url(request.url)
+
+    @staticmethod
+    def __ref_key(img_url: str, size: Optional[int]) -> str:
+        """
+        :return: the key of the reference of an image in the cache, i.e. the hash of its url and its thumbnail size
+        """
+        return hashlib.sha256(f"{img_url}\n{size or ''}".encode("utf-8")).hexdigest()
+
+    def __cached_path(self, kind: str, key: str) -> str:
+        """
+        :return: the path of the cached blob or reference of a key. The files are spread over 256 sub-folders to keep
+        them small
+        """
+        return os.path.join(self.cache_dir, kind, key[:2], key)
+
+    def __cached_files(self) -> list[str]:
+        """
+        :return: the paths of every complete file of the cache
+        """
+        return [os.path.join(folder, name) for folder, _, names in os.walk(self.cache_dir)
+                for name in names if ".tmp-" not in name]
+
+    def __tmp_path(self) -> str:
+        return os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+
+    def __lookup(self, ref_key: str) -> Optional[str]:
+        """
+        find an image in the cache and mark it as recently used. The files are touched when they are served, so their
+        mtime is their last use
+        :param ref_key: the key of the reference of the image
+        :return: the hash of the bytes of the image, None if it is not cached
+        """
+        ref_path = self.__cached_path(REFS_DIR, ref_key)
+        try:
+            with open(ref_path, "r", encoding="utf-8") as ref_file:
+                content_hash = ref_file.read()
+            os.utime(self.__cached_path(BLOBS_DIR, content_hash))  # the blob may have been evicted on its own
+            os.utime(ref_path)
+        except FileNotFoundError:
+            return None
+        return content_hash
+
+    def __read_blob(self, content_hash: str) -> Optional[bytes]:
+        try:
+            with open(self.__cached_path(BLOBS_DIR, content_hash), "rb") as blob_file:
+                return blob_file.read()
+        except FileNotFoundError:
+            return None  # evicted since it was looked up
+
+    def __store(self, tmp_path: str, content_hash: str, ref_key: str) -> int:
+        """
+        move a completely written temporary file into the cache, and reference it from its url and thumbnail size
+        :return: the number of bytes added to the cache
+        """
+        blob_path = self.__cached_path(BLOBS_DIR, content_hash)
+        ref_path = self.__cached_path(REFS_DIR, ref_key)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+        # atomic, so concurrent misses of the same image never expose a partial file
+        os.replace(tmp_path, blob_path)
+        ref_tmp_path = self.__tmp_path()
+        with open(ref_tmp_path, "w", encoding="utf-8") as ref_file:
+            ref_file.write(content_hash)
+        os.replace(ref_tmp_path, ref_path)
+        return os.path.getsize(blob_path) + len(content_hash)
+
+    async def __add_to_cache(self, tmp_path: str, content_hash: str, ref_key: str) -> None:
+        """
+        store a file in the cache and, above the size cap, start an eviction in a thread unless one is running
+        """
+        self._cache_bytes += await asyncio.to_thread(self.__store, tmp_path, content_hash, ref_key)
+        if self._cache_bytes > self.max_cache_bytes and (self._eviction is None or self._eviction.done()):
+            self._eviction = asyncio.ensure_future(asyncio.to_thread(self.__evict))
+
+    def __evict(self) -> None:
+        """
+        evict the least recently used files until the cache is below 90% of its cap, so the eviction scan is amortized
+        over many insertions. The size is recomputed from the disk, since the gunicorn workers share the same cache
+        folder. It runs in a thread
+        """
+        files = []
+        for path in self.__cached_files():
+            try:
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                pass  # evicted by another worker
+        files.sort()
+        cache_bytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if cache_bytes <= 0.9 * self.max_cache_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            cache_bytes -= size
+        self._cache_bytes = cache_bytes
+
+    @staticmethod
+    def __not_modified(etag: str, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    @staticmethod
+    def __media_type(img_url: str, size: Optional[int]) -> str:
+        """
+        :return: the media type of a cached file. The thumbnails are always JPEG, the originals keep the type of their url
+        """
+        if size is not None:
+            return "image/jpeg"
+        media_type = mimetypes.guess_type(img_url)[0]
+        return media_type if media_type and media_type.startswith("image/") else "application/octet-stream"
+
+    async def get(self, img_url: str, size: Optional[int] = None, if_none_match: Optional[str] = None) -> Response:
+        """
+        Serve an image or one of its thumbnails
+        :param img_url: the url of the image
+        :param size: the thumbnail size, None for the original image
+        :param if_none_match: the If-None-Match header of the request
+        :return: the response. An original streamed from its host has no ETag yet, its bytes are hashed on the way
+        """
+        if size is not None and size not in self.thumbnail_sizes:
+            raise ValueError(f"'size' must be one of {sorted(self.thumbnail_sizes)}")
+        try:
+            url = httpx.URL(img_url)
+        except httpx.InvalidURL as error:
+            raise ValueError(f"'{img_url}' is not a valid image url") from error
+        if not url.is_absolute_url:
+            raise ValueError(f"'{img_url}' is not a valid image url")
+        self.__check_url(url)  # the images cached before the host was disallowed are not served either
+        ref_key = self.__ref_key(img_url, size)
+        content_hash = await asyncio.to_thread(self.__lookup, ref_key)
+        if content_hash is not None:
+            headers = {"ETag": f'"{content_hash}"', "Cache-Control": CACHE_CONTROL, **NOSNIFF}
+            if self.__not_modified(headers["ETag"], if_none_match):
+                return Response(status_code=304, headers=headers)
+            return FileResponse(path=self.__cached_path(BLOBS_DIR, content_hash),
+                                media_type=self.__media_type(img_url, size), headers=headers)
+        if size is None:
+            return await self.__stream_original(img_url, ref_key)
+        return await self.__thumbnail(img_url, size, ref_key)
+
+    async def __fetch(self, img_url: str) -> httpx.Response:
+        """
+        request an image from its host, and check it is an image no larger than max_image_bytes
+        :param img_url: the url of the image
+        :return: the successful upstream response, whose body is not read yet
+        """
+        try:
+            upstream = await self.client.send(self.client.build_request("GET", img_url), stream=True)
+        except (httpx.InvalidURL, httpx.UnsupportedProtocol) as error:
+            raise ValueError(f"'{img_url}' is not a valid image url") from error
+        except httpx.HTTPError as error:
+            raise ImageProxyError(502, f"The image host could not be reached: {error!r}") from error
+        if not upstream.is_success:
+            await upstream.aclose()
+            raise ImageProxyError(404 if upstream.status_code in (404, 410) else 502,
+                                  f"The image host responded with {upstream.status_code}")
+        content_type = upstream.headers.get("content-type", "")
+        if not content_type.startswith("image/") or content_type.startswith("image/svg"):  # an svg can run scripts
+            await upstream.aclose()
+            raise ImageProxyError(415, f"The url is not an image but '{content_type}'")
+        if int(upstream.headers.get("content-length") or 0) > self.max_image_bytes:
+            await upstream.aclose()
+            raise ImageProxyError(413, f"The image is larger than {self.max_image_bytes} bytes")
+        return upstream
+
+    async def __capped_chunks(self, upstream: httpx.Response) -> AsyncIterator[bytes]:
+        """
+        :return: the chunks of the upstream body, which is cut short past max_image_bytes, whatever its content-length
+        """
+        received = 0
+        try:
+            async for chunk in upstream.aiter_bytes():
+                received += len(chunk)
+                if received > self.max_image_bytes:
+                    raise ImageProxyError(413, f"The image is larger than {self.max_image_bytes} bytes")
+                yield chunk
+        except httpx.HTTPError as error:
+            raise ImageProxyError(502, f"The image host failed to send the image: {error!r}") from error
+        finally:
+            await upstream.aclose()
+
+    async def __stream_original(self, img_url: str, ref_key: str) -> Response:
+        """
+        stream the upstream bytes to the client, writing them to the cache at the same time
+        """
+        upstream = await self.__fetch(img_url)
+
+        async def body() -> AsyncIterator[bytes]:
+            tmp_path = self.__tmp_path()
+            tmp_file = await asyncio.to_thread(open, tmp_path, "wb")
+            digest = hashlib.sha256()
+            complete = False
+            try:
+                async for chunk in self.__capped_chunks(upstream):
+                    yield chunk
+                    await asyncio.to_thread(_write_chunk, tmp_file, digest, chunk)
+                complete = True
+            finally:
+                await upstream.aclose()
+                await asyncio.to_thread(tmp_file.close)
+                if complete:
+                    await self.__add_to_cache(tmp_path, digest.hexdigest(), ref_key)
+                else:  # the client or the upstream went away, never cache a partial image
+                    await asyncio.to_thread(os.remove, tmp_path)
+
+        return StreamingResponse(body(), media_type=upstream.headers["content-type"],
+                                 headers={"Cache-Control": CACHE_CONTROL, **NOSNIFF})
+
+    async def __thumbnail(self, img_url: str, size: int, ref_key: str) -> Response:
+        """
+        generate a thumbnail once, from the cached original if there is one, and cache it
+        """
+        original_hash = await asyncio.to_thread(self.__lookup, self.__ref_key(img_url, None))
+        original = None if original_hash is None else await asyncio.to_thread(self.__read_blob, original_hash)
+        if original is None:
+            original = b"".join([chunk async for chunk in self.__capped_chunks(await self.__fetch(img_url))])
+        thumbnail = await asyncio.to_thread(_make_thumbnail, original, size, self.max_image_pixels)
+        content_hash = hashlib.sha256(thumbnail).hexdigest()
+        tmp_path = self.__tmp_path()
+        await asyncio.to_thread(_write_file, tmp_path, thumbnail)
+        await self.__add_to_cache(tmp_path, content_hash, ref_key)
+        return Response(content=thumbnail, media_type="image/jpeg",
+                        headers={"ETag": f'"{content_hash}"', "Cache-Control": CACHE_CONTROL, **NOSNIFF})
+
+
+def _write_chunk(tmp_file: BinaryIO, digest, chunk: bytes) -> None:
+    tmp_file.write(chunk)
+    digest.update(chunk)
+
+
+def _write_file(path: str, content: bytes) -> None:
+    with open(path, "wb") as output_file:
+        output_file.write(content)
+
+
+def _make_thumbnail(original: bytes, size: int, max_pixels: int) -> bytes:
+    """
+    :param original: the bytes of the original image
+    :param size: the maximum width/height of the thumbnail
+    :param max_pixels: the maximum number of pixels of the original, checked before it is decoded
+    :return: the JPEG bytes of the thumbnail
+    """
+    from PIL import Image  # imported on the first thumbnail, not when the API starts
+
+    try:
+        image = Image.open(BytesIO(original))  # only reads the header
+        if image.width * image.height > max_pixels:  # a decompression bomb, a few bytes that decode to gigabytes
+            raise ImageProxyError(413, f"The image has more than {max_pixels} pixels")
+        image.draft("RGB", (size, size))  # let the JPEG decoder skip the resolution the thumbnail does not need
+        image = image.convert("RGB")
+    except Image.DecompressionBombError as error:  # larger than the limit of PIL itself
+        raise ImageProxyError(413, str(error)) from error
+    except OSError as error:  # PIL.UnidentifiedImageError, or a truncated image
+        raise ImageProxyError(415, f"The image could not be decoded: {error}") from error
+    image.thumbnail((size, size))
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
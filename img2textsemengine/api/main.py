@@ -1,7 +1,10 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, RedirectResponse
 from starlette_prometheus import PrometheusMiddleware, metrics
-from img2textsemengine.api import lifespan
+from img2textsemengine.api import lifespan, profilers
+from img2textsemengine.api.executor import DeadlineExceeded, ExecutorOverloaded
+from img2textsemengine.api.image_proxy import ImageProxyError
+from img2textsemengine.api.profiler import ProfiledRequestsMiddleware
 from img2textsemengine.api.routes import router
 
 
@@ -18,6 +21,31 @@ async def value_error_exception_handler(request: Request, exc: ValueError):
         status_code=400,
         content={"message": str(exc)},
     )
+
+
+@app.exception_handler(ExecutorOverloaded)
+async def executor_overloaded_exception_handler(request: Request, exc: ExecutorOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"message": str(exc)},
+        headers={"Retry-After": str(exc.retry_after_seconds)},
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_exception_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(
+        status_code=504,
+        content={"message": str(exc)},
+    )
+
+
+@app.exception_handler(ImageProxyError)
+async def image_proxy_exception_handler(request: Request, exc: ImageProxyError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"message": str(exc)},
+    )
 app.include_router(router)
 
 
@@ -26,6 +54,8 @@ def root():
     return RedirectResponse(url='/docs')
 
 
+# count the requests of the /admin/profile captures
+app.add_middleware(ProfiledRequestsMiddleware, get_profiler=lambda: profilers.get("base_searcher"))
 # Include Prometheus support
 app.add_middleware(PrometheusMiddleware)
 app.add_route("/metrics", metrics)
@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+# the innermost frames of a thread that is idle, e.g. an executor worker waiting for a call or the event loop waiting
+# for a socket. Their samples are dropped, so the profile only shows the threads that do some work
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py", "thread.py")
+
+
+class SamplingProfiler(object):
+    """
+    A class to profile the service on demand, without instrumenting the code. Once armed, a background thread samples
+    the stack of every thread of the worker at a fixed interval, until a given number of requests has completed.
+    The samples are aggregated as collapsed stacks, the input format of flamegraph.pl and speedscope
+    """
+    def __init__(self, interval_ms: float = 5, max_requests: int = 1000):
+        """
+        :param interval_ms: the sampling interval
+        :param max_requests: the maximum number of requests a single profile can capture
+        """
+        self.interval = interval_ms / 1000
+        self.max_requests = max_requests
+        self._samples: Counter[str] = Counter()
+        self._remaining_requests = 0
+        self._started_at: Optional[float] = None
+        self._duration = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None
+
+    def start(self, requests: int) -> None:
+        """
+        Drop the previous profile and start sampling until the given number of requests has completed
+        :param requests: the number of requests to capture
+        :return: None
+        """
+        if not 0 < requests <= self.max_requests:
+            raise ValueError(f"The number of profiled requests must be between 1 and {self.max_requests}")
+        with self._lock:
+            if self.active:
+                raise ValueError("A profile is already being captured")
+            self._samples = Counter()
+            self._remaining_requests = requests
+            self._started_at = time.perf_counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.__sample, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def request_finished(self) -> None:
+        """
+        Count a completed request, and stop sampling once the requested number of them has completed
+        :return: None
+        """
+        with self._lock:
+            if not self.active:
+                return
+            self._remaining_requests -= 1
+            if self._remaining_requests > 0:
+                return
+            thread, self._thread = self._thread, None
+            self._duration = time.perf_counter() - self._started_at
+        self._stop.set()
+        thread.join()
+
+    def collapsed_stacks(self) -> str:
+        """
+        :return: the profile as collapsed stacks, one 'outer;...;inner count' line per distinct stack
+        """
+        header = (f"# {sum(self._samples.values())} samples every {self.interval * 1000:g}ms over "
+                  f"{self._duration:.2f}s, pid {os.getpid()}")
+        if self.active:
+            header += f", still capturing {self._remaining_requests} requests"
+        lines = [f"{stack} {count}" for stack, count in self._samples.most_common()]
+        return "\n".join([header] + lines) + "\n"
+
+    def __sample(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self._samples[";".join(reversed(stack))] += 1
+
+
+class ProfiledRequestsMiddleware(object):
+    """
+    An ASGI middleware that counts the completed requests of a profile being captured. The admin requests are not
+    counted. Without a profiler, the requests are passed through as they are
+    """
+    def __init__(self, app, get_profiler: Callable[[], Optional[SamplingProfiler]]):
+        """
+        :param app: the ASGI app
+        :param get_profiler: returns the profiler of the worker, None if it is disabled
+        """
+        self.app = app
+        self.get_profiler = get_profiler
+
+    async def __call__(self, scope, receive, send):
+        profiler = self.get_profiler() if scope["type"] == "http" else None
+        if profiler is None or scope["path"].startswith("/admin"):
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, send)
+        if profiler.active:
+            profiler.request_finished()
@@ -1,5 +1,15 @@
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+
+class Text2ImgSearchFilter(BaseModel):
+    """
+    A class to represent the payload conditions of a search. All the defined conditions must hold
+    """
+    caption_text: Optional[str] = None  # every word of it must be in the captions of the image, in any order
+    caption_words: Optional[list[str]] = None  # at least one of them must be in the captions of the image
+    sources: Optional[list[str]] = None  # the hosts of the images, e.g. images.cocodataset.org
+    url_prefix: Optional[str] = None  # the start of the image urls, ending after the host or after a folder
 
 
 class Text2ImgSearchRequest(BaseModel):
@@ -8,13 +18,35 @@ class Text2ImgSearchRequest(BaseModel):
     """
     text: str
     vector_to_search: str
-    k: Optional[int]
+    k: Optional[int] = Field(default=None, gt=0)  # the number of results, 10 by default
+    filter: Optional[Text2ImgSearchFilter] = None  # only the images matching it are searched
+    fields: Optional[list[str]] = None  # the fields of each result, 'img_url' and/or 'captions'. All by default
 
     class Config:
         json_schema_extra = {
             "example": {
                 "text": "a cat playing alone",
                 "vector_to_search": "image",
-                "k": 5
+                "k": 5,
+                "filter": {"caption_words": ["cat", "kitten"], "sources": ["images.cocodataset.org"]},
+                "fields": ["img_url"]
+            }
+        }
+
+
+class Text2ImgBatchSearchRequest(BaseModel):
+    """
+    A class to represent the request object for many txt 2 img searches at once
+    """
+    queries: list[Text2ImgSearchRequest]
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "queries": [
+                    {"text": "a cat playing alone", "vector_to_search": "image", "k": 5},
+                    {"text": "photo of a dog", "vector_to_search": "text", "k": 3,
+                     "filter": {"url_prefix": "http://images.cocodataset.org/val2014"}, "fields": ["img_url"]}
+                ]
             }
         }
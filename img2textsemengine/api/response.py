@@ -1,12 +1,13 @@
+from typing import Optional
 from pydantic import BaseModel
 
 
 class Text2ImgSearchInstanceReply(BaseModel):
     """
-    A class to define the reply object of the API
+    A class to define the reply object of the API. The fields the request did not ask for are left out
     """
-    captions: list[str]  # the captions of the image
-    img_url: str  # the url of the image
+    captions: Optional[list[str]] = None  # the captions of the image
+    img_url: Optional[str] = None  # the url of the image
 
     class Config:
         json_schema_extra = {
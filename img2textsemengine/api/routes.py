@@ -1,14 +1,65 @@
-import asyncio
+import json
+import time
 from functools import partial
-import requests
-from fastapi import APIRouter
-from fastapi.responses import PlainTextResponse, FileResponse
-from PIL import Image
-from img2textsemengine.api import searchers
+from typing import Optional
+from fastapi import APIRouter, Header
+from fastapi.responses import PlainTextResponse, FileResponse, Response
+from img2textsemengine.api import (batchers, configurations, executors, image_proxies, profilers, readiness,
+                                   searchers)
 from img2textsemengine.api.response import Text2ImgSearchInstanceReply
-from img2textsemengine.api.request import Text2ImgSearchRequest
+from img2textsemengine.api.executor import await_with_deadline
+from img2textsemengine.api.request import Text2ImgBatchSearchRequest, Text2ImgSearchRequest
+from img2textsemengine.utils.metrics import track_stage
+from img2textsemengine.vector_db.payload_filter import SearchFilter, resolve_fields
 
 router = APIRouter()
+DEFAULT_TOP_K = 10  # the number of results of a query without k, the default of the Searcher
+
+
+def request_deadline(x_request_timeout: Optional[float]) -> float:
+    """
+    :param x_request_timeout: the timeout in seconds of the client, if it sent one
+    :return: the time.monotonic() after which the work of the request is dropped. It is the shortest between the
+    timeout of the client and the configured deadline
+    """
+    timeout = configurations["base_searcher"].executor.deadline_seconds
+    if x_request_timeout is not None:
+        timeout = min(timeout, x_request_timeout)
+    return time.monotonic() + timeout
+
+
+def search_filter(request: Text2ImgSearchRequest) -> Optional[SearchFilter]:
+    """
+    :param request: a search request
+    :return: the payload conditions of the search, None without any
+    """
+    if request.filter is None:
+        return None
+    return SearchFilter(**request.filter.model_dump())
+
+
+def build_replies(response: list[tuple[Optional[str], Optional[list[str]]]], fields: tuple[str, ...]) -> list[dict]:
+    """
+    :param response: the (img_url, captions) results of a search
+    :param fields: the fields the request asked for
+    :return: the replies of the results as plain dicts, with the asked fields only
+    """
+    if fields == ("img_url",):
+        return [{"img_url": img_url} for img_url, _ in response]
+    if fields == ("captions",):
+        return [{"captions": captions} for _, captions in response]
+    return [{"captions": captions, "img_url": img_url} for img_url, captions in response]
+
+
+def json_response(content: list) -> Response:
+    """
+    Serialize the replies in a single json.dumps. The response_model of the routes only documents them: validating a
+    pydantic model per result and encoding it again costs more than the search itself for a large k
+    :param content: the replies
+    :return: the JSON response
+    """
+    return Response(content=json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                    media_type="application/json")
 
 
 @router.get(
@@ -20,44 +71,165 @@ def get_health():
     return "OK"
 
 
+@router.get(
+    "/ready",
+    response_class=PlainTextResponse,
+    response_description="Returns 'OK' once the worker has warmed up its model, a 503 before"
+)
+def get_ready():
+    if not readiness.get("base_searcher"):
+        return PlainTextResponse("Warming up", status_code=503)
+    return "OK"
+
+
 @router.post(
     "/query",
     response_model=list[Text2ImgSearchInstanceReply],
     response_description="Return the metadata of the top-k most similar images against the user query"
 )
-async def query(request_body: Text2ImgSearchRequest) -> list[Text2ImgSearchInstanceReply]:
+async def query(request_body: Text2ImgSearchRequest,
+                x_request_timeout: Optional[float] = Header(default=None)) -> Response:
     """
     Implement the query POST request which retrieve the top-k most similar image against the user's text query
     :param request_body: the request body
-    :return: The img url and the captions/answers of the most relevant image
+    :param x_request_timeout: the timeout of the client in seconds. The work of the request is dropped after it
+    :return: The img url and the captions/answers of the most relevant image, or the fields the request asked for
     """
     text = request_body.text
     vector_to_search = request_body.vector_to_search
-    k = request_body.k
-    loop = asyncio.get_event_loop()
+    k = request_body.k if request_body.k is not None else DEFAULT_TOP_K
+    searcher = searchers["base_searcher"]
+    deadline = request_deadline(x_request_timeout)
+    # fail fast, before waiting for a batch
+    searcher.check_vector_name(vector_to_search)
+    conditions = search_filter(request_body)
+    fields = resolve_fields(request_body.fields)
+    text_features = searcher.cached_embedding(text)
+    if text_features is None:
+        # the text is embedded together with the queries of other concurrent requests
+        text_features = await batchers["base_searcher"].embed(text, deadline=deadline)
+    if searcher.async_search:  # only the text encoder needs a thread, the search is awaited on the event loop
+        response = await await_with_deadline("search", searcher.search_async(text_features=text_features,
+                                                                             vector_to_search=vector_to_search,
+                                                                             top_k=k,
+                                                                             search_filter=conditions,
+                                                                             fields=list(fields)), deadline=deadline)
+    else:
+        response = await executors["base_searcher"].run("search", partial(searcher.search,
+                                                                          text_features=text_features,
+                                                                          vector_to_search=vector_to_search,
+                                                                          top_k=k,
+                                                                          search_filter=conditions,
+                                                                          fields=list(fields)), deadline=deadline)
+    with track_stage("build_response"):
+        return json_response(build_replies(response, fields))
+
 
-    response = await loop.run_in_executor(executor=None, func=partial(searchers["base_searcher"].query,
-                                                                      text=text,
-                                                                      vector_to_search=vector_to_search,
-                                                                      top_k=k))
-    search_results = []
-    for retrieved_img in response:
-        search_results.append(Text2ImgSearchInstanceReply(captions=retrieved_img[1],
-                                                          img_url=retrieved_img[0]))
-    return search_results
+@router.post(
+    "/query/batch",
+    response_model=list[list[Text2ImgSearchInstanceReply]],
+    response_description="Return the metadata of the top-k most similar images against each user query, in the "
+                         "order of the queries"
+)
+async def query_batch(request_body: Text2ImgBatchSearchRequest,
+                      x_request_timeout: Optional[float] = Header(default=None)) -> Response:
+    """
+    Implement the batch query POST request which retrieve the top-k most similar images against many text queries.
+    The queries are embedded in a single forward pass and searched in a single QDrant request
+    :param request_body: the request body
+    :param x_request_timeout: the timeout of the client in seconds. The work of the request is dropped after it
+    :return: The img url and the captions/answers of the most relevant images of each query, or the fields each query
+    asked for
+    """
+    queries = request_body.queries
+    max_queries = configurations["base_searcher"].batching.max_queries_per_request
+    if len(queries) > max_queries:
+        raise ValueError(f"A batch request can contain at most {max_queries} queries, got {len(queries)}")
+    searcher = searchers["base_searcher"]
+    deadline = request_deadline(x_request_timeout)
+    texts = [query.text for query in queries]
+    vectors_to_search = [query.vector_to_search for query in queries]
+    top_ks = [query.k if query.k is not None else DEFAULT_TOP_K for query in queries]
+    filters = [search_filter(query) for query in queries]
+    fields = [resolve_fields(query.fields) for query in queries]
+    if searcher.async_search:
+        for vector_to_search in set(vectors_to_search):
+            searcher.check_vector_name(vector_to_search)  # fail fast, before embedding the queries
+        text_features = await executors["base_searcher"].run("embed", partial(searcher.embed_texts, texts),
+                                                             deadline=deadline)
+        responses = await await_with_deadline("search", searcher.search_batch_async(text_features=text_features,
+                                                                                    vectors_to_search=vectors_to_search,
+                                                                                    top_ks=top_ks,
+                                                                                    filters=filters,
+                                                                                    fields=[list(selected) for selected
+                                                                                            in fields]),
+                                              deadline=deadline)
+    else:
+        responses = await executors["base_searcher"].run("query_batch", partial(searcher.query_batch,
+                                                                                texts=texts,
+                                                                                vectors_to_search=vectors_to_search,
+                                                                                top_ks=top_ks,
+                                                                                filters=filters,
+                                                                                fields=[list(selected) for selected
+                                                                                        in fields]),
+                                                         deadline=deadline)
+    with track_stage("build_response"):
+        return json_response([build_replies(response, selected) for response, selected in zip(responses, fields)])
 
 
 @router.get(
     "/get_image",
     response_class=FileResponse,
-    response_description="Returns an image based on its url"
+    response_description="Returns an image, or one of its thumbnails, based on its url"
 )
-def get_image(img_url: str) -> FileResponse:
+async def get_image(img_url: str,
+                    size: Optional[int] = None,
+                    if_none_match: Optional[str] = Header(default=None)) -> Response:
     """
-    Given an img url, save it locally and then display it
+    Given an img url, stream it from the on-disk cache or from its host, caching it on the way
     :param img_url: the img url
+    :param size: the maximum width/height of a thumbnail of the image, one of image_proxy.thumbnail_sizes. If it is
+    not defined, the original image is returned
+    :param if_none_match: the ETag of the copy cached by the client, if any. A 304 is returned if it is still valid
     :return: the image itself
     """
-    image = Image.open(requests.get(img_url, stream=True).raw)
-    image.save("tmp.jpeg")
-    return FileResponse(path="tmp.jpeg")
+    return await image_proxies["base_searcher"].get(img_url=img_url, size=size, if_none_match=if_none_match)
+
+
+def get_profiler():
+    """
+    :return: the sampling profiler of the worker, if it is enabled
+    """
+    profiler = profilers.get("base_searcher")
+    if profiler is None:
+        raise ValueError("The profiler is disabled, enable it in the 'profiling' section of the configuration")
+    return profiler
+
+
+@router.post(
+    "/admin/profile",
+    response_class=PlainTextResponse,
+    response_description="Starts sampling the stacks of the worker that serves it, until the given number of "
+                         "requests has completed"
+)
+def start_profile(requests: int = 100) -> str:
+    """
+    Start capturing a profile of the worker that serves this request. Each gunicorn worker is profiled separately
+    :param requests: the number of requests to capture
+    :return: a confirmation message
+    """
+    get_profiler().start(requests=requests)
+    return f"Profiling the next {requests} requests"
+
+
+@router.get(
+    "/admin/profile",
+    response_class=PlainTextResponse,
+    response_description="Returns the last captured profile as collapsed stacks"
+)
+def get_profile() -> str:
+    """
+    Return the profile of the worker that serves this request, in the collapsed stacks format of flamegraph.pl
+    :return: the collapsed stacks
+    """
+    return get_profiler().collapsed_stacks()
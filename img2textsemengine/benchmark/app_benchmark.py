@@ -0,0 +1,63 @@
+import asyncio
+import time
+from typing import Any
+import httpx
+from img2textsemengine.api import batchers, configurations, executors, searchers
+from img2textsemengine.api.batcher import QueryEmbeddingBatcher
+from img2textsemengine.api.config import Config
+from img2textsemengine.api.executor import InferenceExecutor
+from img2textsemengine.api.main import app
+from img2textsemengine.benchmark.report import latency_summary
+from img2textsemengine.vector_db.searcher import Searcher
+
+
+async def benchmark_app_query(searcher: Searcher,
+                              configs: Config,
+                              texts: list[str],
+                              vector_to_search: str,
+                              top_k: int,
+                              concurrency: int) -> dict[str, Any]:
+    """
+    Measure the /query route of the FastAPI app in process, through an ASGI client, so the routing, the validation,
+    the micro-batcher, the executor and the serialization are included but the network is not. The lifespan of the app
+    does not run: the given searcher, an executor and a batcher are injected in its globals instead
+    :param searcher: the searcher that serves the route
+    :param configs: the configuration of the service, for the batcher and the executor
+    :param texts: the text queries, one request each
+    :param vector_to_search: the vector column to search
+    :param top_k: the number of results of each query
+    :param concurrency: the number of requests in flight
+    :return: the latency summary of the requests and the requests per second
+    """
+    executor = InferenceExecutor(workers=configs.executor.workers, max_queue_size=configs.executor.max_queue_size,
+                                 retry_after_seconds=configs.executor.retry_after_seconds)
+    batcher = QueryEmbeddingBatcher(embed_fn=searcher.embed_texts, executor=executor,
+                                    max_batch_size=configs.batching.max_batch_size,
+                                    max_wait_ms=configs.batching.max_wait_ms,
+                                    max_queued_queries=configs.batching.max_queued_queries)
+    await batcher.start()
+    searchers["base_searcher"], executors["base_searcher"], batchers["base_searcher"] = searcher, executor, batcher
+    configurations["base_searcher"] = configs
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(client: httpx.AsyncClient, text: str) -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/query", json={"text": text, "vector_to_search": vector_to_search,
+                                                         "k": top_k})
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+            start = time.perf_counter()
+            latencies = await asyncio.gather(*(run(client, text) for text in texts))
+            wall_seconds = time.perf_counter() - start
+    finally:
+        await batcher.stop()
+        executor.shutdown()
+        batchers.clear()
+        executors.clear()
+        configurations.clear()
+        searchers.clear()
+    return {"total": latency_summary(list(latencies)), "qps": round(len(texts) / wall_seconds, 2)}
@@ -0,0 +1,97 @@
+import json
+import random
+import time
+from io import BytesIO
+from typing import Any
+import numpy as np
+import requests
+from PIL import Image
+from requests.adapters import BaseAdapter
+from img2textsemengine.benchmark.search_benchmark import synthetic_queries
+from img2textsemengine.vector_db.qdrant_util import Importer
+
+SYNTHETIC_HOST = "http://benchmark.local/"
+
+
+class SyntheticImageAdapter(BaseAdapter):
+    """
+    A requests adapter that answers every request with the same random JPEG, so the Importer can be benchmarked
+    offline. The download stage then measures the decoding of the images, not the network
+    """
+    def __init__(self, width: int = 640, height: int = 480, seed: int = 0):
+        """
+        :param width: the width of the image, the size of the COCO images by default
+        :param height: the height of the image
+        :param seed: the seed of the pixels
+        """
+        super().__init__()
+        pixels = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        output = BytesIO()
+        Image.fromarray(pixels).save(output, format="JPEG", quality=90)
+        self.content = output.getvalue()
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.content
+        response.headers["Content-Type"] = "image/jpeg"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+def write_synthetic_dataset(path: str, count: int, captions_per_image: int = 5, seed: int = 0) -> None:
+    """
+    Write a jsonl dataset with the fields the Importer reads
+    :param path: the output file
+    :param count: the number of records
+    :param captions_per_image: the number of captions of each record
+    :param seed: the seed of the captions
+    :return: None
+    """
+    captions = synthetic_queries(count * captions_per_image, seed=seed)
+    random.Random(seed).shuffle(captions)
+    with open(path, "w", encoding="utf-8") as dataset_file:
+        for index in range(count):
+            dataset_file.write(json.dumps({
+                "coco_url": f"{SYNTHETIC_HOST}{index}.jpg",
+                "answer": captions[index * captions_per_image:(index + 1) * captions_per_image]}) + "\n")
+
+
+def benchmark_import(hf_model: str,
+                     dataset_path: str,
+                     batch_size: int = 32,
+                     download_workers: int = 16,
+                     queue_depth: int = 128,
+                     upsert_batch_size: int = 256,
+                     embedding_workers: int = 1) -> dict[str, Any]:
+    """
+    Measure the throughput of a full import into an in-memory QDrant collection, with synthetic images
+    :param hf_model: the CLIP model of the Importer
+    :param dataset_path: the jsonl dataset, e.g. written by write_synthetic_dataset
+    :param batch_size: the number of records embedded in a single forward pass
+    :param download_workers: the number of concurrent downloads
+    :param queue_depth: the maximum number of downloaded records waiting to be embedded
+    :param upsert_batch_size: the number of points per upsert request
+    :param embedding_workers: the number of processes that embed the images
+    :return: the imported points, the points per second, and the busy time and throughput of every stage
+    """
+    importer = Importer(host=":memory:", port=6333, collection_name="benchmark", image_vector_size=512,
+                        hf_model=hf_model, dataset_path=dataset_path, batch_size=batch_size,
+                        download_workers=download_workers, queue_depth=queue_depth,
+                        upsert_batch_size=upsert_batch_size, embedding_workers=embedding_workers)
+    importer.http_session.mount(SYNTHETIC_HOST, SyntheticImageAdapter())
+    start = time.perf_counter()
+    stats = importer.import_data(caption_payload_name="possible_answers")
+    wall_seconds = time.perf_counter() - start
+    return {"points": stats["upsert"].items,
+            "seconds": round(wall_seconds, 3),
+            "points_per_second": round(stats["upsert"].items / wall_seconds, 2),
+            "stages": {name: {"items": stage.items,
+                              "busy_seconds": round(stage.busy_seconds, 3),
+                              "items_per_busy_second": round(stage.items / stage.busy_seconds, 2)
+                              if stage.busy_seconds else 0.0}
+                       for name, stage in stats.items()}}
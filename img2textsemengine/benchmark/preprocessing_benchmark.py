@@ -0,0 +1,95 @@
+import time
+from io import BytesIO
+from typing import Any
+import numpy as np
+import torch
+from PIL import Image, ImageDraw, ImageFilter
+from transformers import AutoProcessor, CLIPModel
+from img2textsemengine.vector_db.encoders import compare_embeddings
+from img2textsemengine.vector_db.image_preprocessing import ImagePreprocessor
+
+# the sizes of some COCO images, landscape and portrait
+_COCO_SIZES = ((640, 480), (640, 427), (480, 640), (500, 375), (427, 640), (640, 512))
+
+
+def synthetic_photos(count: int, seed: int = 0) -> list[bytes]:
+    """
+    Encode photo-like jpegs: smooth gradients, blurred shapes and a little sensor noise. Unlike random pixels they
+    have the spectrum of a photo, which decides how much a reduced-scale decoding loses
+    :param count: the number of images
+    :param seed: the seed of the images
+    :return: the encoded images, with the sizes of COCO images
+    """
+    rng = np.random.default_rng(seed)
+    photos = []
+    for index in range(count):
+        width, height = _COCO_SIZES[index % len(_COCO_SIZES)]
+        y, x = np.mgrid[0:height, 0:width]
+        colors = rng.uniform(0, 255, (3, 3))
+        gradient = colors[0] * (x / width)[..., None] + colors[1] * (y / height)[..., None] + colors[2] * 0.5
+        image = Image.fromarray(np.clip(gradient / 2, 0, 255).astype(np.uint8))
+        draw = ImageDraw.Draw(image)
+        for _ in range(30):
+            left, top = int(rng.integers(0, width)), int(rng.integers(0, height))
+            draw.ellipse([left, top, left + int(rng.integers(10, 200)), top + int(rng.integers(10, 200))],
+                         fill=tuple(int(channel) for channel in rng.integers(0, 256, 3)))
+        pixels = np.asarray(image.filter(ImageFilter.GaussianBlur(1.5)), dtype=np.int16)
+        pixels = np.clip(pixels + rng.integers(-8, 9, pixels.shape), 0, 255).astype(np.uint8)
+        output = BytesIO()
+        Image.fromarray(pixels).save(output, format="JPEG", quality=90)
+        photos.append(output.getvalue())
+    return photos
+
+
+def benchmark_preprocessing(hf_model: str,
+                            contents: list[bytes],
+                            batch_size: int = 32,
+                            with_embeddings: bool = True) -> dict[str, Any]:
+    """
+    Compare the image processor of the model with the fast preprocessing, with and without the reduced-scale decoding.
+    Each one decodes and preprocesses the same images in batches, on the calling thread
+    :param hf_model: the clip model
+    :param contents: the encoded images
+    :param batch_size: the number of images normalized together
+    :param with_embeddings: whether to also compare the image embeddings of the pixel values
+    :return: for each preprocessing, the milliseconds per image and the differences from the image processor: the
+    maximum and mean absolute difference of the pixel values and, optionally, the cosine similarity of the embeddings
+    """
+    processor = AutoProcessor.from_pretrained(hf_model)
+
+    def reference(batch: list[bytes]) -> np.ndarray:
+        images = [Image.open(BytesIO(content)).convert("RGB") for content in batch]
+        return processor(images=images, return_tensors="np")["pixel_values"]
+
+    runs = {"processor": reference}
+    for name, draft in (("fast", False), ("fast_draft", True)):
+        preprocessor = ImagePreprocessor(hf_model=hf_model, draft=draft)
+        runs[name] = lambda batch, preprocessor=preprocessor: preprocessor.pixel_values(
+            [preprocessor.load(content) for content in batch])
+
+    pixel_values, results = {}, {}
+    for name, run in runs.items():
+        run(contents[:batch_size])  # warm up
+        start = time.perf_counter()
+        pixel_values[name] = np.concatenate([run(contents[offset:offset + batch_size])
+                                             for offset in range(0, len(contents), batch_size)])
+        results[name] = {"ms_per_image": round((time.perf_counter() - start) * 1000 / len(contents), 3)}
+    for name, values in pixel_values.items():
+        difference = np.abs(values - pixel_values["processor"])
+        speedup = results["processor"]["ms_per_image"] / results[name]["ms_per_image"]
+        results[name].update({"speedup": round(speedup, 2),
+                              "max_abs_pixel_diff": float(difference.max()),
+                              "mean_abs_pixel_diff": float(difference.mean())})
+
+    if with_embeddings:
+        model = CLIPModel.from_pretrained(hf_model)
+        model.eval()
+        with torch.inference_mode():
+            embeddings = {name: np.concatenate([model.get_image_features(
+                pixel_values=torch.from_numpy(values[offset:offset + batch_size])).numpy()
+                for offset in range(0, len(values), batch_size)]) for name, values in pixel_values.items()}
+        for name, values in embeddings.items():
+            cosine = compare_embeddings(embeddings["processor"], values)
+            results[name].update({"min_cosine": round(float(cosine.min()), 6),
+                                  "mean_cosine": round(float(cosine.mean()), 6)})
+    return results
@@ -0,0 +1,76 @@
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Any, Optional
+import numpy as np
+
+
+def latency_summary(seconds: list[float]) -> dict[str, float]:
+    """
+    :param seconds: the latencies of the measured calls, in seconds
+    :return: the count, the mean, the p50/p95/p99 and the max of the latencies, in milliseconds
+    """
+    if not seconds:
+        return {"count": 0}
+    milliseconds = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {"count": len(seconds),
+            "mean_ms": round(float(milliseconds.mean()), 3),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(float(milliseconds.max()), 3)}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(results: dict[str, Any], parameters: dict[str, Any], path: str) -> dict[str, Any]:
+    """
+    Write the results of a benchmark run as JSON, together with what is needed to compare it with another run
+    :param results: the results of each benchmark
+    :param parameters: the parameters of the run
+    :param path: the output file
+    :return: the written report
+    """
+    report = {"commit": _git_commit(),
+              "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+              "python": platform.python_version(),
+              "machine": platform.machine(),
+              "cpu_count": os.cpu_count(),
+              "parameters": parameters,
+              "results": results}
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+    return report
+
+
+def compare_reports(baseline: dict[str, Any], current: dict[str, Any], metric: str = "p95_ms") -> dict[str, float]:
+    """
+    Compare a latency percentile of two reports
+    :param baseline: the report of the reference run
+    :param current: the report of the run to check
+    :param metric: the latency summary field to compare
+    :return: the current/baseline ratio of the metric, for every latency found in both reports. A ratio above 1 is a
+    regression
+    """
+    def flatten(results: dict[str, Any], prefix: str = "") -> dict[str, float]:
+        values = {}
+        for name, value in results.items():
+            if isinstance(value, dict) and metric in value:
+                values[f"{prefix}{name}"] = value[metric]
+            elif isinstance(value, dict):
+                values.update(flatten(value, prefix=f"{prefix}{name}."))
+        return values
+
+    baseline_values, current_values = flatten(baseline["results"]), flatten(current["results"])
+    return {name: round(current_values[name] / baseline_values[name], 3)
+            for name in sorted(baseline_values.keys() & current_values.keys()) if baseline_values[name]}
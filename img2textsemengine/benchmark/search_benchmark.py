@@ -0,0 +1,144 @@
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from img2textsemengine.api.routes import build_replies, json_response
+from img2textsemengine.benchmark.report import latency_summary
+from img2textsemengine.dataset.sample_file import iter_records
+from img2textsemengine.vector_db.collection import VECTOR_NAMES, build_vectors_config
+from img2textsemengine.vector_db.collection_meta import write_collection_meta
+from img2textsemengine.vector_db.payload_filter import resolve_fields
+from img2textsemengine.vector_db.searcher import Searcher
+
+PHASES = ("tokenize", "encode", "search", "serialize")
+_WORDS = ("a", "the", "man", "woman", "dog", "cat", "red", "blue", "bicycle", "clock", "street", "table", "pizza",
+          "sitting", "riding", "on", "next", "to", "with", "of", "playing", "beach", "kitchen", "train", "bus",
+          "small", "large", "white", "black", "group", "people", "field", "standing", "holding", "plate", "sky")
+
+
+def synthetic_queries(count: int, seed: int = 0) -> list[str]:
+    """
+    :param count: the number of queries
+    :param seed: the seed of the generator, so two runs send the same queries
+    :return: caption-like text queries
+    """
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(_WORDS, k=rng.randint(3, 12))) for _ in range(count)]
+
+
+def dataset_queries(dataset_path: str, count: int) -> list[str]:
+    """
+    :param dataset_path: the parquet or jsonl sample of the dataset
+    :param count: the number of queries, the captions are repeated if there are fewer
+    :return: the captions of the dataset, used as text queries
+    """
+    captions = [answer.strip() for _, record in iter_records(dataset_path) for answer in record["answer"]]
+    return [captions[index % len(captions)] for index in range(count)]
+
+
+def load_synthetic_collection(qdrant_client: QdrantClient,
+                              collection_name: str,
+                              count: int,
+                              vector_size: int = 512,
+                              seed: int = 0,
+                              batch_size: int = 1024) -> int:
+    """
+    (Re)create a collection with random named vectors, the same for a given seed
+    :param qdrant_client: the qdrant client, typically an in-memory one
+    :param collection_name: the collection to create
+    :param count: the number of points
+    :param vector_size: the size of every named vector
+    :param seed: the seed of the vectors
+    :param batch_size: the number of points per upsert request
+    :return: the number of points
+    """
+    qdrant_client.recreate_collection(collection_name=collection_name,
+                                      vectors_config=build_vectors_config({name: vector_size for name in VECTOR_NAMES}))
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        vectors = {name: rng.standard_normal((size, vector_size), dtype=np.float32).tolist() for name in VECTOR_NAMES}
+        qdrant_client.upsert(collection_name=collection_name, points=[
+            models.PointStruct(id=start + row,
+                               vector={name: vectors[name][row] for name in VECTOR_NAMES},
+                               payload={"img_url": f"http://benchmark.local/{start + row}.jpg",
+                                        "possible_answers": [f"synthetic caption {start + row}"] * 5})
+            for row in range(size)])
+    write_collection_meta(qdrant_client, collection_name, version=uuid.uuid4().hex, updated_at=time.time())
+    return count
+
+
+def run_concurrently(func: Callable[[Any], Any], items: Iterable, concurrency: int) -> tuple[list, float]:
+    """
+    :param func: the call to measure
+    :param items: the argument of each call
+    :param concurrency: the number of threads issuing the calls
+    :return: the results of the calls, in the input order, and the wall clock duration of all of them
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(func, items))
+    return results, time.perf_counter() - start
+
+
+def benchmark_searcher_phases(searcher: Searcher,
+                              texts: list[str],
+                              vector_to_search: str,
+                              top_k: int,
+                              concurrency: int) -> dict[str, Any]:
+    """
+    Measure every phase of a query, as the /query route runs it: tokenize and encode the text, search the vector
+    backend, and serialize the response
+    :param searcher: the searcher to measure
+    :param texts: the text queries, one call each
+    :param vector_to_search: the vector column to search
+    :param top_k: the number of results of each query
+    :param concurrency: the number of concurrent queries
+    :return: the latency summary of every phase and of the whole query, and the queries per second
+    """
+    fields = resolve_fields(None)  # all the fields, as a query without fields
+
+    def run(text: str) -> dict[str, float]:
+        start = time.perf_counter()
+        inputs = searcher.text_encoder.tokenize([text])
+        tokenized = time.perf_counter()
+        text_features = searcher.text_encoder.encode(inputs)[0].tolist()
+        encoded = time.perf_counter()
+        response = searcher.search(text_features=text_features, vector_to_search=vector_to_search, top_k=top_k)
+        searched = time.perf_counter()
+        json_response(build_replies(response, fields))
+        serialized = time.perf_counter()
+        return {"tokenize": tokenized - start, "encode": encoded - tokenized, "search": searched - encoded,
+                "serialize": serialized - searched, "total": serialized - start}
+
+    timings, wall_seconds = run_concurrently(run, texts, concurrency)
+    results = {phase: latency_summary([timing[phase] for timing in timings]) for phase in PHASES + ("total",)}
+    results["qps"] = round(len(texts) / wall_seconds, 2)
+    return results
+
+
+def benchmark_searcher_query(searcher: Searcher,
+                             texts: list[str],
+                             vector_to_search: str,
+                             top_k: int,
+                             concurrency: int) -> dict[str, Any]:
+    """
+    Measure Searcher.query end to end
+    :param searcher: the searcher to measure
+    :param texts: the text queries, one call each
+    :param vector_to_search: the vector column to search
+    :param top_k: the number of results of each query
+    :param concurrency: the number of concurrent queries
+    :return: the latency summary of the queries and the queries per second
+    """
+    def run(text: str) -> float:
+        start = time.perf_counter()
+        searcher.query(text=text, vector_to_search=vector_to_search, top_k=top_k)
+        return time.perf_counter() - start
+
+    latencies, wall_seconds = run_concurrently(run, texts, concurrency)
+    return {"total": latency_summary(latencies), "qps": round(len(texts) / wall_seconds, 2)}
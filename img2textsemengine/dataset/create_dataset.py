@@ -1,23 +1,147 @@
-import json
+import logging
+import multiprocessing
+from typing import Iterable, Optional
+import numpy as np
 from tqdm import tqdm
 from datasets import load_dataset
+from datasets.distributed import split_dataset_by_node
+from img2textsemengine.dataset.sample_file import write_sample
 
+logger = logging.getLogger(__name__)
+
+# head: the first records of the stream. reservoir: a uniform sample of exactly limit records of the whole stream.
+# bernoulli: every record is kept with the same probability, independently
+SAMPLING_METHODS = ("head", "reservoir", "bernoulli")
 
-def sample_coco_dataset(hf_card: str,
-                        limit: int,
-                        sample_path) -> None:
-    """
 
-    :param hf_card:
-    :param limit:
-    :param sample_path:
-    :return:
+def sample_stream(records: Iterable[dict],
+                  method: str,
+                  limit: Optional[int],
+                  fraction: Optional[float],
+                  rng: np.random.Generator) -> tuple[list[dict], int]:
     """
-    dataset = load_dataset(hf_card, streaming=True, split="val")
-    with open(sample_path, "w") as sample_file:
-        for index, record in tqdm(enumerate(dataset), total=limit):
-            if index <= limit:
-                record.pop("image", None)
-                sample_file.write(json.dumps(record) + "\n")
-            else:
+    Sample a stream of records in a single pass
+    :param records: the stream
+    :param method: one of SAMPLING_METHODS
+    :param limit: the maximum number of sampled records, required by the head and reservoir methods
+    :param fraction: the probability to keep a record, required by the bernoulli method
+    :param rng: the random generator of the reservoir and bernoulli methods
+    :return: the sampled records, in stream order except for the reservoir, and the number of records read
+    """
+    sample = []
+    seen = 0
+    if method == "head":
+        for seen, record in enumerate(records, start=1):
+            sample.append(record)
+            if len(sample) >= limit:
                 break
+    elif method == "reservoir":
+        # algorithm R: the i-th record replaces a random slot of a full reservoir with probability limit / i
+        for seen, record in enumerate(records, start=1):
+            if len(sample) < limit:
+                sample.append(record)
+            else:
+                slot = rng.integers(seen)
+                if slot < limit:
+                    sample[slot] = record
+    elif method == "bernoulli":
+        for seen, record in enumerate(records, start=1):
+            if rng.random() < fraction:
+                sample.append(record)
+                if limit is not None and len(sample) >= limit:
+                    break
+    else:
+        raise ValueError(f"Unknown sampling method '{method}', it must be one of {SAMPLING_METHODS}")
+    return sample, seen
+
+
+def merge_samples(samples: list[tuple[list[dict], int]],
+                  method: str,
+                  limit: Optional[int],
+                  rng: np.random.Generator) -> list[dict]:
+    """
+    Merge the samples of disjoint shards of the stream into a sample of the whole stream
+    :param samples: the sample of each shard and the number of records the shard has read
+    :param method: the sampling method of the shards
+    :param limit: the maximum number of records of the merged sample
+    :param rng: the random generator that merges reservoirs
+    :return: the merged sample
+    """
+    if method != "reservoir" or len(samples) == 1:
+        merged = [record for sample, _ in samples for record in sample]
+        return merged if limit is None else merged[:limit]
+    # each shard contributes as many records as a uniform sample of the union would draw from it, so the merge of
+    # uniform samples of the shards is a uniform sample of the whole stream
+    seen = np.asarray([shard_seen for _, shard_seen in samples], dtype=np.int64)
+    counts = rng.multivariate_hypergeometric(seen, min(limit, int(seen.sum())))
+    merged = []
+    for (sample, _), count in zip(samples, counts):
+        merged.extend(sample[index] for index in sorted(rng.choice(len(sample), size=count, replace=False)))
+    return merged
+
+
+def _sample_shard(hf_card: str,
+                  split: str,
+                  rank: int,
+                  world_size: int,
+                  method: str,
+                  limit: Optional[int],
+                  fraction: Optional[float],
+                  seed: int) -> tuple[list[dict], int]:
+    """
+    Sample the shard of the stream of a worker process. The image column is dropped before the records are decoded
+    :return: the sample of the shard and the number of records it has read
+    """
+    dataset = load_dataset(hf_card, streaming=True, split=split)
+    if "image" in (dataset.column_names or []):
+        dataset = dataset.remove_columns("image")
+    if world_size > 1:
+        # the workers read disjoint files of the dataset when their number divides the number of files, otherwise each
+        # one reads every file and keeps one record out of world_size
+        dataset = split_dataset_by_node(dataset, rank=rank, world_size=world_size)
+    rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(world_size)[rank])
+    records = tqdm(dataset, desc=f"shard {rank}", position=rank, total=limit if method == "head" else None)
+    return sample_stream(records, method=method, limit=limit, fraction=fraction, rng=rng)
+
+
+def sample_coco_dataset(hf_card: str,
+                        limit: Optional[int],
+                        sample_path: str,
+                        method: str = "head",
+                        fraction: Optional[float] = None,
+                        seed: int = 0,
+                        num_proc: int = 1,
+                        split: str = "val",
+                        row_group_size: int = 10_000) -> int:
+    """
+    Stream a huggingface dataset, sample its records without their images and write them to a parquet file
+    :param hf_card: the dataset card in the huggingface hub
+    :param limit: the maximum number of sampled records, required by the head and reservoir methods
+    :param sample_path: the parquet file of the sample
+    :param method: 'head' for the first records, 'reservoir' for a uniform sample of exactly limit records, or
+    'bernoulli' to keep every record with probability fraction
+    :param fraction: the probability to keep a record, used by the bernoulli method
+    :param seed: the seed of the reservoir and bernoulli methods, the same seed gives the same sample
+    :param num_proc: the number of processes, each one streaming and sampling a shard of the dataset
+    :param split: the split of the dataset
+    :param row_group_size: the number of records per row group of the parquet file
+    :return: the number of sampled records
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method '{method}', it must be one of {SAMPLING_METHODS}")
+    if method in ("head", "reservoir") and not limit:
+        raise ValueError(f"The '{method}' sampling method requires a limit")
+    if method == "bernoulli" and not (fraction and 0 < fraction <= 1):
+        raise ValueError("The 'bernoulli' sampling method requires a fraction in (0, 1]")
+    shard_args = [(hf_card, split, rank, num_proc, method, limit, fraction, seed) for rank in range(num_proc)]
+    if num_proc == 1:
+        samples = [_sample_shard(*shard_args[0])]
+    else:
+        with multiprocessing.get_context("spawn").Pool(num_proc) as pool:
+            samples = pool.starmap(_sample_shard, shard_args)
+    sample = merge_samples(samples, method=method, limit=limit,
+                           rng=np.random.default_rng(np.random.SeedSequence(seed).spawn(num_proc + 1)[-1]))
+    written = write_sample(sample, sample_path, row_group_size=row_group_size)
+    logger.info("Sampled %d of the %d records read with the '%s' method into %s", written,
+                sum(seen for _, seen in samples), method, sample_path)
+    return written
@@ -0,0 +1,81 @@
+import itertools
+import json
+import os
+from typing import Iterable, Iterator
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# A sample of the dataset is a parquet file written in row groups, read back one batch at a time from a memory map, so
+# neither the sampler nor the Importer holds more than a batch of records as python objects. JSONL samples, the format
+# of the older samples, are still read line by line.
+
+
+def write_sample(records: Iterable[dict], path: str, row_group_size: int = 10_000) -> int:
+    """
+    Write records to a parquet file, one row group per row_group_size records
+    :param records: the records, with the same fields
+    :param path: the parquet file
+    :param row_group_size: the number of records per row group
+    :return: the number of written records
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    records = iter(records)
+    writer = None
+    written = 0
+    try:
+        while chunk := list(itertools.islice(records, row_group_size)):
+            table = pa.Table.from_pylist(chunk, schema=writer.schema if writer is not None else None)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table, row_group_size=row_group_size)
+            written += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:  # no records, an empty file is still a valid sample
+        pq.write_table(pa.table({}), path)
+    return written
+
+
+def count_records(path: str) -> int:
+    """
+    :param path: a parquet or jsonl sample
+    :return: the number of records of the sample, read from the parquet metadata without scanning the rows
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as sample_file:
+            return sum(1 for line in sample_file if line.strip())
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def iter_records(path: str, start_index: int = 0, batch_size: int = 1024) -> Iterator[tuple[int, dict]]:
+    """
+    Stream the records of a sample
+    :param path: a parquet or jsonl sample
+    :param start_index: the index of the first record, the row groups before it are not read
+    :param batch_size: the number of records converted to python objects at a time
+    :return: the (index, record) pairs of the sample, in order
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as sample_file:
+            lines = (line for line in sample_file if line.strip())
+            for index, line in enumerate(itertools.islice(lines, start_index, None), start=start_index):
+                yield index, json.loads(line)
+        return
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    first_row = 0
+    row_groups = []
+    for row_group in range(parquet_file.num_row_groups):
+        rows = parquet_file.metadata.row_group(row_group).num_rows
+        if row_groups or first_row + rows > start_index:
+            row_groups.append(row_group)
+        else:
+            first_row += rows
+    if not row_groups:
+        return
+    index = first_row
+    for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups):
+        skip = min(max(start_index - index, 0), batch.num_rows)
+        yield from enumerate(batch.slice(skip).to_pylist(), start=index + skip)
+        index += batch.num_rows
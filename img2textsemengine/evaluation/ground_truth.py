@@ -0,0 +1,74 @@
+from typing import NamedTuple
+import numpy as np
+from qdrant_client import QdrantClient
+
+
+class StoredVectors(NamedTuple):
+    """
+    The points of a collection, in scroll order: the position of a point is its id in the evaluation
+    """
+    img_urls: list[str]
+    captions: list[list[str]]
+    vectors: np.ndarray  # L2-normalized float32, one row per point
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def load_stored_vectors(qdrant_client: QdrantClient,
+                        collection_name: str,
+                        vector_name: str,
+                        caption_payload_name: str = "possible_answers",
+                        batch_size: int = 1024) -> StoredVectors:
+    """
+    Scroll through a collection and load one of its named vectors in memory, together with the url and the captions of
+    each image
+    :param qdrant_client: the qdrant client
+    :param collection_name: the collection to load
+    :param vector_name: the named vector to load
+    :param caption_payload_name: the payload field that stores the captions/answers
+    :param batch_size: the number of points per scroll request
+    :return: the stored points
+    """
+    img_urls, captions, vectors = [], [], []
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(collection_name=collection_name,
+                                              limit=batch_size,
+                                              offset=offset,
+                                              with_payload=["img_url", caption_payload_name],
+                                              with_vectors=[vector_name])
+        for point in points:
+            img_urls.append(point.payload["img_url"])
+            captions.append(point.payload.get(caption_payload_name) or [])
+            vectors.append(point.vector[vector_name])
+        if offset is None:
+            break
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    return StoredVectors(img_urls=img_urls, captions=captions, vectors=_normalize(matrix))
+
+
+def exact_top_k(queries: np.ndarray, vectors: np.ndarray, k: int, chunk_rows: int = 256) -> np.ndarray:
+    """
+    Brute-force cosine top-k of every query over all the stored vectors. The queries are scored a chunk at a time, so
+    the score matrix of a chunk, chunk_rows x stored vectors, bounds the memory
+    :param queries: the query embeddings, one row per query
+    :param vectors: the L2-normalized stored vectors, one row per point
+    :param k: the number of results per query
+    :param chunk_rows: the number of queries scored together
+    :return: the positions of the top-k points of each query, best first, shape (queries, k). When the collection has
+    fewer than k points the missing results are -1
+    """
+    queries = _normalize(np.asarray(queries, dtype=np.float32))
+    top_k = np.full((len(queries), k), -1, dtype=np.int64)
+    limit = min(k, len(vectors))
+    if limit == 0:
+        return top_k
+    for start in range(0, len(queries), chunk_rows):
+        scores = queries[start:start + chunk_rows] @ vectors.T
+        top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+        top_k[start:start + chunk_rows, :limit] = np.take_along_axis(top, order, axis=1)
+    return top_k
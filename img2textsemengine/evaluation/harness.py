@@ -0,0 +1,113 @@
+import logging
+import time
+from typing import Any, Optional
+import numpy as np
+from img2textsemengine.benchmark.report import latency_summary
+from img2textsemengine.evaluation.ground_truth import StoredVectors, exact_top_k, load_stored_vectors
+from img2textsemengine.evaluation.metrics import mrr, ndcg_at_k, overlap_at_k, recall_at_k, relevance_matrix
+from img2textsemengine.vector_db.searcher import Searcher
+
+logger = logging.getLogger(__name__)
+
+
+def caption_queries(stored: StoredVectors,
+                    max_queries: Optional[int] = None,
+                    seed: int = 0) -> tuple[list[str], np.ndarray]:
+    """
+    Use every stored caption as a query whose only relevant result is its own image
+    :param stored: the stored points
+    :param max_queries: the maximum number of queries, a seeded sample of the captions. None for all of them
+    :param seed: the seed of the sample
+    :return: the text of each query and the position of its image
+    """
+    texts = [caption.strip() for captions in stored.captions for caption in captions]
+    targets = np.asarray([position for position, captions in enumerate(stored.captions) for _ in captions],
+                         dtype=np.int64)
+    if max_queries is not None and max_queries < len(texts):
+        sample = np.sort(np.random.default_rng(seed).choice(len(texts), size=max_queries, replace=False))
+        texts, targets = [texts[index] for index in sample], targets[sample]
+    return texts, targets
+
+
+def retrieval_metrics(retrieved: np.ndarray, targets: np.ndarray, k: int) -> dict[str, float]:
+    """
+    :param retrieved: the positions of the results of each query, shape (queries, k)
+    :param targets: the position of the relevant image of each query
+    :param k: the number of results per query
+    :return: the recall@k, the MRR and the NDCG@k of the queries, with their own image as the only relevant result
+    """
+    relevance = relevance_matrix(retrieved, targets)
+    ones = np.ones(len(targets), dtype=np.int64)
+    return {f"recall@{k}": round(recall_at_k(relevance, ones), 5),
+            f"mrr@{k}": round(mrr(relevance), 5),
+            f"ndcg@{k}": round(ndcg_at_k(relevance, ones), 5)}
+
+
+def evaluate(searcher: Searcher,
+             vector_name: str,
+             k: int = 10,
+             batch_size: int = 64,
+             max_queries: Optional[int] = None,
+             seed: int = 0,
+             search_settings: Optional[list[dict[str, Any]]] = None,
+             caption_payload_name: str = "possible_answers") -> dict[str, Any]:
+    """
+    Evaluate the searches of one named vector of the collection. The captions stored in the collection are embedded
+    as queries in batches, their exact top-k is computed by brute force over the stored vectors, and the same queries
+    are searched through the searcher in batches, once per search setting. The result cache of the searcher should be
+    disabled, otherwise the repeated searches are not measured
+    :param searcher: the searcher to evaluate
+    :param vector_name: the named vector to search
+    :param k: the number of results per query
+    :param batch_size: the number of queries embedded, and searched, together
+    :param max_queries: the maximum number of queries, None for every caption of the collection
+    :param seed: the seed of the sample of the queries
+    :param search_settings: the hnsw_ef, oversampling and rescore of each run of the searches, None for a single run
+    with the defaults of the searcher
+    :param caption_payload_name: the payload field that stores the captions/answers
+    :return: the metrics of the exact search and, for each setting, the metrics and the latencies of the searcher
+    """
+    stored = load_stored_vectors(searcher.qdrant_client, searcher.collection_name, vector_name,
+                                 caption_payload_name=caption_payload_name)
+    texts, targets = caption_queries(stored, max_queries=max_queries, seed=seed)
+    logger.info("Evaluating %d queries over %d '%s' vectors", len(texts), len(stored.img_urls), vector_name)
+
+    start = time.perf_counter()
+    embeddings = np.concatenate([np.asarray(searcher.embed_texts(texts[offset:offset + batch_size]), dtype=np.float32)
+                                 for offset in range(0, len(texts), batch_size)])
+    embed_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    # the queries are projected as the stored vectors when the collection stores reduced vectors
+    exact = exact_top_k(searcher.project(embeddings, vector_name), stored.vectors, k)
+    exact_seconds = time.perf_counter() - start
+    results = {"queries": len(texts),
+               "points": len(stored.img_urls),
+               "embed_ms_per_query": round(embed_seconds * 1000 / max(len(texts), 1), 3),
+               "exact": {**retrieval_metrics(exact, targets, k),
+                         "ms_per_query": round(exact_seconds * 1000 / max(len(texts), 1), 3)},
+               "searcher": []}
+
+    positions = {img_url: position for position, img_url in enumerate(stored.img_urls)}
+    features = embeddings.tolist()
+    for setting in search_settings or [{}]:
+        retrieved = np.full((len(texts), k), -1, dtype=np.int64)
+        latencies = []
+        start = time.perf_counter()
+        for offset in range(0, len(texts), batch_size):
+            batch = features[offset:offset + batch_size]
+            batch_start = time.perf_counter()
+            responses = searcher.search_batch(text_features=batch, vectors_to_search=[vector_name] * len(batch),
+                                              top_ks=[k] * len(batch), fields=[["img_url"]] * len(batch),
+                                              **setting)
+            # the latency of a query is its share of the batch, the latency of the request when batch_size is 1
+            latencies.extend([(time.perf_counter() - batch_start) / len(batch)] * len(batch))
+            for row, response in enumerate(responses, start=offset):
+                ranked = [positions.get(img_url, -1) for img_url, _ in response[:k]]
+                retrieved[row, :len(ranked)] = ranked
+        wall_seconds = time.perf_counter() - start
+        results["searcher"].append({"setting": setting,
+                                    **retrieval_metrics(retrieved, targets, k),
+                                    f"recall@{k}_vs_exact": round(overlap_at_k(retrieved, exact), 5),
+                                    "latency": latency_summary(latencies),
+                                    "qps": round(len(texts) / max(wall_seconds, 1e-9), 2)})
+    return results
@@ -0,0 +1,101 @@
+from typing import Optional
+import numpy as np
+
+# Every metric takes a relevance matrix with one row per query and one column per rank, best first: the relevance of
+# the result at that rank, 0 for an irrelevant or a missing result. The metrics of all the queries are computed with a
+# few array operations, so they scale to hundreds of thousands of queries
+
+
+def _discounts(k: int) -> np.ndarray:
+    """
+    :param k: the number of ranks
+    :return: the DCG discount of each rank, 1 / log2(rank + 1)
+    """
+    return 1.0 / np.log2(np.arange(2, k + 2))
+
+
+def relevance_matrix(retrieved: np.ndarray, relevant: np.ndarray) -> np.ndarray:
+    """
+    :param retrieved: the ids of the results of each query, shape (queries, k). Missing results are -1
+    :param relevant: the relevant ids of each query, shape (queries,) for a single relevant id per query or
+    (queries, r) for many. The -1 ids are never relevant
+    :return: the binary relevance matrix of the results
+    """
+    retrieved = np.asarray(retrieved)
+    relevant = np.asarray(relevant)
+    if relevant.ndim == 1:
+        relevant = relevant[:, None]
+    matches = (retrieved[:, :, None] == relevant[:, None, :]) & (retrieved[:, :, None] >= 0)
+    return matches.any(axis=2).astype(np.float64)
+
+
+def reciprocal_ranks(relevance: np.ndarray) -> np.ndarray:
+    """
+    :param relevance: the relevance matrix
+    :return: the inverse of the rank of the first relevant result of each query, 0 if none is relevant
+    """
+    relevant = np.asarray(relevance) > 0
+    first = relevant.argmax(axis=1)
+    return np.where(relevant.any(axis=1), 1.0 / (first + 1), 0.0)
+
+
+def mrr(relevance: np.ndarray) -> float:
+    """
+    :param relevance: the relevance matrix
+    :return: the mean reciprocal rank of the queries
+    """
+    return float(reciprocal_ranks(relevance).mean())
+
+
+def precision_at_k(relevance: np.ndarray) -> float:
+    """
+    :param relevance: the relevance matrix, with k columns
+    :return: the fraction of the top-k results that are relevant, over all the queries
+    """
+    return float((np.asarray(relevance) > 0).mean())
+
+
+def recall_at_k(relevance: np.ndarray, relevant_counts: np.ndarray) -> float:
+    """
+    :param relevance: the relevance matrix, with k columns
+    :param relevant_counts: the total number of relevant items of each query
+    :return: the mean fraction of the relevant items of a query found in its top-k results. The queries without any
+    relevant item are left out
+    """
+    relevant_counts = np.asarray(relevant_counts, dtype=np.float64)
+    found = (np.asarray(relevance) > 0).sum(axis=1)
+    has_relevant = relevant_counts > 0
+    if not has_relevant.any():
+        return 0.0
+    return float((found[has_relevant] / relevant_counts[has_relevant]).mean())
+
+
+def ndcg_at_k(relevance: np.ndarray, relevant_counts: Optional[np.ndarray] = None) -> float:
+    """
+    :param relevance: the relevance matrix, with k columns. The relevance may be graded
+    :param relevant_counts: the total number of relevant items of each query, for a binary relevance. The ideal
+    ranking puts min(count, k) of them on top. None to build the ideal ranking from the retrieved results only
+    :return: the mean normalized discounted cumulative gain of the queries, 0 for the queries without any relevant
+    item
+    """
+    relevance = np.asarray(relevance, dtype=np.float64)
+    discounts = _discounts(relevance.shape[1])
+    dcg = relevance @ discounts
+    if relevant_counts is None:
+        ideal = -np.sort(-relevance, axis=1) @ discounts
+    else:
+        ideal_hits = np.minimum(np.asarray(relevant_counts), relevance.shape[1])
+        ideal = np.concatenate([[0.0], np.cumsum(discounts)])[ideal_hits]
+    return float(np.divide(dcg, ideal, out=np.zeros_like(dcg), where=ideal > 0).mean())
+
+
+def overlap_at_k(retrieved: np.ndarray, reference: np.ndarray) -> float:
+    """
+    :param retrieved: the ids of the results of each query, shape (queries, k). Missing results are -1
+    :param reference: the ids of the reference results of each query, e.g. of an exact search, shape (queries, k)
+    :return: the mean fraction of the reference top-k that is also retrieved, i.e. the recall@k of an approximate
+    search against the exact one
+    """
+    reference = np.asarray(reference)
+    found = relevance_matrix(reference, retrieved).sum(axis=1)
+    return float((found / np.maximum((reference >= 0).sum(axis=1), 1)).mean())
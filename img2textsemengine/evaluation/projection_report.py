@@ -0,0 +1,72 @@
+import logging
+from typing import Any, Optional
+import numpy as np
+from img2textsemengine.evaluation.ground_truth import StoredVectors, exact_top_k
+from img2textsemengine.evaluation.harness import retrieval_metrics
+from img2textsemengine.evaluation.metrics import overlap_at_k
+from img2textsemengine.vector_db.projection import VectorProjection
+
+logger = logging.getLogger(__name__)
+
+
+def projection_report(stored: StoredVectors,
+                      queries: np.ndarray,
+                      targets: np.ndarray,
+                      dims: list[int],
+                      k: int = 10,
+                      whiten_options: tuple[bool, ...] = (False, True),
+                      sample_size: int = 10_000,
+                      seed: int = 0) -> dict[str, Any]:
+    """
+    Measure what reducing the stored vectors costs in accuracy. For every dimension, and with and without whitening,
+    a projection is fitted on a seeded sample of the stored vectors, as the Importer fits it on the first records, the
+    stored vectors and the queries are projected, and the queries are answered by an exact search in the reduced space
+    :param stored: the full-dimension stored vectors of one named vector
+    :param queries: the query embeddings, one row per query
+    :param targets: the position of the relevant image of each query
+    :param dims: the reduced dimensions to compare
+    :param k: the number of results per query
+    :param whiten_options: whether each projection is whitened
+    :param sample_size: the number of stored vectors each projection is fitted on
+    :param seed: the seed of the sample
+    :return: for the full vectors and each projection, the recall@k, MRR and NDCG@k, the recall@k against the exact
+    top-k of the full vectors, the share of the squared norm of the fitted vectors kept by the projection, centered
+    when it is whitened, and the bytes of a float32 vector
+    """
+    full_dim = stored.vectors.shape[1]
+    if queries.shape[1] != full_dim:
+        raise ValueError(f"The stored vectors have {full_dim} dimensions and the queries {queries.shape[1]}, the "
+                         f"report needs a collection whose vectors are not reduced")
+    full = exact_top_k(queries, stored.vectors, k)
+    results = {"full": {"dim": full_dim, **retrieval_metrics(full, targets, k), "bytes_per_vector": full_dim * 4}}
+    rng = np.random.default_rng(seed)
+    sample = stored.vectors[rng.choice(len(stored.vectors), size=min(sample_size, len(stored.vectors)), replace=False)]
+    for dim in sorted(dims):
+        for whiten in whiten_options:
+            projection = VectorProjection.fit(sample, dim=dim, whiten=whiten)
+            reduced = projection.transform(stored.vectors)
+            reduced /= np.maximum(np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12)
+            retrieved = exact_top_k(projection.transform(queries), reduced, k)
+            centered = sample - projection.mean
+            kept_energy = float(np.square(centered @ projection.components.T).sum() / np.square(centered).sum())
+            name = f"pca_{dim}{'_whiten' if whiten else ''}"
+            results[name] = {"dim": dim,
+                             "whiten": whiten,
+                             **retrieval_metrics(retrieved, targets, k),
+                             f"recall@{k}_vs_full": round(overlap_at_k(retrieved, full), 5),
+                             "explained_energy": round(kept_energy, 5),
+                             "bytes_per_vector": dim * 4}
+            logger.info("%s: %s", name, results[name])
+    return results
+
+
+def smallest_dim(results: dict[str, Any], k: int, min_recall_vs_full: float) -> Optional[str]:
+    """
+    :param results: the report of projection_report
+    :param k: the number of results per query of the report
+    :param min_recall_vs_full: the minimum recall@k against the exact top-k of the full vectors
+    :return: the name of the smallest projection whose recall against the full vectors is acceptable, None if none is
+    """
+    acceptable = [(result["dim"], name) for name, result in results.items()
+                  if name != "full" and result[f"recall@{k}_vs_full"] >= min_recall_vs_full]
+    return min(acceptable)[1] if acceptable else None
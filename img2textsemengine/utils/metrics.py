@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+from typing import Iterator
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics of the search service. They are registered in the default registry, so they are exported by
+# the existing "/metrics" route together with the starlette_prometheus request metrics.
+
+QUERY_EMBEDDING_BATCH_SIZE = Histogram(
+    "query_embedding_batch_size",
+    "Number of queries embedded in a single batched forward pass of the text encoder",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+QUERY_EMBEDDING_BATCH_WAIT = Histogram(
+    "query_embedding_batch_wait_seconds",
+    "Time the oldest query of a batch waited in the coalescer before the forward pass started",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+SEARCHER_CACHE_HITS = Counter(
+    "searcher_cache_hits_total",
+    "Number of lookups served by a Searcher cache",
+    ["cache"],
+)
+SEARCHER_CACHE_MISSES = Counter(
+    "searcher_cache_misses_total",
+    "Number of lookups not served by a Searcher cache",
+    ["cache"],
+)
+SEARCHER_CACHE_EVICTIONS = Counter(
+    "searcher_cache_evictions_total",
+    "Number of entries evicted from a Searcher cache, by reason (size, ttl or invalidation)",
+    ["cache", "reason"],
+)
+SEMANTIC_CACHE_SIMILARITY = Histogram(
+    "semantic_cache_similarity",
+    "Cosine similarity between a query and the nearest cached query of the semantic cache, the lookups above the "
+    "similarity threshold are hits",
+    buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.96, 0.97, 0.98, 0.99, 0.995, 0.999, 1.0),
+)
+SEARCHER_STAGE_SECONDS = Histogram(
+    "searcher_stage_seconds",
+    "Time spent in each stage of a query: tokenize, encode, search and build_response",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+SEARCHER_STAGE_IN_PROGRESS = Gauge(
+    "searcher_stage_in_progress",
+    "Number of calls currently running each stage of a query",
+    ["stage"],
+)
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "executor_queue_depth",
+    "Number of blocking calls submitted to the inference executor that have not started yet, by task",
+    ["task"],
+)
+EXECUTOR_WAIT_SECONDS = Histogram(
+    "executor_wait_seconds",
+    "Time a blocking call waited in the inference executor queue before it started, by task",
+    ["task"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+EXECUTOR_REJECTED = Counter(
+    "executor_rejected_total",
+    "Number of blocking calls rejected with a 503 because the queue of the inference executor was full, by task",
+    ["task"],
+)
+EXECUTOR_EXPIRED = Counter(
+    "executor_expired_total",
+    "Number of blocking calls dropped before they were computed because their deadline expired or their request was "
+    "cancelled, by task",
+    ["task"],
+)
+WORKER_MEMORY_BYTES = Gauge(
+    "worker_memory_bytes",
+    "Memory of the worker process by kind: rss, pss, shared and private. The pss of the workers sum to their real "
+    "memory, since the pages they share, e.g. the preloaded model weights, are split among them",
+    ["pid", "kind"],
+)
+WORKER_STARTUP_SECONDS = Gauge(
+    "worker_startup_seconds",
+    "Time the worker took from the start of its lifespan until it was ready to serve requests",
+    ["pid"],
+)
+IMPORTER_STAGE_SECONDS = Histogram(
+    "importer_stage_seconds",
+    "Time spent in a single call of each stage of the import pipeline: download, inference and upsert",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+IMPORTER_STAGE_ITEMS = Counter(
+    "importer_stage_items_total",
+    "Number of records processed by each stage of the import pipeline",
+    ["stage"],
+)
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """
+    Time a stage of a query and count it as in progress while it runs
+    :param stage: the name of the stage, used as the 'stage' label
+    """
+    with SEARCHER_STAGE_IN_PROGRESS.labels(stage=stage).track_inprogress(), \
+            SEARCHER_STAGE_SECONDS.labels(stage=stage).time():
+        yield
@@ -0,0 +1,28 @@
+from typing import Optional
+
+# The fields of /proc/<pid>/smaps_rollup, in kB. PSS splits every shared page among the processes that map it, so the
+# sum of the PSS of the gunicorn workers is their real memory, while the sum of their RSS counts the shared pages once
+# per worker
+_SMAPS_FIELDS = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+                 "Private_Clean": "private", "Private_Dirty": "private"}
+
+
+def read_process_memory(pid: Optional[int] = None) -> dict[str, int]:
+    """
+    :param pid: the process to inspect, None for the current one
+    :return: the rss, pss, shared and private memory of the process in bytes. On kernels without smaps_rollup only
+    the rss is returned
+    """
+    proc = f"/proc/{pid or 'self'}"
+    memory = {}
+    try:
+        with open(f"{proc}/smaps_rollup", "r") as smaps_file:
+            for line in smaps_file:
+                field, _, value = line.partition(":")
+                if field in _SMAPS_FIELDS:
+                    kind = _SMAPS_FIELDS[field]
+                    memory[kind] = memory.get(kind, 0) + int(value.split()[0]) * 1024
+    except FileNotFoundError:
+        with open(f"{proc}/status", "r") as status_file:
+            memory["rss"] = next(int(line.split()[1]) * 1024 for line in status_file if line.startswith("VmRSS"))
+    return memory
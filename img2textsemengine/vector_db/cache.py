@@ -0,0 +1,273 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import numpy as np
+from img2textsemengine.utils.metrics import (SEARCHER_CACHE_EVICTIONS, SEARCHER_CACHE_HITS, SEARCHER_CACHE_MISSES,
+                                             SEMANTIC_CACHE_SIMILARITY)
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """
+    A thread-safe LRU cache whose entries also expire after a fixed time to live. Hits, misses and evictions
+    are exported as prometheus counters labelled with the cache name
+    """
+    def __init__(self, name: str, max_size: int, ttl_seconds: float):
+        """
+        :param name: the name of the cache, used as the 'cache' label of the metrics
+        :param max_size: the maximum number of entries. A non-positive size disables the cache
+        :param ttl_seconds: the time after which an entry expires
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Optional[Any] = None, count_miss: bool = True) -> Any:
+        """
+        :param key: the key to look up
+        :param default: the value to return on a miss
+        :param count_miss: whether a miss is counted in the metrics. A caller that probes the cache before a lookup
+        that counts its own misses sets it to False, so a single miss is not counted twice
+        :return: the cached value, or default if the key is missing or expired
+        """
+        if not self.enabled:
+            return default
+        with self._lock:
+            expires_at, value = self._entries.get(key, (0.0, _MISSING))
+            if value is not _MISSING and expires_at < time.monotonic():
+                del self._entries[key]
+                SEARCHER_CACHE_EVICTIONS.labels(cache=self.name, reason="ttl").inc()
+                value = _MISSING
+            if value is _MISSING:
+                if count_miss:
+                    SEARCHER_CACHE_MISSES.labels(cache=self.name).inc()
+                return default
+            self._entries.move_to_end(key)
+        SEARCHER_CACHE_HITS.labels(cache=self.name).inc()
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Store a value, evicting the least recently used entry if the cache is full
+        :param key: the key of the entry
+        :param value: the value to cache
+        :return: None
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                SEARCHER_CACHE_EVICTIONS.labels(cache=self.name, reason="size").inc()
+
+    def clear(self) -> None:
+        """
+        Drop every entry, e.g. because the data they were computed from has changed
+        :return: None
+        """
+        with self._lock:
+            evicted = len(self._entries)
+            self._entries.clear()
+        if evicted:
+            SEARCHER_CACHE_EVICTIONS.labels(cache=self.name, reason="invalidation").inc(evicted)
+
+
+class SemanticCache(object):
+    """
+    A thread-safe cache of search results looked up by the similarity of the query embeddings instead of their equality,
+    so the paraphrases of a query ("a photo of a dog", "dog photo") share its results. The normalized embeddings of the
+    cached queries are the rows of a single matrix, and a lookup is one matrix-vector product. A cached entry serves a
+    query of the same context, i.e. the same vector and search parameters, whose embedding is within the similarity
+    threshold and whose k is not larger than the cached one. The least recently used entry is evicted when the cache is
+    full, and every entry is dropped when the collection version changes
+    """
+    def __init__(self, name: str, max_size: int, ttl_seconds: float, similarity_threshold: float):
+        """
+        :param name: the name of the cache, used as the 'cache' label of the metrics
+        :param max_size: the maximum number of entries. A non-positive size disables the cache
+        :param ttl_seconds: the time after which an entry expires
+        :param similarity_threshold: the minimum cosine similarity between a query and a cached query to serve the
+        cached results
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._embeddings: Optional[np.ndarray] = None  # (max_size, dim), allocated by the first put
+        self._contexts = np.full(max(max_size, 0), -1, dtype=np.int64)  # the context id of each slot, -1 if free
+        self._top_ks = np.zeros(max(max_size, 0), dtype=np.int64)
+        self._expires_at = np.zeros(max(max_size, 0), dtype=np.float64)
+        self._last_used = np.zeros(max(max_size, 0), dtype=np.int64)
+        self._values: list[Any] = [None] * max(max_size, 0)
+        # the id of each context. The contexts include the filters of the clients, so the ones without any entry left are
+        # forgotten, see __context_id
+        self._context_ids: dict[Hashable, int] = {}
+        self._next_context_id = 0
+        self._version: Optional[str] = None
+        self._clock = 0  # the logical time of the LRU
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._contexts >= 0))
+
+    @staticmethod
+    def __normalize(embedding: list[float]) -> np.ndarray:
+        """
+        :param embedding: a query embedding
+        :return: the L2-normalized float32 embedding
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def __check_version(self, version: Optional[str]) -> None:
+        """
+        drop every entry if the collection version has changed. It is called with the lock held
+        :param version: the current version of the collection
+        :return: None
+        """
+        if version != self._version:
+            evicted = len(self)
+            self._contexts[:] = -1
+            self._values = [None] * self.max_size
+            self._context_ids = {}
+            self._version = version
+            if evicted:
+                SEARCHER_CACHE_EVICTIONS.labels(cache=self.name, reason="invalidation").inc(evicted)
+
+    def __context_id(self, context: Hashable) -> int:
+        """
+        :param context: the context of a query
+        :return: the id of the context, a new one if it has none. At most max_size contexts have an entry, so when the
+        mapping reaches that size the contexts without any entry are forgotten, and it stays bounded whatever the
+        contexts the clients send. It is called with the lock held
+        """
+        context_id = self._context_ids.get(context)
+        if context_id is None:
+            if len(self._context_ids) >= self.max_size:
+                live = set(self._contexts[self._contexts >= 0].tolist())
+                self._context_ids = {key: value for key, value in self._context_ids.items() if value in live}
+            context_id = self._next_context_id
+            self._next_context_id += 1
+            self._context_ids[context] = context_id
+        return context_id
+
+    def __nearest(self, vector: np.ndarray, context_id: int, top_k: int) -> tuple[int, float]:
+        """
+        find the most similar cached query of a context. The expired entries are dropped on the way. It is called with
+        the lock held
+        :param vector: the normalized query embedding
+        :param context_id: the id of the context of the query
+        :param top_k: the number of results of the query, the cached entries with fewer results are skipped
+        :return: the slot and the similarity of the nearest cached query, -1 and -inf if there is none
+        """
+        if self._embeddings is None or self._embeddings.shape[1] != vector.shape[0]:
+            return -1, float("-inf")
+        expired = (self._contexts >= 0) & (self._expires_at < time.monotonic())
+        if expired.any():
+            self._contexts[expired] = -1
+            SEARCHER_CACHE_EVICTIONS.labels(cache=self.name, reason="ttl").inc(int(expired.sum()))
+        candidates = np.flatnonzero((self._contexts == context_id) & (self._top_ks >= top_k))
+        if not len(candidates):
+            return -1, float("-inf")
+        similarities = self._embeddings[candidates] @ vector
+        best = int(np.argmax(similarities))
+        return int(candidates[best]), float(similarities[best])
+
+    def get(self,
+            embedding: list[float],
+            context: Hashable,
+            top_k: int,
+            version: Optional[str],
+            default: Optional[Any] = None) -> Any:
+        """
+        :param embedding: the embedding of the query
+        :param context: what the results depend on besides the query, i.e. the searched vector and the search parameters
+        :param top_k: the number of results of the query
+        :param version: the current version of the collection
+        :param default: the value to return on a miss
+        :return: the first top_k cached results of the nearest cached query, or default if no cached query is similar
+        enough
+        """
+        if not self.enabled:
+            return default
+        vector = self.__normalize(embedding)
+        with self._lock:
+            self.__check_version(version)
+            context_id = self._context_ids.get(context)
+            slot, similarity = self.__nearest(vector, context_id, top_k) if context_id is not None else (-1, -1.0)
+            if slot >= 0:
+                SEMANTIC_CACHE_SIMILARITY.observe(similarity)
+            if slot < 0 or similarity < self.similarity_threshold:
+                SEARCHER_CACHE_MISSES.labels(cache=self.name).inc()
+                return default
+            self._clock += 1
+            self._last_used[slot] = self._clock
+            value = self._values[slot]
+        SEARCHER_CACHE_HITS.labels(cache=self.name).inc()
+        return value[:top_k]
+
+    def put(self, embedding: list[float], context: Hashable, top_k: int, version: Optional[str], value: list) -> None:
+        """
+        Store the results of a query. They replace the entry of the same query embedding, otherwise they take a free
+        slot or the one of the least recently used entry
+        :param embedding: the embedding of the query
+        :param context: what the results depend on besides the query, see get
+        :param top_k: the number of results the query asked for
+        :param version: the version of the collection the results were computed from
+        :param value: the results of the query
+        :return: None
+        """
+        if not self.enabled:
+            return
+        vector = self.__normalize(embedding)
+        with self._lock:
+            self.__check_version(version)
+            if self._embeddings is None or self._embeddings.shape[1] != vector.shape[0]:
+                self._embeddings = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+                self._contexts[:] = -1
+            context_id = self.__context_id(context)
+            slot, similarity = self.__nearest(vector, context_id, 0)
+            if slot < 0 or similarity < 1.0 - 1e-6:
+                free = np.flatnonzero(self._contexts < 0)
+                if len(free):
+                    slot = int(free[0])
+                else:
+                    slot = int(np.argmin(self._last_used))
+                    SEARCHER_CACHE_EVICTIONS.labels(cache=self.name, reason="size").inc()
+            self._clock += 1
+            self._embeddings[slot] = vector
+            self._contexts[slot] = context_id
+            self._top_ks[slot] = top_k
+            self._expires_at[slot] = time.monotonic() + self.ttl_seconds
+            self._last_used[slot] = self._clock
+            self._values[slot] = value
+
+    def clear(self) -> None:
+        """
+        Drop every entry
+        :return: None
+        """
+        with self._lock:
+            evicted = len(self)
+            self._contexts[:] = -1
+            self._values = [None] * self.max_size
+            self._context_ids = {}
+        if evicted:
+            SEARCHER_CACHE_EVICTIONS.labels(cache=self.name, reason="invalidation").inc(evicted)
@@ -0,0 +1,84 @@
+from io import BytesIO
+from typing import Optional, Union
+import numpy as np
+import torch
+from PIL import Image
+from transformers import AutoTokenizer, CLIPModel, AutoProcessor
+from img2textsemengine.vector_db.image_preprocessing import PREPROCESSING_MODES, ImagePreprocessor
+
+
+class ClipEmbedder(object):
+    """
+    A class to extract the image and the caption embeddings of the imported records with the full clip model. The
+    Importer uses it in its own process, and every embedding worker process loads its own copy, so a record gets the
+    same vectors whichever process embeds it
+    """
+    def __init__(self, hf_model: str, num_threads: Optional[int] = None, preprocessing: str = "processor"):
+        """
+        :param hf_model: the huggingface model to extract the embeddings of the images/texts
+        :param num_threads: the intra-op threads of each forward pass, None for the torch default. It is a process-wide
+        setting of torch
+        :param preprocessing: how the images are turned into pixel values, one of PREPROCESSING_MODES
+        """
+        if preprocessing not in PREPROCESSING_MODES:
+            raise ValueError(f"Unknown preprocessing '{preprocessing}', it must be one of {PREPROCESSING_MODES}")
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(hf_model)
+        self.model = CLIPModel.from_pretrained(hf_model)
+        self.model.eval()
+        self.processor = AutoProcessor.from_pretrained(hf_model) if preprocessing == "processor" else None
+        self.preprocessor = ImagePreprocessor(hf_model=hf_model,
+                                              draft=preprocessing == "fast_draft") if self.processor is None else None
+
+    def load_image(self, content: bytes) -> Union[Image.Image, np.ndarray]:
+        """
+        decode an encoded image. It does not use the model, so it can run in other threads than embed
+        :param content: the encoded image
+        :return: the decoded image, or its resized crop with the fast preprocessing
+        """
+        if self.preprocessor is not None:
+            return self.preprocessor.load(content)
+        return Image.open(BytesIO(content)).convert("RGB")
+
+    def embed(self,
+              images: list[Union[Image.Image, np.ndarray]],
+              answers: list[list[str]]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        extract the embeddings of a batch of records
+        :param images: the image of each record, returned by load_image
+        :param answers: the captions/answers of each record
+        :return: two float32 matrices, the image embeddings and the mean caption embeddings, one row per record
+        """
+        with torch.inference_mode():
+            image_features = self.__extract_image_embs(images=images)
+            text_features = self.__extract_text_embs(answers=answers)
+        return image_features.numpy(), text_features.numpy()
+
+    def __extract_image_embs(self, images: list[Union[Image.Image, np.ndarray]]) -> torch.Tensor:
+        """
+        extract the embeddings of a batch of images in a single forward pass
+        :param images: the decoded images, or their crops
+        :return a tensor representing the image embeddings, one row per image
+        """
+        if self.preprocessor is not None:
+            pixel_values = torch.from_numpy(self.preprocessor.pixel_values(images))
+        else:
+            pixel_values = self.processor(images=images, return_tensors="pt")["pixel_values"]
+        image_features = self.model.get_image_features(pixel_values=pixel_values)
+        return image_features
+
+    def __extract_text_embs(self, answers: list[list[str]]) -> torch.Tensor:
+        """
+        extract the text embedding of each provided caption/answer for a batch of images in a single forward pass.
+        Then return as the text embedding of each image the average embedding of its captions/answers
+        :param answers: the captions/answers of each image
+        :return the avg/mean embedding of the captions of each image, one row per image
+        """
+        inputs = self.tokenizer([answer for image_answers in answers for answer in image_answers],
+                                padding=True,
+                                truncation=True,  # a caption longer than the 77 positions of CLIP would fail the batch
+                                return_tensors="pt")
+        text_features = self.model.get_text_features(**inputs)
+        per_image = torch.split(text_features, [len(image_answers) for image_answers in answers])
+        return torch.stack([torch.mean(features, dim=0) for features in per_image])
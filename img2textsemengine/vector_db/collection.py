@@ -0,0 +1,81 @@
+from typing import Optional
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from img2textsemengine.vector_db.payload_filter import CAPTIONS_FIELD, SOURCE_FIELD, URL_PREFIXES_FIELD
+
+# The named vectors stored for each image: the clip embedding of the image itself and the mean clip embedding of
+# its captions/answers
+VECTOR_NAMES = ("text", "image")
+QUANTIZATIONS = ("scalar", "binary")
+
+
+def build_vectors_config(vector_sizes: dict[str, int],
+                         vector_params: Optional[dict[str, dict]] = None) -> dict[str, models.VectorParams]:
+    """
+    Build the configuration of the named vectors of the collection
+    :param vector_sizes: the size of each named vector
+    :param vector_params: the index parameters of each named vector, the 'index' section of config/data/import.yaml.
+    Each one may define:
+    m and ef_construct: the number of edges per node and the size of the candidates list while building the HNSW
+    graph. Higher values give a better recall, at the cost of more memory and a slower build
+    on_disk: whether to keep the original vectors on disk, memory-mapped, instead of in RAM
+    hnsw_on_disk: whether to keep the HNSW graph on disk, memory-mapped, instead of in RAM
+    quantization: None, 'scalar' (int8, 4x smaller) or 'binary' (1 bit per dimension, 32x smaller). The quantized
+    vectors are searched first and the best candidates are rescored with the original ones
+    quantile: the quantile of the values kept by the scalar quantization, the outliers beyond it are clipped
+    always_ram: whether to keep the quantized vectors in RAM even when the original ones are on disk
+    The missing parameters, or the vectors without any, get the QDrant defaults
+    :return: the vectors configuration of the collection
+    """
+    vector_params = dict(vector_params or {})  # a plain dict, the get of the DotDict of the configs ignores plain keys
+    return {name: _vector_config(size, vector_params.get(name) or {}) for name, size in vector_sizes.items()}
+
+
+def _vector_config(size: int, params: dict) -> models.VectorParams:
+    """
+    :param size: the size of the vector
+    :param params: its index parameters, see build_vectors_config
+    :return: the configuration of the vector
+    """
+    hnsw_config = None
+    if any(params.get(key) is not None for key in ("m", "ef_construct", "hnsw_on_disk")):
+        hnsw_config = models.HnswConfigDiff(m=params.get("m"), ef_construct=params.get("ef_construct"),
+                                            on_disk=params.get("hnsw_on_disk"))
+    quantization = params.get("quantization")
+    always_ram = params.get("always_ram", True)
+    if quantization is None:
+        quantization_config = None
+    elif quantization == "scalar":
+        quantization_config = models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=params.get("quantile"),
+                                                   always_ram=always_ram))
+    elif quantization == "binary":
+        quantization_config = models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=always_ram))
+    else:
+        raise ValueError(f"Unknown quantization '{quantization}', it must be null or one of {QUANTIZATIONS}")
+    return models.VectorParams(size=size, distance=models.Distance.COSINE, hnsw_config=hnsw_config,
+                               quantization_config=quantization_config, on_disk=params.get("on_disk"))
+
+
+def create_payload_indexes(qdrant_client: QdrantClient,
+                           collection_name: str,
+                           caption_payload_name: str = CAPTIONS_FIELD) -> None:
+    """
+    Index the payload fields the searches are filtered on: a full-text index of the captions and keyword indexes of
+    the source and the url prefixes of the images. They are created before the points are written, so QDrant also
+    links the HNSW graph within the filtered subsets, and it plans a filtered search from their cardinality: a narrow
+    filter scores only its matching points instead of traversing the whole graph. Indexing an already indexed field
+    does nothing
+    :param qdrant_client: the qdrant client
+    :param collection_name: the collection
+    :param caption_payload_name: the payload field that stores the captions/answers
+    :return: None
+    """
+    qdrant_client.create_payload_index(collection_name=collection_name,
+                                       field_name=caption_payload_name,
+                                       field_schema=models.TextIndexParams(type=models.TextIndexType.TEXT,
+                                                                           tokenizer=models.TokenizerType.WORD,
+                                                                           lowercase=True))
+    for field_name in (SOURCE_FIELD, URL_PREFIXES_FIELD):
+        qdrant_client.create_payload_index(collection_name=collection_name, field_name=field_name,
+                                           field_schema=models.PayloadSchemaType.KEYWORD)
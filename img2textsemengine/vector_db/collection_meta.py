@@ -0,0 +1,74 @@
+from typing import Any
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http import models
+
+# The metadata of a collection (e.g. the version written by the Importer) is stored as the payload of a single point
+# in a small sibling collection, so that it never shows up in the search results of the collection itself.
+META_COLLECTION_SUFFIX = "__meta"
+_META_POINT_ID = 0
+
+
+def meta_collection_name(collection_name: str) -> str:
+    """
+    :param collection_name: the name of the data collection
+    :return: the name of the collection that stores its metadata
+    """
+    return f"{collection_name}{META_COLLECTION_SUFFIX}"
+
+
+def read_collection_meta(qdrant_client: QdrantClient, collection_name: str) -> dict[str, Any]:
+    """
+    Read the metadata of a collection
+    :param qdrant_client: the qdrant client
+    :param collection_name: the name of the data collection
+    :return: the metadata, or an empty dict if none has been written yet
+    """
+    meta_collection = meta_collection_name(collection_name)
+    if not qdrant_client.collection_exists(meta_collection):
+        return {}
+    points = qdrant_client.retrieve(collection_name=meta_collection, ids=[_META_POINT_ID], with_payload=True)
+    return points[0].payload if points else {}
+
+
+async def read_collection_meta_async(qdrant_client: AsyncQdrantClient, collection_name: str) -> dict[str, Any]:
+    """
+    Read the metadata of a collection without blocking the event loop
+    :param qdrant_client: the async qdrant client
+    :param collection_name: the name of the data collection
+    :return: the metadata, or an empty dict if none has been written yet
+    """
+    meta_collection = meta_collection_name(collection_name)
+    if not await qdrant_client.collection_exists(meta_collection):
+        return {}
+    points = await qdrant_client.retrieve(collection_name=meta_collection, ids=[_META_POINT_ID], with_payload=True)
+    return points[0].payload if points else {}
+
+
+def write_collection_meta(qdrant_client: QdrantClient, collection_name: str, **fields: Any) -> dict[str, Any]:
+    """
+    Update the metadata of a collection with the given fields
+    :param qdrant_client: the qdrant client
+    :param collection_name: the name of the data collection
+    :param fields: the metadata fields to set
+    :return: the updated metadata
+    """
+    meta_collection = meta_collection_name(collection_name)
+    if not qdrant_client.collection_exists(meta_collection):
+        qdrant_client.create_collection(collection_name=meta_collection,
+                                        vectors_config=models.VectorParams(size=1, distance=models.Distance.DOT))
+    meta = {**read_collection_meta(qdrant_client, collection_name), **fields}
+    qdrant_client.upsert(collection_name=meta_collection,
+                         points=[models.PointStruct(id=_META_POINT_ID, vector=[1.0], payload=meta)])
+    return meta
+
+
+def delete_collection_meta(qdrant_client: QdrantClient, collection_name: str) -> None:
+    """
+    Delete the metadata of a collection, e.g. because the collection is recreated from scratch
+    :param qdrant_client: the qdrant client
+    :param collection_name: the name of the data collection
+    :return: None
+    """
+    meta_collection = meta_collection_name(collection_name)
+    if qdrant_client.collection_exists(meta_collection):
+        qdrant_client.delete_collection(collection_name=meta_collection)
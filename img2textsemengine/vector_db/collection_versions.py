@@ -0,0 +1,284 @@
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Optional
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from img2textsemengine.vector_db.collection_meta import (META_COLLECTION_SUFFIX, delete_collection_meta,
+                                                         read_collection_meta, write_collection_meta)
+
+logger = logging.getLogger(__name__)
+
+# The searchers query an alias, e.g. 'coco_captions', which points to a versioned collection, e.g.
+# 'coco_captions__v20260101T120000123456-1a2b3c4d'. A re-import builds a new versioned collection next to the live
+# one, waits until QDrant has indexed it, checks it and switches the alias in a single atomic operation. The previous
+# versions are kept for a rollback. The metadata, and so the version the searchers invalidate their caches with, belong
+# to the alias. A collection imported before the aliases existed has the name of the alias, it is migrated once by
+# migrate_to_alias.
+VERSION_SEPARATOR = "__v"
+
+
+def new_version_name(alias: str) -> str:
+    """
+    :param alias: the alias the searchers query
+    :return: the name of a new versioned collection of the alias. The names of the versions sort by creation time, to
+    the microsecond, and the random suffix tells apart the ones created by concurrent imports
+    """
+    created_at = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    return f"{alias}{VERSION_SEPARATOR}{created_at}-{uuid.uuid4().hex[:8]}"
+
+
+def resolve_alias(qdrant_client: QdrantClient, alias: str) -> Optional[str]:
+    """
+    :param qdrant_client: the qdrant client
+    :param alias: the alias
+    :return: the collection the alias points to, or None if there is no such alias
+    """
+    for description in qdrant_client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+def check_alias(qdrant_client: QdrantClient, alias: str) -> None:
+    """
+    Check that an alias can be switched, i.e. that no collection has its name
+    :param qdrant_client: the qdrant client
+    :param alias: the alias
+    :return: None
+    """
+    if resolve_alias(qdrant_client, alias) is None and qdrant_client.collection_exists(alias):
+        raise ValueError(f"'{alias}' is a collection imported before the aliases existed, not an alias. "
+                         f"Migrate it once with 'python scripts/collection_versions.py --migrate'")
+
+
+def list_versions(qdrant_client: QdrantClient, alias: str) -> list[str]:
+    """
+    :param qdrant_client: the qdrant client
+    :param alias: the alias
+    :return: the versioned collections of the alias, from the oldest to the newest
+    """
+    prefix = f"{alias}{VERSION_SEPARATOR}"
+    return sorted(description.name for description in qdrant_client.get_collections().collections
+                  if description.name.startswith(prefix) and not description.name.endswith(META_COLLECTION_SUFFIX))
+
+
+def wait_until_indexed(qdrant_client: QdrantClient,
+                       collection_name: str,
+                       timeout_seconds: float = 3600,
+                       poll_seconds: float = 2) -> None:
+    """
+    Wait until QDrant has finished optimizing and indexing a collection, i.e. until its status is green
+    :param qdrant_client: the qdrant client
+    :param collection_name: the collection
+    :param timeout_seconds: how long to wait
+    :param poll_seconds: how often the status is read
+    :return: None
+    """
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        status = qdrant_client.get_collection(collection_name).status
+        if status == models.CollectionStatus.GREEN:
+            return
+        if status == models.CollectionStatus.RED:
+            raise RuntimeError(f"The collection '{collection_name}' failed to index, its status is red")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"The collection '{collection_name}' is still {status} after {timeout_seconds}s")
+        time.sleep(poll_seconds)
+
+
+def check_self_recall(qdrant_client: QdrantClient,
+                      collection_name: str,
+                      vector_names: list[str],
+                      sample_size: int = 100,
+                      top_k: int = 10) -> dict[str, float]:
+    """
+    A smoke check of a collection before it goes live: a sample of its points is searched with their own vectors, and
+    each one should find itself among the first results. It catches an empty or a partially written collection, and
+    an index too lossy to find even the exact vectors
+    :param qdrant_client: the qdrant client
+    :param collection_name: the collection
+    :param vector_names: the named vectors to check
+    :param sample_size: the number of points searched
+    :param top_k: the number of results a point should be in
+    :return: for each named vector, the fraction of the sampled points found among the top_k results of their own
+    vector, or with an exact duplicate among them
+    """
+    if qdrant_client.count(collection_name, exact=True).count == 0:
+        raise RuntimeError(f"The collection '{collection_name}' is empty")
+    # the first points in id order. The ids are hashes of the image urls, so they are a random sample of the records
+    points, _ = qdrant_client.scroll(collection_name=collection_name, limit=sample_size, with_payload=False,
+                                     with_vectors=vector_names)
+    recalls = {}
+    for vector_name in vector_names:
+        requests = [models.SearchRequest(vector=models.NamedVector(name=vector_name, vector=point.vector[vector_name]),
+                                         limit=top_k)
+                    for point in points]
+        responses = qdrant_client.search_batch(collection_name=collection_name, requests=requests)
+        # a duplicate image has the same vector, and can rank before the point itself
+        found = sum(any(result.id == point.id or result.score >= 1.0 - 1e-6 for result in response)
+                    for point, response in zip(points, responses))
+        recalls[vector_name] = found / len(points)
+    return recalls
+
+
+def switch_alias(qdrant_client: QdrantClient, alias: str, collection_name: str) -> Optional[str]:
+    """
+    Point an alias to a collection. The previous alias is deleted and the new one created in a single request, so the
+    searchers go from one collection to the other without a failed query
+    :param qdrant_client: the qdrant client
+    :param alias: the alias
+    :param collection_name: the collection the alias points to from now on
+    :return: the collection the alias pointed to before, None if there was no alias
+    """
+    check_alias(qdrant_client, alias)
+    previous = resolve_alias(qdrant_client, alias)
+    operations = []
+    if previous is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=collection_name,
+                                                                                  alias_name=alias)))
+    qdrant_client.update_collection_aliases(change_aliases_operations=operations)
+    return previous
+
+
+def prune_versions(qdrant_client: QdrantClient, alias: str, keep_versions: int) -> list[str]:
+    """
+    Delete the oldest versioned collections of an alias. The live one is never deleted
+    :param qdrant_client: the qdrant client
+    :param alias: the alias
+    :param keep_versions: the number of previous versions kept for a rollback
+    :return: the deleted collections
+    """
+    live = resolve_alias(qdrant_client, alias)
+    previous = [name for name in list_versions(qdrant_client, alias) if name != live]
+    deleted = previous[:max(len(previous) - keep_versions, 0)]
+    for name in deleted:
+        qdrant_client.delete_collection(name)
+        delete_collection_meta(qdrant_client, name)
+        logger.info("Deleted the old version '%s' of '%s'", name, alias)
+    return deleted
+
+
+def publish_version(qdrant_client: QdrantClient,
+                    alias: str,
+                    collection_name: str,
+                    vector_names: list[str],
+                    keep_versions: int = 2,
+                    index_timeout_seconds: float = 3600,
+                    check_sample_size: int = 100,
+                    min_self_recall: float = 0.95) -> dict[str, Any]:
+    """
+    Make a fully written versioned collection the live one: wait until it is indexed, check it, switch the alias to it,
+    store a new version in the metadata of the alias, so the searchers drop their cached results, and prune the oldest
+    versions. A collection that is not indexed in time or fails the check is dropped, and the alias is not touched
+    :param qdrant_client: the qdrant client
+    :param alias: the alias the searchers query
+    :param collection_name: the new versioned collection
+    :param vector_names: the named vectors of the collection
+    :param keep_versions: the number of previous versions kept for a rollback
+    :param index_timeout_seconds: how long to wait for the indexing of the collection
+    :param check_sample_size: the number of points of the smoke check, see check_self_recall
+    :param min_self_recall: the minimum self recall of every named vector
+    :return: the updated metadata of the alias
+    """
+    try:
+        wait_until_indexed(qdrant_client, collection_name, timeout_seconds=index_timeout_seconds)
+        recalls = check_self_recall(qdrant_client, collection_name, vector_names=vector_names,
+                                    sample_size=check_sample_size)
+        failed = {name: recall for name, recall in recalls.items() if recall < min_self_recall}
+        if failed:
+            raise RuntimeError(f"The collection '{collection_name}' failed the smoke check, the self recall of {failed} "
+                               f"is below {min_self_recall}. The alias '{alias}' still points to the previous version")
+    except (RuntimeError, TimeoutError):
+        # dropped, otherwise it would be kept as one of the newest versions by prune_versions
+        logger.warning("Dropping the collection '%s', it does not go live", collection_name)
+        qdrant_client.delete_collection(collection_name)
+        delete_collection_meta(qdrant_client, collection_name)
+        raise
+    previous = switch_alias(qdrant_client, alias, collection_name)
+    logger.info("Switched '%s' from '%s' to '%s', self recall %s", alias, previous, collection_name, recalls)
+    meta = _write_alias_meta(qdrant_client, alias, collection_name)
+    prune_versions(qdrant_client, alias, keep_versions=keep_versions)
+    return meta
+
+
+def rollback(qdrant_client: QdrantClient, alias: str, collection_name: Optional[str] = None) -> str:
+    """
+    Point an alias back to a kept version
+    :param qdrant_client: the qdrant client
+    :param alias: the alias
+    :param collection_name: the version to go back to, None for the one before the live one
+    :return: the collection the alias points to
+    """
+    versions = list_versions(qdrant_client, alias)
+    live = resolve_alias(qdrant_client, alias)
+    if collection_name is None:
+        older = [name for name in versions if live is None or name < live]
+        if not older:
+            raise ValueError(f"There is no version of '{alias}' older than '{live}'")
+        collection_name = older[-1]
+    elif collection_name not in versions:
+        raise ValueError(f"'{collection_name}' is not a version of '{alias}', the versions are {versions}")
+    switch_alias(qdrant_client, alias, collection_name)
+    _write_alias_meta(qdrant_client, alias, collection_name)
+    return collection_name
+
+
+def migrate_to_alias(qdrant_client: QdrantClient, alias: str, index_timeout_seconds: float = 3600) -> str:
+    """
+    Turn a collection imported before the aliases existed, which has the name of the alias, into the first version of
+    the alias. Its points, payload indexes and projections are copied into a new versioned collection, which is indexed
+    and counted before the original is deleted and the alias created in its place. The searches fail in between these
+    two requests, so it is run once, explicitly, see scripts/collection_versions.py
+    :param qdrant_client: the qdrant client
+    :param alias: the collection to migrate, and the alias that replaces it
+    :param index_timeout_seconds: how long to wait for the indexing of the copy
+    :return: the versioned collection the alias points to
+    """
+    if resolve_alias(qdrant_client, alias) is not None:
+        raise ValueError(f"'{alias}' is already an alias")
+    if not qdrant_client.collection_exists(alias):
+        raise ValueError(f"There is no collection '{alias}' to migrate")
+    info = qdrant_client.get_collection(alias)
+    collection_name = new_version_name(alias)
+    qdrant_client.create_collection(collection_name=collection_name,
+                                    vectors_config=info.config.params.vectors,
+                                    init_from=models.InitFrom(collection=alias))
+    try:
+        for field_name, schema in (info.payload_schema or {}).items():
+            qdrant_client.create_payload_index(collection_name, field_name=field_name,
+                                               field_schema=schema.params or schema.data_type)
+        write_collection_meta(qdrant_client, collection_name,
+                              projection=read_collection_meta(qdrant_client, alias).get("projection"))
+        wait_until_indexed(qdrant_client, collection_name, timeout_seconds=index_timeout_seconds)
+        copied = qdrant_client.count(collection_name, exact=True).count
+        original = qdrant_client.count(alias, exact=True).count
+        if copied != original:
+            raise RuntimeError(f"The copy '{collection_name}' has {copied} points, but '{alias}' has {original}")
+    except Exception:
+        logger.warning("Dropping the copy '%s', '%s' is not migrated", collection_name, alias)
+        qdrant_client.delete_collection(collection_name)
+        delete_collection_meta(qdrant_client, collection_name)
+        raise
+    # the metadata of the alias is the one of the original collection, its version is kept until _write_alias_meta
+    logger.warning("Deleting the collection '%s', copied into '%s', to replace it with an alias",
+                   alias, collection_name)
+    qdrant_client.delete_collection(alias)
+    switch_alias(qdrant_client, alias, collection_name)
+    _write_alias_meta(qdrant_client, alias, collection_name)
+    return collection_name
+
+
+def _write_alias_meta(qdrant_client: QdrantClient, alias: str, collection_name: str) -> dict[str, Any]:
+    """
+    Store a new version in the metadata of an alias, with the projections of the collection it points to
+    :param qdrant_client: the qdrant client
+    :param alias: the alias
+    :param collection_name: the collection the alias points to
+    :return: the updated metadata of the alias
+    """
+    return write_collection_meta(qdrant_client, alias, version=uuid.uuid4().hex, updated_at=time.time(),
+                                 collection=collection_name,
+                                 projection=read_collection_meta(qdrant_client, collection_name).get("projection"))
@@ -0,0 +1,210 @@
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from multiprocessing import shared_memory
+from typing import Any, Iterable, Iterator, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The workers are spawned, not forked: a forked child would inherit the OpenMP thread pool of torch in an unusable state,
+# and the importing process may have running threads (downloads, the batch writer). Every worker loads its own model,
+# decodes and preprocesses its own images, and writes the embeddings of a batch into a shared memory slot, so only the
+# jpeg bytes and the captions are pickled.
+
+
+def _worker_cores(rank: int, num_threads: int) -> Optional[set[int]]:
+    """
+    :param rank: the rank of the worker
+    :param num_threads: the torch threads of each worker
+    :return: the cores the worker is pinned to, disjoint from the cores of the other workers, or None when the platform
+    does not support the pinning or there are not enough cores
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < (rank + 1) * num_threads:
+        return None
+    return set(cores[rank * num_threads:(rank + 1) * num_threads])
+
+
+def _embedding_worker(rank: int,
+                      hf_model: str,
+                      num_threads: int,
+                      preprocessing: str,
+                      slot_names: list[str],
+                      slot_shape: tuple[int, int, int],
+                      tasks: multiprocessing.Queue,
+                      results: multiprocessing.Queue) -> None:
+    """
+    The loop of a worker process: embed the batches of the task queue until it receives None
+    """
+    cores = _worker_cores(rank, num_threads)
+    if cores:
+        os.sched_setaffinity(0, cores)
+    from img2textsemengine.vector_db.clip_embedder import ClipEmbedder
+
+    embedder = ClipEmbedder(hf_model=hf_model, num_threads=num_threads, preprocessing=preprocessing)
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    buffers = [np.ndarray(slot_shape, dtype=np.float32, buffer=slot.buf) for slot in slots]
+    try:
+        while (task := tasks.get()) is not None:
+            sequence, slot, contents, answers = task
+            start = time.perf_counter()
+            try:
+                kept, images = [], []
+                for position, content in enumerate(contents):
+                    try:
+                        images.append(embedder.load_image(content))
+                        kept.append(position)
+                    except OSError:
+                        logger.warning("Skipping an image of batch %d, it could not be decoded", sequence)
+                if images:
+                    image_features, text_features = embedder.embed(images=images,
+                                                                   answers=[answers[position] for position in kept])
+                    buffers[slot][0, :len(kept)] = image_features
+                    buffers[slot][1, :len(kept)] = text_features
+                results.put((sequence, kept, time.perf_counter() - start, None))
+            except Exception:
+                results.put((sequence, None, 0.0, traceback.format_exc()))
+    finally:
+        buffers = []  # the views must be released before the shared memory is closed
+        for slot in slots:
+            slot.close()
+
+
+class EmbeddingWorkerPool(object):
+    """
+    A pool of processes that extract the clip embeddings of batches of downloaded images. The batches are embedded
+    concurrently, and handed back in their submission order, so the single writer of the Importer still upserts and
+    checkpoints the points in dataset order
+    """
+    def __init__(self,
+                 hf_model: str,
+                 num_workers: int,
+                 batch_size: int,
+                 vector_size: int,
+                 num_threads: Optional[int] = None,
+                 max_pending: Optional[int] = None,
+                 preprocessing: str = "processor"):
+        """
+        :param hf_model: the huggingface model every worker loads
+        :param num_workers: the number of worker processes
+        :param batch_size: the maximum number of records per batch
+        :param vector_size: the size of the image and text vectors
+        :param num_threads: the torch threads of each worker, None to share the cores of the machine among the workers
+        :param max_pending: the maximum number of batches submitted but not yet handed back, each one holds a shared
+        memory slot. None for two per worker, so a worker never waits for its next batch
+        :param preprocessing: how the workers turn the images into pixel values, see ClipEmbedder
+        """
+        self.hf_model = hf_model
+        self.num_workers = num_workers
+        self.num_threads = num_threads or max(1, (os.cpu_count() or 1) // num_workers)
+        self.slot_shape = (2, batch_size, vector_size)  # the image and the text embeddings of a batch
+        self.num_slots = max_pending or 2 * num_workers
+        self.preprocessing = preprocessing
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks = None
+        self._results = None
+        self._workers = []
+        self._slots = []
+        self._buffers = []
+
+    def start(self) -> None:
+        """
+        Allocate the shared memory slots and start the worker processes
+        :return: None
+        """
+        slot_bytes = int(np.prod(self.slot_shape)) * np.dtype(np.float32).itemsize
+        self._slots = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(self.num_slots)]
+        self._buffers = [np.ndarray(self.slot_shape, dtype=np.float32, buffer=slot.buf) for slot in self._slots]
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._workers = [self._context.Process(target=_embedding_worker,
+                                               args=(rank, self.hf_model, self.num_threads, self.preprocessing,
+                                                     [slot.name for slot in self._slots], self.slot_shape,
+                                                     self._tasks, self._results),
+                                               name=f"embedding-worker-{rank}",
+                                               daemon=True)
+                         for rank in range(self.num_workers)]
+        for worker in self._workers:
+            worker.start()
+        logger.info("Started %d embedding workers with %d torch threads each", self.num_workers, self.num_threads)
+
+    def close(self) -> None:
+        """
+        Stop the worker processes and release the shared memory slots
+        :return: None
+        """
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=60)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self._buffers = []
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []
+
+    def map_ordered(self,
+                    batches: Iterable[tuple[Any, list[bytes], list[list[str]]]]
+                    ) -> Iterator[tuple[Any, list[int], np.ndarray, np.ndarray, float]]:
+        """
+        Embed batches in the worker processes
+        :param batches: for each batch a tag, handed back with its embeddings, the encoded images and the
+        captions/answers of each image
+        :return: for each batch, in the input order, its tag, the positions of the images that could be decoded, their
+        image and mean caption embeddings, and the seconds a worker spent on the batch
+        """
+        free = list(range(self.num_slots))
+        in_flight = {}  # sequence -> (tag, slot), the batches submitted and not yet handed back
+        done = {}  # sequence -> (kept, seconds), the reorder buffer of the batches embedded out of order
+        next_sequence = 0
+        for sequence, (tag, contents, answers) in enumerate(batches):
+            while not free:
+                next_sequence = yield from self.__hand_back(in_flight, done, free, next_sequence)
+            slot = free.pop()
+            in_flight[sequence] = (tag, slot)
+            self._tasks.put((sequence, slot, contents, answers))
+        while in_flight:
+            next_sequence = yield from self.__hand_back(in_flight, done, free, next_sequence)
+
+    def __hand_back(self, in_flight: dict, done: dict, free: list, next_sequence: int) -> Iterator[tuple]:
+        """
+        Wait for a batch to be embedded, then hand back every batch that is next in order. Their slots are copied and
+        freed
+        :return: the sequence of the next batch to hand back
+        """
+        sequence, kept, seconds = self.__receive()
+        done[sequence] = (kept, seconds)
+        while next_sequence in done:
+            kept, seconds = done.pop(next_sequence)
+            tag, slot = in_flight.pop(next_sequence)
+            image_features = self._buffers[slot][0, :len(kept)].copy()
+            text_features = self._buffers[slot][1, :len(kept)].copy()
+            free.append(slot)
+            next_sequence += 1
+            yield tag, kept, image_features, text_features, seconds
+        return next_sequence
+
+    def __receive(self) -> tuple[int, list[int], float]:
+        """
+        :return: the sequence, the decoded positions and the seconds of the next batch embedded by a worker
+        """
+        while True:
+            try:
+                sequence, kept, seconds, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [worker.name for worker in self._workers if not worker.is_alive()]
+                if dead:
+                    raise RuntimeError(f"The embedding workers {dead} exited unexpectedly")
+                continue
+            if error is not None:
+                raise RuntimeError(f"An embedding worker failed on batch {sequence}:\n{error}")
+            return sequence, kept, seconds
@@ -0,0 +1,180 @@
+import logging
+import os
+from typing import TYPE_CHECKING, Optional
+import numpy as np
+
+if TYPE_CHECKING:
+    import torch
+
+# torch and transformers are imported when an encoder is loaded, not with this module, so that importing the serving
+# path stays fast and the onnx backends never import torch
+
+ONNX_MODEL_FILE = "text_encoder.onnx"
+ONNX_INT8_MODEL_FILE = "text_encoder.int8.onnx"
+ENCODER_BACKENDS = ("torch", "onnx", "onnx_int8")
+# float16 is left out on purpose: the CPU kernels of torch 2.2 do not implement LayerNorm in half precision
+TORCH_DTYPES = ("float32", "bfloat16")
+
+logger = logging.getLogger(__name__)
+
+
+class TorchTextEncoder(object):
+    """
+    A class to extract the clip embeddings of texts with the PyTorch model. Only the text tower and its projection
+    are loaded, since the vision weights are never used to embed a query. The embeddings are the same as the ones of
+    CLIPModel.get_text_features, so they are compatible with the vectors stored by the Importer
+    """
+    def __init__(self, hf_model: str, dtype: str = "float32", num_threads: Optional[int] = None):
+        """
+        :param hf_model: the huggingface model to extract the embedding of the texts, or the directory of its text
+        encoder prepared by model_export.prepare_text_encoder
+        :param dtype: the dtype of the weights, float32 or bfloat16
+        :param num_threads: the intra-op threads of each forward pass, None for the torch default. It is a process-wide
+        setting of torch
+        """
+        import torch
+        from transformers import CLIPTextModelWithProjection, CLIPTokenizerFast
+
+        if dtype not in TORCH_DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}' for the torch encoder, it must be one of {list(TORCH_DTYPES)}")
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.tokenizer = CLIPTokenizerFast.from_pretrained(hf_model)
+        self.model = CLIPTextModelWithProjection.from_pretrained(hf_model, torch_dtype=getattr(torch, dtype))
+        self.model.eval()
+
+    def tokenize(self, texts: list[str]) -> dict[str, "torch.Tensor"]:
+        """
+        :param texts: the texts to tokenize
+        :return: the model inputs
+        """
+        # a query longer than the 77 positions of CLIP would fail the whole batch, as in the Importer it is truncated
+        return self.tokenizer(texts, padding=True, truncation=True, return_tensors="pt")
+
+    def encode(self, inputs: dict[str, "torch.Tensor"]) -> np.ndarray:
+        """
+        :param inputs: the tokenized texts
+        :return: a float32 matrix with one embedding per text
+        """
+        import torch  # already loaded with the model, this is a lookup in sys.modules
+
+        with torch.inference_mode():
+            return self.model(**inputs).text_embeds.float().numpy()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        :param texts: the texts to embed
+        :return: a float32 matrix with one embedding per text
+        """
+        return self.encode(self.tokenize(texts))
+
+
+class OnnxTextEncoder(object):
+    """
+    A class to extract the clip embeddings of texts with an ONNX Runtime export of the text tower. The export is
+    produced offline by model_export.export_onnx_text_encoder
+    """
+    def __init__(self, model_dir: str, quantized: bool = False, num_threads: Optional[int] = None):
+        """
+        :param model_dir: the directory with the exported model and the tokenizer
+        :param quantized: whether to load the dynamically int8-quantized variant of the model
+        :param num_threads: the intra-op threads of the ONNX Runtime session, None for the runtime default
+        """
+        import onnxruntime  # only needed by the nodes that serve the ONNX backends
+        from transformers import CLIPTokenizerFast
+
+        model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        session_options = onnxruntime.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+        self.tokenizer = CLIPTokenizerFast.from_pretrained(model_dir)
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, model_file),
+                                                    sess_options=session_options,
+                                                    providers=["CPUExecutionProvider"])
+
+    def tokenize(self, texts: list[str]) -> dict[str, np.ndarray]:
+        """
+        :param texts: the texts to tokenize
+        :return: the model inputs
+        """
+        inputs = self.tokenizer(texts, padding=True, truncation=True, return_tensors="np")
+        return {"input_ids": inputs["input_ids"].astype(np.int64),
+                "attention_mask": inputs["attention_mask"].astype(np.int64)}
+
+    def encode(self, inputs: dict[str, np.ndarray]) -> np.ndarray:
+        """
+        :param inputs: the tokenized texts
+        :return: a float32 matrix with one embedding per text
+        """
+        return self.session.run(["text_embeds"], inputs)[0]
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        :param texts: the texts to embed
+        :return: a float32 matrix with one embedding per text
+        """
+        return self.encode(self.tokenize(texts))
+
+
+def build_text_encoder(backend: str,
+                       hf_model: str,
+                       onnx_model_dir: Optional[str] = None,
+                       dtype: str = "float32",
+                       num_threads: Optional[int] = None,
+                       prepared_model_dir: Optional[str] = None):
+    """
+    Create the text encoder of the given backend
+    :param backend: one of 'torch', 'onnx' or 'onnx_int8'
+    :param hf_model: the huggingface model, used by the torch backend
+    :param onnx_model_dir: the directory of the ONNX export, used by the onnx backends
+    :param dtype: the dtype of the weights of the torch backend, float32 or bfloat16
+    :param num_threads: the intra-op threads of each forward pass, None for the runtime default
+    :param prepared_model_dir: the directory of the text encoder of hf_model prepared by
+    model_export.prepare_text_encoder. The torch backend loads it instead of hf_model when it exists
+    :return: the text encoder
+    """
+    if backend == "torch":
+        return TorchTextEncoder(hf_model=_prepared_or_hub_model(hf_model, prepared_model_dir), dtype=dtype,
+                                num_threads=num_threads)
+    if backend in ("onnx", "onnx_int8"):
+        if not onnx_model_dir:
+            raise ValueError(f"The '{backend}' encoder backend requires the directory of the ONNX export")
+        return OnnxTextEncoder(model_dir=onnx_model_dir, quantized=backend == "onnx_int8", num_threads=num_threads)
+    raise ValueError(f"Unknown encoder backend '{backend}', it must be one of {ENCODER_BACKENDS}")
+
+
+def _prepared_or_hub_model(hf_model: str, prepared_model_dir: Optional[str]) -> str:
+    """
+    :param hf_model: the huggingface model
+    :param prepared_model_dir: the directory of its prepared text encoder, if any
+    :return: the prepared directory if it has been prepared, otherwise hf_model, which is resolved through the
+    huggingface cache and the hub
+    """
+    if not prepared_model_dir:
+        return hf_model
+    if os.path.isfile(os.path.join(prepared_model_dir, "config.json")):
+        return prepared_model_dir
+    logger.warning("The prepared model directory '%s' does not exist, loading '%s' instead. Run "
+                   "scripts/prepare_model.py to create it", prepared_model_dir, hf_model)
+    return hf_model
+
+
+def compare_embeddings(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """
+    :param reference: the embeddings of the reference encoder, one row per text
+    :param candidate: the embeddings of the candidate encoder, one row per text
+    :return: the cosine similarity between the two embeddings of each text
+    """
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return np.sum(reference * candidate, axis=1)
+
+
+def top_k_overlap(reference_ids: list[list], candidate_ids: list[list]) -> np.ndarray:
+    """
+    :param reference_ids: the ids retrieved with the reference encoder, one list per query
+    :param candidate_ids: the ids retrieved with the candidate encoder, one list per query
+    :return: the fraction of the reference top-k that is also retrieved with the candidate encoder, per query
+    """
+    return np.array([len(set(reference) & set(candidate)) / max(len(reference), 1)
+                     for reference, candidate in zip(reference_ids, candidate_ids)])
@@ -0,0 +1,85 @@
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from transformers import AutoImageProcessor
+
+# The preprocessing of CLIPImageProcessor, split in two halves. The per-image half decodes, resizes and crops a jpeg to
+# a small uint8 array and runs in the download threads or the embedding workers, PIL releases the GIL while it decodes
+# and resizes. The per-batch half rescales and normalizes the whole batch as a single numpy operation.
+
+# processor: the image processor of the model on the decoded images. fast: the same pixel values, up to float rounding,
+# computed by ImagePreprocessor. fast_draft: the jpegs are also decoded at a reduced scale
+PREPROCESSING_MODES = ("processor", "fast", "fast_draft")
+
+
+class ImagePreprocessor(object):
+    """
+    A class to turn encoded images into the pixel values of a clip model, with the same resize, center crop and
+    normalization as the image processor of the model. In draft mode the jpegs are decoded at a reduced scale, the
+    smallest scale whose image is still larger than the resized one, so a 640x480 COCO image is decoded at 320x240 for
+    a 224 model. The pixel values then differ slightly from the ones of the image processor, see
+    scripts/check_preprocessing.py
+    """
+    def __init__(self, hf_model: str, draft: bool = True):
+        """
+        :param hf_model: the huggingface model whose image processor configuration is reproduced
+        :param draft: whether to decode the jpegs at a reduced scale. Without it the pixel values match the ones of the
+        image processor up to float rounding
+        """
+        processor = AutoImageProcessor.from_pretrained(hf_model)
+        if not (processor.do_resize and processor.do_center_crop and "shortest_edge" in processor.size):
+            raise ValueError(f"The image processor of '{hf_model}' does not resize the shortest edge and center crop, "
+                             f"it cannot be reproduced")
+        self.shortest_edge = processor.size["shortest_edge"]
+        self.crop_height = processor.crop_size["height"]
+        self.crop_width = processor.crop_size["width"]
+        self.resample = Image.Resampling(processor.resample)
+        self.draft = draft
+        scale = processor.rescale_factor if processor.do_rescale else 1.0
+        mean = np.asarray(processor.image_mean if processor.do_normalize else 0.0, dtype=np.float32)
+        std = np.asarray(processor.image_std if processor.do_normalize else 1.0, dtype=np.float32)
+        # (pixel * scale - mean) / std folded into a single multiply-add per channel
+        self.multiplier = (scale / std).astype(np.float32)
+        self.offset = (-mean / std).astype(np.float32)
+
+    def resized_size(self, width: int, height: int) -> tuple[int, int]:
+        """
+        :param width: the width of the original image
+        :param height: the height of the original image
+        :return: the width and the height of the image with its shortest edge resized, rounded as the image processor
+        """
+        short, long = (width, height) if width <= height else (height, width)
+        new_short, new_long = self.shortest_edge, int(self.shortest_edge * long / short)
+        return (new_short, new_long) if width <= height else (new_long, new_short)
+
+    def load(self, content: bytes) -> np.ndarray:
+        """
+        decode, resize and center crop an encoded image
+        :param content: the encoded image
+        :return: the crop, a uint8 array of shape (crop_height, crop_width, 3)
+        """
+        image = Image.open(BytesIO(content))
+        width, height = self.resized_size(*image.size)  # from the original size, a draft only changes the decoding
+        if self.draft:
+            image.draft("RGB", (width, height))  # a no-op for the formats other than jpeg
+        image = image.convert("RGB")
+        if image.size != (width, height):
+            image = image.resize((width, height), resample=self.resample)
+        if width < self.crop_width or height < self.crop_height:  # padded with zeros around it, as the image processor
+            canvas_width, canvas_height = max(width, self.crop_width), max(height, self.crop_height)
+            canvas = Image.new("RGB", (canvas_width, canvas_height))
+            canvas.paste(image, ((canvas_width - width) // 2, (canvas_height - height) // 2))
+            image, width, height = canvas, canvas_width, canvas_height
+        top, left = (height - self.crop_height) // 2, (width - self.crop_width) // 2
+        return np.asarray(image.crop((left, top, left + self.crop_width, top + self.crop_height)))
+
+    def pixel_values(self, crops: list[np.ndarray]) -> np.ndarray:
+        """
+        rescale and normalize a batch of crops
+        :param crops: the uint8 crops returned by load
+        :return: the float32 pixel values of the batch, shape (batch, 3, crop_height, crop_width)
+        """
+        batch = np.stack(crops).astype(np.float32)
+        batch *= self.multiplier
+        batch += self.offset
+        return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
@@ -0,0 +1,277 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import Any, Iterable, Optional
+import numpy as np
+from qdrant_client import QdrantClient
+from img2textsemengine.vector_db.collection_meta import read_collection_meta
+from img2textsemengine.vector_db.payload_filter import PayloadIndex, SearchFilter, with_url_fields
+
+# A local index is a folder with a manifest, one raw L2-normalized matrix per named vector, and the ids/payloads of the
+# points serialized as json one after the other, plus an offsets array to look up a single point. Every file is
+# memory-mapped read-only, so the gunicorn workers of a node share the same pages of the OS page cache. The index
+# folder is a symlink to the folder of the current build, so a rebuild replaces it with a single rename.
+MANIFEST_FILE = "manifest.json"
+PAYLOADS_FILE = "payloads.bin"
+OFFSETS_FILE = "payload_offsets.npy"
+INDEX_DTYPES = ("float32", "float16")
+
+
+def _vectors_file(vector_name: str) -> str:
+    return f"{vector_name}.bin"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def build_local_index(index_dir: str,
+                      chunks: Iterable[tuple[list, dict[str, np.ndarray], list[dict[str, Any]]]],
+                      vector_sizes: dict[str, int],
+                      dtype: str = "float32",
+                      version: Optional[str] = None,
+                      projection: Optional[dict[str, str]] = None) -> int:
+    """
+    Write a local index from chunks of points. The index is built in a folder of its own, and index_dir, a symlink,
+    is then pointed at it atomically, so the searchers never open a half-written or a missing index
+    :param index_dir: the folder of the index
+    :param chunks: an iterable of (ids, named vectors, payloads) chunks
+    :param vector_sizes: the size of each named vector
+    :param dtype: the dtype of the stored vectors, float32 or float16
+    :param version: the version of the collection the points come from
+    :param projection: the projections the vectors are reduced with, the 'projection' field of the metadata of the
+    collection. The searchers apply them to the queries
+    :return: the number of indexed points
+    """
+    if dtype not in INDEX_DTYPES:
+        raise ValueError(f"Unsupported local index dtype '{dtype}', it must be one of {INDEX_DTYPES}")
+    tmp_dir = f"{index_dir.rstrip(os.sep)}.v-{uuid.uuid4().hex}"
+    os.makedirs(tmp_dir)
+    count = 0
+    offsets = [0]
+    vector_files = {name: open(os.path.join(tmp_dir, _vectors_file(name)), "wb") for name in vector_sizes}
+    try:
+        with open(os.path.join(tmp_dir, PAYLOADS_FILE), "wb") as payloads_file:
+            for ids, vectors, payloads in chunks:
+                for name, vector_file in vector_files.items():
+                    vector_file.write(_normalize(np.asarray(vectors[name], dtype=np.float32)).astype(dtype).tobytes())
+                for point_id, payload in zip(ids, payloads):
+                    record = json.dumps({"id": point_id, "payload": with_url_fields(payload)}).encode("utf-8")
+                    payloads_file.write(record)
+                    offsets.append(offsets[-1] + len(record))
+                count += len(ids)
+    finally:
+        for vector_file in vector_files.values():
+            vector_file.close()
+    np.save(os.path.join(tmp_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as manifest_file:
+        json.dump({"vectors": vector_sizes, "count": count, "dtype": dtype,
+                   "version": version or uuid.uuid4().hex, "projection": projection}, manifest_file)
+    _swap_index(index_dir, tmp_dir)
+    return count
+
+
+def _swap_index(index_dir: str, new_dir: str) -> None:
+    """
+    point the index_dir symlink at a new build and delete the previous one. The workers that still map the old files
+    keep reading them until they reload
+    :param index_dir: the folder of the index, a symlink
+    :param new_dir: the folder of the new build, next to it
+    :return: None
+    """
+    link = f"{index_dir.rstrip(os.sep)}.link-{uuid.uuid4().hex}"
+    os.symlink(os.path.basename(new_dir), link)  # relative, so the builds can be moved along with the link
+    old_dir = os.path.realpath(index_dir) if os.path.islink(index_dir) else None
+    if os.path.isdir(index_dir) and not os.path.islink(index_dir):
+        # a folder built before the symlinks is moved away first, the only swap that is not atomic
+        old_dir = f"{index_dir.rstrip(os.sep)}.old-{uuid.uuid4().hex}"
+        os.rename(index_dir, old_dir)
+    os.replace(link, index_dir)
+    if old_dir is not None and old_dir != os.path.realpath(new_dir):
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def build_local_index_from_qdrant(qdrant_client: QdrantClient,
+                                  collection_name: str,
+                                  index_dir: str,
+                                  dtype: str = "float32",
+                                  batch_size: int = 1024) -> int:
+    """
+    Sync a local index with the points of a QDrant collection, scrolling through it
+    :param qdrant_client: the qdrant client
+    :param collection_name: the collection to copy
+    :param index_dir: the folder of the index
+    :param dtype: the dtype of the stored vectors, float32 or float16
+    :param batch_size: the number of points per scroll request
+    :return: the number of indexed points
+    """
+    vectors_config = qdrant_client.get_collection(collection_name).config.params.vectors
+    vector_sizes = {name: params.size for name, params in vectors_config.items()}
+
+    def scroll():
+        offset = None
+        while True:
+            points, offset = qdrant_client.scroll(collection_name=collection_name, limit=batch_size, offset=offset,
+                                                  with_payload=True, with_vectors=True)
+            if points:
+                yield ([point.id for point in points],
+                       {name: np.asarray([point.vector[name] for point in points], dtype=np.float32)
+                        for name in vector_sizes},
+                       [point.payload for point in points])
+            if offset is None:
+                break
+
+    meta = read_collection_meta(qdrant_client, collection_name)
+    return build_local_index(index_dir=index_dir, chunks=scroll(), vector_sizes=vector_sizes, dtype=dtype,
+                             version=meta.get("version"), projection=meta.get("projection"))
+
+
+def build_local_index_from_snapshot(snapshot_dir: str, index_dir: str, dtype: str = "float32") -> int:
+    """
+    Build a local index from a snapshot written by the Importer
+    :param snapshot_dir: the folder of the snapshot
+    :param index_dir: the folder of the index
+    :param dtype: the dtype of the stored vectors, float32 or float16
+    :return: the number of indexed points
+    """
+    from img2textsemengine.vector_db.snapshot import SnapshotReader  # pyarrow is not needed to serve the index
+
+    reader = SnapshotReader(snapshot_dir)
+    chunks = ((ids, vectors, payloads.to_pylist()) for ids, vectors, payloads in reader.shards())
+    return build_local_index(index_dir=index_dir, chunks=chunks, vector_sizes=reader.vector_sizes, dtype=dtype,
+                             projection=reader.manifest.get("projection"))
+
+
+class LocalVectorIndex(object):
+    """
+    A class to answer exact top-k cosine similarity searches over a memory-mapped local index
+    """
+    def __init__(self, index_dir: str, chunk_rows: int = 65536):
+        """
+        :param index_dir: the folder of the index
+        :param chunk_rows: the number of stored vectors scored at once, it bounds the temporary memory of a search
+        """
+        self.index_dir = os.path.realpath(index_dir)  # every file is read from the same build
+        self.chunk_rows = chunk_rows
+        self._payload_index = None  # built by the first filtered search
+        self._payload_index_lock = threading.Lock()
+        with open(os.path.join(self.index_dir, MANIFEST_FILE), "r", encoding="utf-8") as manifest_file:
+            self.manifest = json.load(manifest_file)
+        count = self.manifest["count"]
+        self.vectors, self.payloads = {}, None
+        if count:  # an empty file cannot be memory-mapped
+            self.vectors = {name: np.memmap(os.path.join(self.index_dir, _vectors_file(name)),
+                                            dtype=self.manifest["dtype"], mode="r", shape=(count, size))
+                            for name, size in self.manifest["vectors"].items()}
+            self.payloads = np.memmap(os.path.join(self.index_dir, PAYLOADS_FILE), dtype=np.uint8, mode="r")
+        self.offsets = np.load(os.path.join(self.index_dir, OFFSETS_FILE), mmap_mode="r")
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    def __len__(self) -> int:
+        return self.manifest["count"]
+
+    def __top_k(self,
+                vector_name: str,
+                queries: np.ndarray,
+                k: int,
+                rows: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        score the stored vectors chunk by chunk, keeping only the running top-k of each query, so the temporary memory
+        is bounded by chunk_rows whatever the size of the index
+        :param vector_name: the named vector to search
+        :param queries: the L2-normalized float32 queries, one per row
+        :param k: the number of results of each query, at most the number of scored vectors
+        :param rows: the sorted positions of the stored vectors to score, None for all of them
+        :return: the scores and the positions of the k best vectors of each query, best first, both (len(queries), k)
+        """
+        matrix = self.vectors[vector_name]
+        # the vectors of a narrow filter are gathered, a broad filter reads every vector in order, which is cheaper than
+        # gathering most of them
+        gather = rows is not None and 2 * len(rows) <= len(matrix)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_positions = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(rows) if gather else len(matrix), self.chunk_rows):
+            if gather:
+                positions = rows[start:start + self.chunk_rows]
+                chunk = matrix[positions]  # only the pages of the matching points are read
+            else:
+                chunk = matrix[start:start + self.chunk_rows]
+                positions = np.arange(start, start + len(chunk))
+            scores = queries @ np.asarray(chunk, dtype=np.float32).T  # float16 is scored in float32
+            if rows is not None and not gather:
+                matching = rows[np.searchsorted(rows, start):np.searchsorted(rows, start + len(chunk))]
+                scores, positions = scores[:, matching - start], matching
+            if scores.shape[1] > k:  # the top-k of the chunk, merged below with the running one
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores, positions = np.take_along_axis(scores, top, axis=1), positions[top]
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_positions = np.concatenate([best_positions, np.broadcast_to(positions, scores.shape)], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_positions = np.take_along_axis(best_positions, top, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_positions, order, axis=1)
+
+    @property
+    def payload_index(self) -> PayloadIndex:
+        """
+        :return: the index of the filtered payload fields. The payloads are scanned once, by the first filtered search
+        """
+        with self._payload_index_lock:
+            if self._payload_index is None:
+                self._payload_index = PayloadIndex(self.point(position)["payload"] for position in range(len(self)))
+        return self._payload_index
+
+    def point(self, position: int) -> dict[str, Any]:
+        """
+        :param position: the row of the point in the index
+        :return: the id and the payload of the point
+        """
+        return json.loads(self.payloads[self.offsets[position]:self.offsets[position + 1]].tobytes())
+
+    def search_batch(self,
+                     vector_names: list[str],
+                     queries: list[list[float]],
+                     limits: list[int],
+                     filters: Optional[list[Optional[SearchFilter]]] = None
+                     ) -> list[list[tuple[float, dict[str, Any]]]]:
+        """
+        Exact top-k search of many queries. The queries of the same named vector and filter are scored with a single
+        matmul. A filtered query only scores the vectors of the matching points, so a narrow filter is cheaper than no
+        filter
+        :param vector_names: the named vector to search for each query
+        :param queries: the query vectors
+        :param limits: the number of results of each query
+        :param filters: the payload conditions of each query, None for the queries without any
+        :return: the (score, payload) pairs of the top-k points of each query, best first, in the input order
+        """
+        results = [[] for _ in queries]
+        if not len(self):
+            return results
+        filters = [None if search_filter is None or search_filter.empty else search_filter
+                   for search_filter in filters or [None] * len(queries)]
+        groups = {}
+        for index, (vector_name, search_filter) in enumerate(zip(vector_names, filters)):
+            groups.setdefault((vector_name, search_filter and search_filter.key), []).append(index)
+        for (vector_name, _), positions in groups.items():
+            search_filter = filters[positions[0]]
+            rows = None if search_filter is None else self.payload_index.rows(search_filter)
+            if rows is not None and not len(rows):
+                continue
+            normalized = _normalize(np.asarray([queries[index] for index in positions], dtype=np.float32))
+            k = min(max(limits[index] for index in positions), len(self) if rows is None else len(rows))
+            if k <= 0:
+                continue
+            scores, points = self.__top_k(vector_name, normalized, k, rows=rows)
+            for row, index in enumerate(positions):
+                limit = max(limits[index], 0)  # the top-k of a query is the head of the top-k of its group
+                results[index] = [(float(score), self.point(position)["payload"])
+                                  for score, position in zip(scores[row][:limit], points[row][:limit])]
+        return results
@@ -0,0 +1,67 @@
+import os
+import torch
+from transformers import CLIPTextModelWithProjection, CLIPTokenizerFast
+from img2textsemengine.vector_db.encoders import ONNX_INT8_MODEL_FILE, ONNX_MODEL_FILE
+
+# The offline steps that turn a huggingface clip model into the artifacts loaded by the text encoders of the API. They
+# run once per model, e.g. when the image of the service is built, so that the replicas never resolve the model through
+# the hub nor load the vision tower
+
+
+def prepare_text_encoder(hf_model: str, output_dir: str) -> None:
+    """
+    Save the text tower of a clip model, its projection and the tokenizer in a local directory, with the weights in
+    safetensors. The torch backend loads it directly, memory-mapping the weights, and it is a fraction of the size of
+    the full checkpoint
+    :param hf_model: the huggingface model to prepare
+    :param output_dir: the directory to store the artifacts
+    :return: None
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    CLIPTokenizerFast.from_pretrained(hf_model).save_pretrained(output_dir)
+    model = CLIPTextModelWithProjection.from_pretrained(hf_model)
+    model.save_pretrained(output_dir, safe_serialization=True)
+
+
+class _TextFeatures(torch.nn.Module):
+    """
+    Wrap the text tower of the clip model, so that the exported graph returns only the projected text embeddings
+    """
+    def __init__(self, model: CLIPTextModelWithProjection):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).text_embeds
+
+
+def export_onnx_text_encoder(hf_model: str, output_dir: str, opset: int = 14) -> None:
+    """
+    Export the text tower of a clip model to ONNX, together with its dynamically int8-quantized variant and
+    the tokenizer, so that the onnx backends can be served without torch
+    :param hf_model: the huggingface model to export
+    :param output_dir: the directory to store the artifacts
+    :param opset: the ONNX opset version
+    :return: None
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = CLIPTokenizerFast.from_pretrained(hf_model)
+    model = CLIPTextModelWithProjection.from_pretrained(hf_model)
+    model.eval()
+    dummy_inputs = tokenizer(["a photo of a dog", "a cat playing alone"], padding=True, return_tensors="pt")
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    torch.onnx.export(_TextFeatures(model),
+                      (dummy_inputs["input_ids"], dummy_inputs["attention_mask"]),
+                      model_path,
+                      input_names=["input_ids", "attention_mask"],
+                      output_names=["text_embeds"],
+                      dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                    "attention_mask": {0: "batch", 1: "sequence"},
+                                    "text_embeds": {0: "batch"}},
+                      opset_version=opset)
+    quantize_dynamic(model_input=model_path,
+                     model_output=os.path.join(output_dir, ONNX_INT8_MODEL_FILE),
+                     weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(output_dir)
@@ -0,0 +1,173 @@
+import re
+from functools import reduce
+from typing import Any, Iterable, Optional
+from urllib.parse import urlsplit
+import numpy as np
+from qdrant_client.http import models
+
+# The payload fields the searches can be filtered on, and the fields a client can ask for in the results. The Importer
+# derives the source, i.e. the host, and the url prefixes of every image from its url, and indexes them with the
+# captions, so a filtered search only scores the matching points. This module is on the serving path, it only needs
+# numpy and the qdrant models.
+CAPTIONS_FIELD = "possible_answers"
+IMG_URL_FIELD = "img_url"
+SOURCE_FIELD = "source"
+URL_PREFIXES_FIELD = "url_prefixes"
+# the fields of a result, in the order of the (img_url, captions) tuples of the Searcher, and their payload fields
+RESULT_FIELDS = {"img_url": IMG_URL_FIELD, "captions": CAPTIONS_FIELD}
+_WORD = re.compile(r"[^\W_]+")  # the words of the full-text index of QDrant: runs of letters and digits
+
+
+def url_payload(url: str) -> dict[str, Any]:
+    """
+    :param url: the url of an image
+    :return: the payload fields derived from the url: its lower-cased host, and the url truncated after the host and
+    after each folder of its path, e.g. ['http://host', 'http://host/val2014'], so a prefix is matched exactly
+    """
+    parts = urlsplit(url)
+    root = f"{parts.scheme}://{parts.netloc}"
+    prefixes = [root]
+    for folder in [folder for folder in parts.path.split("/") if folder][:-1]:  # the last part is the file
+        prefixes.append(f"{prefixes[-1]}/{folder}")
+    return {SOURCE_FIELD: parts.netloc.lower(), URL_PREFIXES_FIELD: prefixes}
+
+
+def with_url_fields(payload: dict[str, Any]) -> dict[str, Any]:
+    """
+    :param payload: the payload of a point
+    :return: the payload with the fields derived from its url, for the points imported before they existed
+    """
+    if SOURCE_FIELD in payload or IMG_URL_FIELD not in payload:
+        return payload
+    return {**payload, **url_payload(payload[IMG_URL_FIELD])}
+
+
+def _words(text: str) -> list[str]:
+    return _WORD.findall(text.lower())
+
+
+class SearchFilter(object):
+    """
+    A class to represent the payload conditions of a search. All the defined conditions must hold
+    """
+    def __init__(self,
+                 caption_text: Optional[str] = None,
+                 caption_words: Optional[list[str]] = None,
+                 sources: Optional[list[str]] = None,
+                 url_prefix: Optional[str] = None):
+        """
+        :param caption_text: every word of the text must be in the captions of the image, in any order
+        :param caption_words: at least one of the words must be in the captions of the image
+        :param sources: the image must be hosted by one of the hosts, e.g. 'images.cocodataset.org'
+        :param url_prefix: the url of the image must start with it. The prefix ends after the host or after a folder
+        """
+        self.caption_text = caption_text.strip() if caption_text else None
+        self.caption_words = sorted({word.lower() for word in caption_words or [] if word.strip()}) or None
+        self.sources = sorted({source.lower() for source in sources or []}) or None
+        self.url_prefix = url_prefix.rstrip("/") if url_prefix else None
+        if self.caption_text is not None and not _words(self.caption_text):
+            raise ValueError(f"The caption text '{caption_text}' has no words to match")
+
+    @property
+    def empty(self) -> bool:
+        return self.key is None
+
+    @property
+    def key(self) -> Optional[tuple]:
+        """
+        :return: a hashable form of the conditions, part of the cache keys of the results. None without conditions
+        """
+        key = (self.caption_text and tuple(_words(self.caption_text)),
+               self.caption_words and tuple(self.caption_words),
+               self.sources and tuple(self.sources),
+               self.url_prefix)
+        return key if any(condition is not None for condition in key) else None
+
+    def to_qdrant(self) -> Optional[models.Filter]:
+        """
+        :return: the QDrant filter of the conditions, None without conditions
+        """
+        must = []
+        if self.caption_text is not None:
+            must.append(models.FieldCondition(key=CAPTIONS_FIELD, match=models.MatchText(text=self.caption_text)))
+        if self.caption_words is not None:
+            must.append(models.Filter(should=[models.FieldCondition(key=CAPTIONS_FIELD,
+                                                                    match=models.MatchText(text=word))
+                                              for word in self.caption_words]))
+        if self.sources is not None:
+            must.append(models.FieldCondition(key=SOURCE_FIELD, match=models.MatchAny(any=self.sources)))
+        if self.url_prefix is not None:
+            must.append(models.FieldCondition(key=URL_PREFIXES_FIELD, match=models.MatchValue(value=self.url_prefix)))
+        return models.Filter(must=must) if must else None
+
+
+class PayloadIndex(object):
+    """
+    A class to index the filtered payload fields of the points of a local index the way the payload indexes of QDrant
+    do: the positions of the points of every caption word, source and url prefix. It is the 'local' search backend
+    counterpart of collection.create_payload_indexes
+    """
+    def __init__(self, payloads: Iterable[dict[str, Any]]):
+        """
+        :param payloads: the payload of every point, in the order of the points
+        """
+        postings = {CAPTIONS_FIELD: {}, SOURCE_FIELD: {}, URL_PREFIXES_FIELD: {}}
+        for position, payload in enumerate(payloads):
+            captions = payload.get(CAPTIONS_FIELD) or []
+            values = {CAPTIONS_FIELD: set(_words(" ".join(captions if isinstance(captions, list) else [captions]))),
+                      SOURCE_FIELD: [payload[SOURCE_FIELD]] if SOURCE_FIELD in payload else [],
+                      URL_PREFIXES_FIELD: payload.get(URL_PREFIXES_FIELD) or []}
+            for field, field_values in values.items():
+                for value in field_values:
+                    postings[field].setdefault(value, []).append(position)
+        self.postings = {field: {value: np.asarray(positions, dtype=np.int64) for value, positions in values.items()}
+                         for field, values in postings.items()}
+
+    def __positions(self, field: str, value: str) -> np.ndarray:
+        return self.postings[field].get(value, np.empty(0, dtype=np.int64))
+
+    def __all_words(self, text: str) -> np.ndarray:
+        """
+        :return: the sorted positions of the points whose captions have every word of the text
+        """
+        return reduce(lambda left, right: np.intersect1d(left, right, assume_unique=True),
+                      [self.__positions(CAPTIONS_FIELD, word) for word in _words(text)])
+
+    def rows(self, search_filter: SearchFilter) -> np.ndarray:
+        """
+        :param search_filter: the payload conditions of a search
+        :return: the sorted positions of the points that match all of them
+        """
+        matches = []
+        if search_filter.caption_text is not None:
+            matches.append(self.__all_words(search_filter.caption_text))
+        if search_filter.caption_words is not None:
+            matches.append(np.unique(np.concatenate([self.__all_words(word) for word in search_filter.caption_words
+                                                     if _words(word)] or [np.empty(0, dtype=np.int64)])))
+        if search_filter.sources is not None:
+            matches.append(np.unique(np.concatenate([self.__positions(SOURCE_FIELD, source)
+                                                     for source in search_filter.sources])))
+        if search_filter.url_prefix is not None:
+            matches.append(self.__positions(URL_PREFIXES_FIELD, search_filter.url_prefix))
+        return reduce(lambda left, right: np.intersect1d(left, right, assume_unique=True), matches)
+
+
+def payload_selector(fields: tuple[str, ...]) -> models.PayloadSelectorInclude:
+    """
+    :param fields: the result fields a client asked for, see RESULT_FIELDS
+    :return: the selector of the payload fields QDrant returns with each result
+    """
+    return models.PayloadSelectorInclude(include=[RESULT_FIELDS[field] for field in fields])
+
+
+def resolve_fields(fields: Optional[list[str]]) -> tuple[str, ...]:
+    """
+    :param fields: the result fields a client asked for, None for all of them
+    :return: the fields, validated and in the order of RESULT_FIELDS, part of the cache keys of the results
+    """
+    if fields is None:
+        return tuple(RESULT_FIELDS)
+    unknown = set(fields) - set(RESULT_FIELDS)
+    if unknown or not fields:
+        raise ValueError(f"The fields must be a non-empty subset of {list(RESULT_FIELDS)}, got {fields}")
+    return tuple(field for field in RESULT_FIELDS if field in fields)
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Optional
+from img2textsemengine.utils.metrics import IMPORTER_STAGE_ITEMS, IMPORTER_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()  # sentinel that tells the writer thread to flush and exit
+
+
+class StageStats(object):
+    """
+    A class to keep the throughput statistics of a single stage of the import pipeline. Every call is also exported
+    as a prometheus metric labelled with the stage name
+    """
+    def __init__(self, name: str):
+        """
+        :param name: the name of the stage, e.g. 'download', 'inference' or 'upsert'
+        """
+        self.name = name
+        self.items = 0
+        self.calls = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()  # the download stage records from several threads
+
+    def record(self, items: int, seconds: float) -> None:
+        """
+        Record that the stage processed some items
+        :param items: the number of processed items
+        :param seconds: the time spent to process them
+        :return: None
+        """
+        with self._lock:
+            self.items += items
+            self.calls += 1
+            self.busy_seconds += seconds
+        IMPORTER_STAGE_SECONDS.labels(stage=self.name).observe(seconds)
+        IMPORTER_STAGE_ITEMS.labels(stage=self.name).inc(items)
+
+    def summary(self, wall_seconds: float) -> str:
+        """
+        :param wall_seconds: the wall clock duration of the whole import
+        :return: a human readable summary of the stage throughput
+        """
+        busy_rate = self.items / self.busy_seconds if self.busy_seconds else 0.0
+        wall_rate = self.items / wall_seconds if wall_seconds else 0.0
+        return (f"{self.name}: {self.items} items in {self.calls} calls, busy {self.busy_seconds:.1f}s, "
+                f"{busy_rate:.1f} items/busy-s, {wall_rate:.1f} items/s")
+
+
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    """
+    Group an iterable into lists of at most batch_size elements
+    :param items: the items to group
+    :param batch_size: the maximum size of each batch
+    :return: an iterator over the batches
+    """
+    iterator = iter(items)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def bounded_map(func: Callable[[Any], Any],
+                items: Iterable,
+                max_workers: int,
+                max_pending: int) -> Iterator[Any]:
+    """
+    Apply func to every item in a thread pool, keeping at most max_pending items in flight. The results
+    are yielded in the input order, so a slow consumer applies back-pressure to the workers.
+    :param func: the function to apply
+    :param items: the input items
+    :param max_workers: the number of concurrent threads
+    :param max_pending: the maximum number of submitted but not yet consumed items
+    :return: an iterator over the results
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class BatchWriter(object):
+    """
+    A background thread that accumulates items and writes them in large batches, so the
+    writes overlap with the work of the previous stages
+    """
+    def __init__(self,
+                 write_fn: Callable[[list], None],
+                 batch_size: int,
+                 max_pending: int,
+                 stats: Optional[StageStats] = None):
+        """
+        :param write_fn: the function that writes a batch of items
+        :param batch_size: the number of items per write
+        :param max_pending: the maximum number of queued put() calls before put() blocks
+        :param stats: where to record the throughput of the writes
+        """
+        self.write_fn = write_fn
+        self.batch_size = batch_size
+        self.stats = stats
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self.__run, name="batch-writer", daemon=True)
+        self._error = None
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def put(self, items: list) -> None:
+        """
+        Queue items to be written. Blocks when the writer falls behind
+        :param items: the items to write
+        :return: None
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put(items)
+
+    def close(self) -> None:
+        """
+        Flush the remaining items and wait for the writer thread to finish
+        :return: None
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __write(self, items: list) -> None:
+        start = time.perf_counter()
+        self.write_fn(items)
+        if self.stats is not None:
+            self.stats.record(len(items), time.perf_counter() - start)
+
+    def __run(self) -> None:
+        buffer = []
+        while True:
+            items = self._queue.get()
+            if items is _STOP:
+                break
+            if self._error is not None:
+                continue  # keep draining so that the producer never blocks on a dead writer
+            buffer.extend(items)
+            try:
+                while len(buffer) >= self.batch_size:
+                    self.__write(buffer[:self.batch_size])
+                    buffer = buffer[self.batch_size:]
+            except Exception as error:  # surfaced to the producer on the next put()/close()
+                logger.exception("Batch writer failed")
+                self._error = error
+        if buffer and self._error is None:
+            try:
+                self.__write(buffer)
+            except Exception as error:
+                logger.exception("Batch writer failed")
+                self._error = error
+
+
+class ImportCheckpoint(object):
+    """
+    A class to persist how far an import has progressed, so that an interrupted import resumes where it stopped
+    """
+    def __init__(self, path: str, collection_name: str, dataset_path: str):
+        """
+        :param path: the json file that stores the checkpoint
+        :param collection_name: the collection being imported, a checkpoint of another collection is ignored
+        :param dataset_path: the dataset being imported, a checkpoint of another dataset is ignored
+        """
+        self.path = path
+        self.key = {"collection_name": collection_name, "dataset_path": dataset_path}
+
+    def load(self) -> int:
+        """
+        :return: the index of the first dataset record that has not been imported yet, 0 if there is no checkpoint
+        """
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "r", encoding="utf-8") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if any(checkpoint.get(field) != value for field, value in self.key.items()):
+            logger.warning("Ignoring the checkpoint %s, it belongs to another import", self.path)
+            return 0
+        return checkpoint["next_index"]
+
+    def save(self, next_index: int) -> None:
+        """
+        Atomically store the checkpoint
+        :param next_index: the index of the first dataset record that has not been imported yet
+        :return: None
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as checkpoint_file:
+            json.dump({**self.key, "next_index": next_index}, checkpoint_file)
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
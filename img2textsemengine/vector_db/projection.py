@@ -0,0 +1,108 @@
+import base64
+from io import BytesIO
+from typing import Any, Optional, Union
+import numpy as np
+
+# The stored vectors can be reduced with a PCA projection fitted at import time on a sample of the embeddings. The
+# projections of a collection are stored base64-encoded in its metadata, one per named vector, and the searchers
+# project the query embeddings with the projection of the vector they search. This module is on the serving path, it
+# only needs numpy.
+
+
+class VectorProjection(object):
+    """
+    A class to reduce L2-normalized embeddings to their first principal components. Without whitening, the axes are the
+    ones of the uncentered embeddings, so the dot products, and the cosine similarities of the searches, are kept as
+    well as possible. With whitening, the embeddings are centered and every component is scaled to a unit variance.
+    The projected vectors are compared by cosine similarity, as the original ones
+    """
+    def __init__(self, mean: np.ndarray, components: np.ndarray, scales: Optional[np.ndarray] = None):
+        """
+        :param mean: the mean subtracted from the normalized embeddings, shape (input_dim,). Zeros without whitening
+        :param components: the principal axes, shape (output_dim, input_dim)
+        :param scales: the factor of each component, the inverse of its standard deviation when whitened. None
+        without whitening
+        """
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def output_dim(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dim: int, whiten: bool = False) -> "VectorProjection":
+        """
+        :param vectors: a sample of the embeddings, one row per embedding
+        :param dim: the number of components kept
+        :param whiten: whether to center the embeddings and scale every component to a unit variance
+        :return: the projection fitted on the sample
+        """
+        vectors = _normalize(np.asarray(vectors, dtype=np.float64))
+        if not 0 < dim < vectors.shape[1]:
+            raise ValueError(f"The reduced dimension must be between 1 and {vectors.shape[1] - 1}, got {dim}")
+        if len(vectors) <= dim:
+            raise ValueError(f"A projection to {dim} dimensions needs more than {dim} embeddings, got {len(vectors)}")
+        mean = vectors.mean(axis=0) if whiten else np.zeros(vectors.shape[1])
+        _, singular_values, axes = np.linalg.svd(vectors - mean, full_matrices=False)
+        scales = None
+        if whiten:
+            variances = singular_values[:dim] ** 2 / (len(vectors) - 1)
+            scales = 1.0 / np.sqrt(variances + 1e-12)
+        return cls(mean=mean, components=axes[:dim], scales=scales)
+
+    def transform(self, vectors: Union[np.ndarray, list[list[float]]]) -> np.ndarray:
+        """
+        :param vectors: the embeddings, one row per embedding
+        :return: the projected float32 embeddings, shape (len(vectors), output_dim)
+        """
+        projected = (_normalize(np.asarray(vectors, dtype=np.float32)) - self.mean) @ self.components.T
+        if self.scales is not None:
+            projected *= self.scales
+        return projected
+
+    def to_meta(self) -> str:
+        """
+        :return: the projection as a base64-encoded npz archive, to be stored in the metadata of a collection
+        """
+        arrays = {"mean": self.mean, "components": self.components}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        output = BytesIO()
+        np.savez_compressed(output, **arrays)
+        return base64.b64encode(output.getvalue()).decode("ascii")
+
+    @classmethod
+    def from_meta(cls, encoded: str) -> "VectorProjection":
+        """
+        :param encoded: a projection returned by to_meta
+        :return: the projection
+        """
+        with np.load(BytesIO(base64.b64decode(encoded))) as arrays:
+            return cls(mean=arrays["mean"], components=arrays["components"],
+                       scales=arrays["scales"] if "scales" in arrays else None)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def projections_to_meta(projections: dict[str, VectorProjection]) -> Optional[dict[str, str]]:
+    """
+    :param projections: the projection of each named vector
+    :return: the 'projection' field of the metadata of a collection, None without projections
+    """
+    return {name: projection.to_meta() for name, projection in projections.items()} or None
+
+
+def projections_from_meta(meta: dict[str, Any]) -> dict[str, VectorProjection]:
+    """
+    :param meta: the metadata of a collection, or the manifest of a snapshot or of a local index
+    :return: the projection of each named vector, empty if the vectors are stored as they are
+    """
+    return {name: VectorProjection.from_meta(encoded) for name, encoded in (meta.get("projection") or {}).items()}
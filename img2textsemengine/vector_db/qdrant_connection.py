@@ -0,0 +1,38 @@
+from typing import Any
+import httpx
+
+# The arguments shared by the sync and the async QDrant clients of the Searcher and of the Importer. Over REST the
+# client keeps a pool of keep-alive connections, otherwise every request to a local QDrant opens a new one. Over gRPC
+# the requests are multiplexed on a single HTTP/2 connection, kept alive with pings, and the vectors are sent as packed
+# floats instead of JSON numbers. The in-process QDrant (':memory:') ignores the transport.
+IN_MEMORY_LOCATION = ":memory:"
+
+
+def qdrant_client_args(host: str,
+                       port: int,
+                       prefer_grpc: bool = False,
+                       grpc_port: int = 6334,
+                       max_connections: int = 100,
+                       max_keepalive_connections: int = 20,
+                       keepalive_expiry_seconds: float = 30) -> dict[str, Any]:
+    """
+    :param host: the QDrant host, or ':memory:' for an in-process QDrant
+    :param port: the REST port of the QDrant
+    :param prefer_grpc: whether to send the requests over gRPC instead of REST
+    :param grpc_port: the gRPC port of the QDrant
+    :param max_connections: the maximum number of concurrent REST connections
+    :param max_keepalive_connections: the maximum number of idle REST connections kept open
+    :param keepalive_expiry_seconds: how long an idle REST connection is kept open, also the interval of the gRPC
+    keep-alive pings
+    :return: the keyword arguments of QdrantClient and AsyncQdrantClient
+    """
+    if host == IN_MEMORY_LOCATION:
+        return {"location": host}
+    return {"location": host,
+            "port": port,
+            "grpc_port": grpc_port,
+            "prefer_grpc": prefer_grpc,
+            "limits": httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry_seconds),
+            "grpc_options": {"grpc.keepalive_time_ms": int(keepalive_expiry_seconds * 1000)}}
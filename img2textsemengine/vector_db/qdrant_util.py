@@ -1,11 +1,36 @@
+import hashlib
+import json
+import logging
+import math
+import time
+import uuid
+from typing import Iterable, Iterator, Optional, Union
+import numpy as np
 import requests
-import torch
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-from datasets import load_dataset
 from PIL import Image
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from transformers import AutoTokenizer, CLIPModel, AutoProcessor
+from transformers import AutoConfig
+from img2textsemengine.dataset.sample_file import count_records, iter_records
+from img2textsemengine.vector_db.clip_embedder import ClipEmbedder
+from img2textsemengine.vector_db.collection import VECTOR_NAMES, build_vectors_config, create_payload_indexes
+from img2textsemengine.vector_db.collection_meta import (delete_collection_meta, read_collection_meta,
+                                                         write_collection_meta)
+from img2textsemengine.vector_db.collection_versions import (check_alias, new_version_name, publish_version,
+                                                             resolve_alias)
+from img2textsemengine.vector_db.embedding_workers import EmbeddingWorkerPool
+from img2textsemengine.vector_db.image_preprocessing import PREPROCESSING_MODES
+from img2textsemengine.vector_db.payload_filter import SOURCE_FIELD, url_payload
+from img2textsemengine.vector_db.pipeline import BatchWriter, ImportCheckpoint, StageStats, batched, bounded_map
+from img2textsemengine.vector_db.projection import VectorProjection, projections_from_meta, projections_to_meta
+from img2textsemengine.vector_db.qdrant_connection import qdrant_client_args
+from img2textsemengine.vector_db.snapshot import SnapshotWriter
+
+logger = logging.getLogger(__name__)
+
+IMPORT_MODES = ("shadow", "recreate", "upsert")
 
 
 class Importer(object):
@@ -18,150 +43,490 @@ class Importer(object):
                  collection_name: str,
                  image_vector_size: int,
                  hf_model: str,
-                 dataset_path: str):
+                 dataset_path: str,
+                 batch_size: int = 32,
+                 download_workers: int = 16,
+                 download_timeout: float = 30,
+                 queue_depth: int = 128,
+                 upsert_batch_size: int = 256,
+                 mode: str = "recreate",
+                 id_field: str = "coco_url",
+                 checkpoint_path: Optional[str] = None,
+                 snapshot_dir: Optional[str] = None,
+                 snapshot_shard_size: int = 50_000,
+                 vector_params: Optional[dict[str, dict]] = None,
+                 embedding_workers: int = 1,
+                 worker_threads: Optional[int] = None,
+                 preprocessing: str = "processor",
+                 prefer_grpc: bool = False,
+                 grpc_port: int = 6334,
+                 keep_versions: int = 2,
+                 index_timeout: float = 3600,
+                 check_sample_size: int = 100,
+                 min_self_recall: float = 0.95,
+                 reduced_dim: Optional[int] = None,
+                 whiten: bool = False,
+                 projection_sample_size: int = 10_000):
         """
         Initialize the importer class. Expecially, we establish the qdrant client
         and initializing the clip model that will be used to extract
         the embeddings of the images
         :param host: qdrant host
         :param port: qdrant port
-        :param collection_name: the collection to store the metadata
+        :param collection_name: the collection to store the metadata, or the alias of its versioned collections
         :param image_vector_size: the size of the image vector
         :param hf_model: the model which is responsible for extracting the embeddings of the images/texts
         :param dataset_path: the path of the input dataset
+        :param batch_size: the number of records embedded in a single CLIP forward pass
+        :param download_workers: the number of images downloaded concurrently
+        :param download_timeout: the timeout in seconds of a single image download
+        :param queue_depth: the maximum number of downloaded records waiting to be embedded
+        :param upsert_batch_size: the number of points sent to QDrant in a single upsert request
+        :param mode: 'shadow' to import everything into a new versioned collection, then switch the collection_name
+        alias to it once it is indexed and checked, 'recreate' to drop the collection and import everything from scratch
+        in place, or 'upsert' to add the new and the changed records to the existing collection, skipping the unchanged
+        ones. 'recreate' and 'upsert' write into the collection the alias points to, if any
+        :param id_field: the record field whose value identifies the image. The point ids are derived from it, so the
+        same image always gets the same id
+        :param checkpoint_path: the file that stores the progress of the import. In 'upsert' mode an interrupted import
+        resumes from it. None disables the checkpoints
+        :param snapshot_dir: the folder where the computed points are also written as a snapshot, so that the
+        collection can be rebuilt without computing the embeddings again. None disables the snapshot
+        :param snapshot_shard_size: the number of points per snapshot shard
+        :param vector_params: the HNSW, on-disk and quantization parameters of each named vector, see
+        collection.build_vectors_config. None for the QDrant defaults
+        :param embedding_workers: the number of processes that embed the images. With 1 they are embedded in this
+        process, otherwise every worker process loads its own model and decodes, preprocesses and embeds whole batches
+        :param worker_threads: the torch threads of each embedding worker, None to share the cores among them
+        :param preprocessing: how the images are turned into pixel values: 'processor' for the image processor of the
+        model, 'fast' for the same pixel values computed a batch at a time, 'fast_draft' to also decode the jpegs at a
+        reduced scale, see image_preprocessing
+        :param prefer_grpc: whether to send the requests to QDrant over gRPC, the cheaper transport for bulk upserts of
+        vectors
+        :param grpc_port: the gRPC port of the QDrant
+        :param keep_versions: in 'shadow' mode, the number of previous versioned collections kept for a rollback
+        :param index_timeout: in 'shadow' mode, how long to wait for QDrant to index the new collection
+        :param check_sample_size: in 'shadow' mode, the number of points of the smoke check of the new collection
+        :param min_self_recall: in 'shadow' mode, the fraction of the checked points that must find themselves among
+        the first results of their own vectors for the new collection to go live
+        :param reduced_dim: the size of the stored vectors, reduced with a PCA projection fitted on the first
+        projection_sample_size embedded records. None stores the vectors as they are. The projection is stored in the
+        metadata of the collection, and the searchers apply it to the queries. In 'upsert' mode the projection of the
+        existing collection is kept
+        :param whiten: whether the projection scales every component to a unit variance
+        :param projection_sample_size: the number of records the projection is fitted on
         """
-
-        self.qdrant_client = QdrantClient(location=host, port=port)
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"Unknown import mode '{mode}', it must be one of {IMPORT_MODES}")
+        if embedding_workers < 1:
+            raise ValueError(f"The number of embedding workers must be at least 1, got {embedding_workers}")
+        if preprocessing not in PREPROCESSING_MODES:
+            raise ValueError(f"Unknown preprocessing '{preprocessing}', it must be one of {PREPROCESSING_MODES}")
+        self.qdrant_client = QdrantClient(**qdrant_client_args(host, port, prefer_grpc=prefer_grpc, grpc_port=grpc_port))
         self.collection_name = collection_name
-        self.__init_qdrant_collection(image_vector_size=image_vector_size)
-        # Initialize huggingface's model and processor
-        self.tokenizer = AutoTokenizer.from_pretrained(hf_model)
-        self.model = CLIPModel.from_pretrained(hf_model)
-        self.processor = AutoProcessor.from_pretrained(hf_model)
-        self.dataset = load_dataset("json", data_files=dataset_path)["train"]
+        # the collection the points are written to: a new version of the alias, or the one the alias points to
+        if mode == "shadow":
+            check_alias(self.qdrant_client, collection_name)  # before the import, not once it is complete
+            self.target_collection = new_version_name(collection_name)
+        else:
+            self.target_collection = resolve_alias(self.qdrant_client, collection_name) or collection_name
+        self.hf_model = hf_model
+        self.mode = mode
+        self.keep_versions = keep_versions
+        self.index_timeout = index_timeout
+        self.check_sample_size = check_sample_size
+        self.min_self_recall = min_self_recall
+        self.id_field = id_field
+        self.checkpoint = ImportCheckpoint(path=checkpoint_path,
+                                           collection_name=collection_name,
+                                           dataset_path=dataset_path) if checkpoint_path else None
+        # checked before the collection is created, since in 'recreate' mode it drops the existing one
+        projection_dim = AutoConfig.from_pretrained(hf_model).projection_dim
+        if projection_dim != image_vector_size:
+            raise ValueError(f"The vectors of '{hf_model}' have {projection_dim} dimensions, "
+                             f"but the image_vector_size is {image_vector_size}")
+        if reduced_dim is not None and not 0 < reduced_dim < image_vector_size:
+            raise ValueError(f"The reduced_dim must be between 1 and {image_vector_size - 1}, got {reduced_dim}")
+        if reduced_dim is not None and projection_sample_size <= reduced_dim:
+            raise ValueError(f"The projection to {reduced_dim} dimensions needs a sample larger than {reduced_dim} "
+                             f"records, got {projection_sample_size}")
+        self.image_vector_size = image_vector_size  # the size of the embeddings, before any projection
+        self.reduced_dim = reduced_dim
+        self.whiten = whiten
+        self.projection_sample_size = projection_sample_size
+        self.projections = self.__existing_projections() if mode == "upsert" else {}
+        self.preprocessing = preprocessing
+        if mode == "upsert":
+            self.__check_preprocessing()
+        # Initialize huggingface's model and processor, in this process or in every embedding worker
+        self.embedding_workers = embedding_workers
+        self.worker_threads = worker_threads
+        self.embedder = ClipEmbedder(hf_model=hf_model,
+                                     preprocessing=preprocessing) if embedding_workers == 1 else None
+        # the collection is created by import_data, so that a failed import drops it
+        self.vector_sizes = {name: reduced_dim or image_vector_size for name in VECTOR_NAMES}
+        self.vector_params = vector_params
+        # in 'upsert' mode the snapshot keeps the shards of the previous runs and appends the new points, otherwise a new
+        # snapshot replaces the previous one once the import succeeds
+        self.snapshot = SnapshotWriter(snapshot_dir=snapshot_dir,
+                                       vector_sizes=self.vector_sizes,
+                                       shard_size=snapshot_shard_size,
+                                       reset=mode != "upsert") if snapshot_dir else None
+        self.dataset_path = dataset_path
+        self.batch_size = batch_size
+        self.download_workers = download_workers
+        self.download_timeout = download_timeout
+        self.queue_depth = queue_depth
+        self.upsert_batch_size = upsert_batch_size
+        # a single pooled session shared by all the download threads
+        self.http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=download_workers, pool_maxsize=download_workers)
+        self.http_session.mount("http://", adapter)
+        self.http_session.mount("https://", adapter)
 
-    def __init_qdrant_collection(self, image_vector_size: int) -> None:
+    def __init_qdrant_collection(self, vector_params: Optional[dict[str, dict]]) -> None:
         """
-        Initialize the collection and specifying the vector(s) parameters
-        :param image_vector_size: the size of the image vector
+        Initialize the collection and specifying the vector(s) parameters. In 'upsert' mode an existing collection
+        is kept as it is, in 'shadow' mode a new versioned collection is created next to the live one. The image and
+        the text vectors have the same size, since both towers of clip project to the same space
+        :param vector_params: the index parameters of each named vector
+        :return: None
+        """
+        if self.mode == "upsert" and self.qdrant_client.collection_exists(self.target_collection):
+            return
+        vectors_config = build_vectors_config(self.vector_sizes, vector_params)
+        if self.mode == "recreate":
+            self.qdrant_client.recreate_collection(
+                collection_name=self.target_collection,
+                vectors_config=vectors_config)
+        else:
+            self.qdrant_client.create_collection(
+                collection_name=self.target_collection,
+                vectors_config=vectors_config)
+        if self.mode != "upsert" and self.checkpoint is not None:
+            self.checkpoint.clear()  # the progress of a previous import is gone with the old collection
+        # the vectors of a new collection are not reduced until its projections are fitted
+        write_collection_meta(self.qdrant_client, self.target_collection, projection=None,
+                              preprocessing=self.preprocessing)
+        if self.mode != "shadow":  # a new version goes live, and gets its version, only once it is complete
+            self.__bump_collection_version(projection=None)
+
+    def __existing_projections(self) -> dict[str, VectorProjection]:
+        """
+        :return: the projections of the collection an upsert adds to, which must match the reduced_dim
+        """
+        if not self.qdrant_client.collection_exists(self.target_collection):
+            return {}
+        projections = projections_from_meta(read_collection_meta(self.qdrant_client, self.target_collection))
+        stored_dim = next(iter(projections.values())).output_dim if projections else None
+        if stored_dim != self.reduced_dim:
+            raise ValueError(f"The collection '{self.target_collection}' stores vectors reduced to {stored_dim} "
+                             f"dimensions, not {self.reduced_dim}. Change the reduced_dim in 'shadow' or 'recreate' mode")
+        return projections
+
+    def __check_preprocessing(self) -> None:
+        """
+        Check that an upsert embeds the images with the preprocessing of the collection it adds to, since the pixel
+        values, and so the vectors, of the preprocessing modes differ slightly
+        :return: None
+        """
+        if not self.qdrant_client.collection_exists(self.target_collection):
+            return
+        # the collections imported before the fast preprocessing existed were embedded with the image processor
+        stored = read_collection_meta(self.qdrant_client, self.target_collection).get("preprocessing", "processor")
+        if stored != self.preprocessing:
+            raise ValueError(f"The images of the collection '{self.target_collection}' are preprocessed with "
+                             f"'{stored}', not '{self.preprocessing}'. Change the preprocessing in 'shadow' or "
+                             f"'recreate' mode")
+
+    def __fit_projections(self,
+                          batches: Iterator[tuple[list[tuple[int, dict]], np.ndarray, np.ndarray]]
+                          ) -> Iterator[tuple[list[tuple[int, dict]], np.ndarray, np.ndarray]]:
+        """
+        hold back the first embedded batches until they add up to projection_sample_size records, fit the projections
+        on them and store them in the metadata, then let every batch through
+        :param batches: the embedded batches
+        :return the same batches
+        """
+        if self.reduced_dim is None or self.projections:
+            yield from batches
+            return
+        held, count = [], 0
+        for batch in batches:
+            held.append(batch)
+            count += len(batch[0])
+            if count >= self.projection_sample_size:
+                break
+        if not held:
+            return
+        self.projections = {name: VectorProjection.fit(np.concatenate([batch[position] for batch in held]),
+                                                       dim=self.reduced_dim, whiten=self.whiten)
+                            for name, position in (("image", 1), ("text", 2))}
+        logger.info("Fitted the projections to %d dimensions on %d records", self.reduced_dim, count)
+        projection = projections_to_meta(self.projections)
+        write_collection_meta(self.qdrant_client, self.target_collection, projection=projection)
+        if self.mode != "shadow" and self.target_collection != self.collection_name:
+            write_collection_meta(self.qdrant_client, self.collection_name, projection=projection)
+        if self.snapshot is not None:
+            self.snapshot.set_projection(projection)
+        yield from held
+        yield from batches
+
+    def __bump_collection_version(self, **fields) -> None:
+        """
+        Store a new version of the collection in its metadata, so that the searchers invalidate their cached results
+        :param fields: other metadata fields to set
         :return: None
         """
-        vectors_config = {
-            "text": models.VectorParams(
-                size=512,
-                distance=models.Distance.COSINE,
-            ),
-            "image": models.VectorParams(
-                size=512,
-                distance=models.Distance.COSINE,
-            ),
-        }
-        self.qdrant_client.recreate_collection(
-            collection_name=self.collection_name,
-            vectors_config=vectors_config)
-
-    def import_data(self, caption_payload_name) -> None:
+        write_collection_meta(self.qdrant_client, self.collection_name,
+                              version=uuid.uuid4().hex,
+                              updated_at=time.time(),
+                              **fields)
+
+    def import_data(self, caption_payload_name) -> dict[str, StageStats]:
         """
         Populate the QDrant DB with the metadata of the dataset. In detail, we will use as
-        'id' the index of the corresponding record in the dataset. As vector will be stored the
+        'id' a uuid derived from the id_field of the record. As vector will be stored the
         clip embedding of the image. As payload will be stored the answers provided by the coc dataset. They will be used to evaluate the accuracy of our system.
+        The import runs as a pipeline of three overlapping stages: a bounded pool of threads downloads the images,
+        the main thread, or the embedding worker processes, embed them in batches, and a background writer upserts the
+        points in large batches. The embedded batches reach the writer in dataset order either way.
+        In 'upsert' mode, the records that are already stored with the same content are skipped before downloading
+        their image, and the import resumes from the last checkpoint. In 'shadow' mode, the new collection goes live
+        once it is complete, see collection_versions.publish_version, and an incomplete one is dropped.
+        The captions, the source and the url prefixes of the images are indexed before any point is written, so the
+        searches can be filtered on them, see payload_filter.
+        :return: the throughput statistics of the download, inference and upsert stages
+        """
+        stats = {name: StageStats(name) for name in ("download", "inference", "upsert")}
+        start_index = self.checkpoint.load() if self.checkpoint is not None and self.mode == "upsert" else 0
+        if start_index:
+            logger.info("Resuming the import from record %d", start_index)
+        writer = BatchWriter(write_fn=self.__upsert_points,
+                             batch_size=self.upsert_batch_size,
+                             max_pending=max(1, self.queue_depth // self.batch_size),
+                             stats=stats["upsert"])
+        pool = None
+        start = time.perf_counter()
+        writer.start()
+        complete = False
+        try:
+            self.__init_qdrant_collection(vector_params=self.vector_params)
+            create_payload_indexes(self.qdrant_client, self.target_collection,
+                                   caption_payload_name=caption_payload_name)
+            # the sample is streamed from its file, the records before start_index are not decoded
+            records = iter_records(self.dataset_path, start_index=start_index)
+            if self.mode == "upsert":
+                records = self.__skip_unchanged(records, caption_payload_name=caption_payload_name)
+            downloads = bounded_map(lambda item: self.__download_record(*item, stats=stats["download"]),
+                                    records,
+                                    max_workers=self.download_workers,
+                                    max_pending=self.queue_depth)
+            downloaded = (download for download in downloads if download is not None)
+            batches = tqdm(batched(downloaded, self.batch_size),
+                           total=math.ceil((count_records(self.dataset_path) - start_index) / self.batch_size))
+            if self.embedding_workers > 1:
+                pool = EmbeddingWorkerPool(hf_model=self.hf_model,
+                                           num_workers=self.embedding_workers,
+                                           batch_size=self.batch_size,
+                                           vector_size=self.image_vector_size,  # the raw embeddings, projected here
+                                           num_threads=self.worker_threads,
+                                           preprocessing=self.preprocessing)
+                pool.start()
+            embedded = self.__fit_projections(self.__embed_batches(batches, pool, stats["inference"]))
+            for batch, image_features, text_features in embedded:
+                writer.put(self.__build_points(batch, image_features, text_features,
+                                               caption_payload_name=caption_payload_name))
+            complete = True
+        finally:
+            if pool is not None:
+                pool.close()
+            writer.close()
+            if self.snapshot is not None:
+                if complete or self.mode == "upsert":
+                    self.snapshot.flush()
+                else:
+                    self.snapshot.discard()  # the snapshot of the previous import is kept
+            if self.mode != "shadow":
+                self.__bump_collection_version()
+            elif not complete:
+                logger.warning("Dropping the incomplete collection '%s'", self.target_collection)
+                self.qdrant_client.delete_collection(self.target_collection)
+                delete_collection_meta(self.qdrant_client, self.target_collection)
+        if self.mode == "shadow":
+            try:
+                publish_version(self.qdrant_client, alias=self.collection_name, collection_name=self.target_collection,
+                                vector_names=list(VECTOR_NAMES), keep_versions=self.keep_versions,
+                                index_timeout_seconds=self.index_timeout, check_sample_size=self.check_sample_size,
+                                min_self_recall=self.min_self_recall)
+            except (RuntimeError, TimeoutError):
+                if self.snapshot is not None:
+                    self.snapshot.discard()  # the snapshot of the live version is kept
+                raise
+        if self.snapshot is not None:
+            self.snapshot.commit()  # a new snapshot replaces the previous one once its collection is live
+        if self.checkpoint is not None:
+            self.checkpoint.clear()  # the import is complete, the next one starts from the beginning
+        wall_seconds = time.perf_counter() - start
+        logger.info("Imported %d points in %.1fs", stats["upsert"].items, wall_seconds)
+        for stage_stats in stats.values():
+            logger.info(stage_stats.summary(wall_seconds))
+        return stats
+
+    def __point_id(self, record: dict) -> str:
+        """
+        :param record: the record of the dataset
+        :return: the id of the point of the record, a uuid derived from its id_field
+        """
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, str(record[self.id_field])))
+
+    def __content_hash(self, record: dict, caption_payload_name: str) -> str:
+        """
+        :param record: the record of the dataset
+        :param caption_payload_name: the payload field that stores the captions/answers
+        :return: a hash of everything the point of the record is computed from
+        """
+        content = json.dumps({"img_url": record["coco_url"],
+                              caption_payload_name: record["answer"],
+                              "hf_model": self.hf_model}, sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def __skip_unchanged(self, records: Iterable[tuple[int, dict]], caption_payload_name: str) -> Iterator[tuple[int, dict]]:
+        """
+        filter out the records that are already stored in the collection with the same content hash, and in the
+        snapshot if one is written, so that their image is neither downloaded nor embedded again. The unchanged points
+        imported before the url fields existed get them, without being embedded again
+        :param records: the (index, record) pairs of the dataset
+        :param caption_payload_name: the payload field that stores the captions/answers
+        :return the (index, record) pairs that are new or changed
+        """
+        skipped = 0
+        for chunk in batched(records, self.upsert_batch_size):
+            stored = self.qdrant_client.retrieve(collection_name=self.target_collection,
+                                                 ids=[self.__point_id(record) for _, record in chunk],
+                                                 with_payload=["content_hash", SOURCE_FIELD],
+                                                 with_vectors=False)
+            stored_payloads = {str(point.id): point.payload for point in stored}
+            backfills = []
+            for index, record in chunk:
+                point_id = self.__point_id(record)
+                stored_payload = stored_payloads.get(point_id) or {}
+                # a point upserted after the last snapshot shard of an interrupted import is imported again, or it
+                # would never reach the snapshot
+                if stored_payload.get("content_hash") == self.__content_hash(record, caption_payload_name) and \
+                        (self.snapshot is None or point_id in self.snapshot.point_ids):
+                    skipped += 1
+                    if SOURCE_FIELD not in stored_payload:
+                        backfills.append(models.SetPayloadOperation(set_payload=models.SetPayload(
+                            payload=url_payload(record["coco_url"]), points=[point_id])))
+                    continue
+                yield index, record
+            if backfills:
+                self.qdrant_client.batch_update_points(collection_name=self.target_collection,
+                                                       update_operations=backfills)
+        logger.info("Skipped %d unchanged records", skipped)
+
+    def __download_record(self,
+                          index: int,
+                          record: dict,
+                          stats: StageStats) -> Optional[tuple[int, dict, Union[Image.Image, bytes]]]:
+        """
+        download and decode the image of a record, and with the fast preprocessing resize and crop it. Images that
+        cannot be downloaded are skipped. With embedding workers the encoded image is kept as it is, the worker that
+        embeds it decodes it
+        :param index: the index of the record in the dataset
+        :param record: the record of the dataset
+        :param stats: where to record the download throughput
+        :return a tuple with the index, the record and the decoded or encoded image, or None if the download failed
+        """
+        start = time.perf_counter()
+        try:
+            response = self.http_session.get(record["coco_url"], timeout=self.download_timeout)
+            response.raise_for_status()
+            image = response.content
+            if self.embedder is not None:
+                image = self.embedder.load_image(image)  # decode here, off the inference thread
+        except (requests.RequestException, OSError):
+            logger.warning("Skipping record %d, could not download %s", index, record["coco_url"], exc_info=True)
+            return None
+        stats.record(1, time.perf_counter() - start)
+        return index, record, image
+
+    def __embed_batches(self,
+                        batches: Iterable[list[tuple[int, dict, Union[Image.Image, bytes]]]],
+                        pool: Optional[EmbeddingWorkerPool],
+                        stats: StageStats) -> Iterator[tuple[list[tuple[int, dict]], np.ndarray, np.ndarray]]:
+        """
+        extract the image and text embeddings of batches of downloaded records, in this process or in the embedding
+        workers
+        :param batches: the downloaded records
+        :param pool: the embedding workers, None to embed in this process
+        :param stats: where to record the inference throughput
+        :return the (index, record) pairs of each batch, in dataset order, with their image and text embeddings. The
+        records whose image could not be decoded by a worker are left out
+        """
+        if pool is None:
+            for batch in batches:
+                batch_start = time.perf_counter()
+                indices, records, images = zip(*batch)
+                image_features, text_features = self.embedder.embed(images=list(images),
+                                                                    answers=[record["answer"] for record in records])
+                stats.record(len(batch), time.perf_counter() - batch_start)
+                yield list(zip(indices, records)), image_features, text_features
+            return
+        tasks = (([(index, record) for index, record, _ in batch],
+                  [content for _, _, content in batch],
+                  [record["answer"] for _, record, _ in batch]) for batch in batches)
+        for records, kept, image_features, text_features, seconds in pool.map_ordered(tasks):
+            stats.record(len(kept), seconds)
+            yield [records[position] for position in kept], image_features, text_features
+
+    def __build_points(self,
+                       records: list[tuple[int, dict]],
+                       image_features: np.ndarray,
+                       text_features: np.ndarray,
+                       caption_payload_name: str) -> list[tuple[int, models.PointStruct]]:
+        """
+        build the QDrant points of a batch of embedded records
+        :param records: the (index, record) pairs of the batch
+        :param image_features: the image embeddings, one row per record
+        :param text_features: the mean caption embeddings, one row per record
+        :param caption_payload_name: the payload field that stores the captions/answers
+        :return the points to upsert, each one with the index of its record in the dataset
+        """
+        if self.projections:
+            image_features = self.projections["image"].transform(image_features)
+            text_features = self.projections["text"].transform(text_features)
+        return [(index, models.PointStruct(id=self.__point_id(record),
+                                           vector={
+                                               "image": image_vector,
+                                               "text": text_vector
+                                           },
+                                           payload={
+                                               caption_payload_name: record["answer"],
+                                               "img_url": record["coco_url"],
+                                               "content_hash": self.__content_hash(record, caption_payload_name),
+                                               **url_payload(record["coco_url"])
+                                           }))
+                for (index, record), image_vector, text_vector in zip(records,
+                                                                      image_features.tolist(),
+                                                                      text_features.tolist())]
+
+    def __upsert_points(self, points: list[tuple[int, models.PointStruct]]) -> None:
+        """
+        upsert a batch of points, append them to the snapshot and checkpoint the progress. The writer receives the
+        points in dataset order, so every record before the last point of the batch has been imported, skipped or
+        failed. When a snapshot is written, the checkpoint only moves when a snapshot shard is flushed, so that a
+        resumed import never leaves a hole in the snapshot
+        :param points: the points to upsert, each one with the index of its record in the dataset
         :return: None
         """
-        total_size = len(self.dataset)
-        for index, record in tqdm(enumerate(self.dataset), total=total_size):
-            url = record["coco_url"]
-
-            image_features = self.__extract_image_emb(img_url=url)
-            text_features = self.__extract_text_emb(answers=record["answer"])
-            point = models.PointStruct(id=index,
-                                       vector={
-                                           "image": image_features[0].tolist(),
-                                           "text": text_features.tolist()
-                                       },
-                                       payload={
-                                           caption_payload_name: record["answer"],
-                                           "img_url": url
-                                       })
-            self.qdrant_client.upsert(collection_name=self.collection_name, points=[point])
-
-    def __extract_image_emb(self, img_url: str) -> torch.Tensor:
-        """
-        extract the embedding of an image
-        :param img_url: the url of the image
-        :return a tensor representing the image embedding
-        """
-        image = Image.open(requests.get(img_url, stream=True).raw)
-        inputs = self.processor(images=image, return_tensors="pt")
-        image_features = self.model.get_image_features(**inputs)
-        return image_features
-
-    def __extract_text_emb(self, answers: str) -> torch.Tensor:
-        """
-        extract the text embedding of each provided caption/answer for a given image. Then return as
-        the text embedding of the image the average embedding of the extracted of each caption/answer
-        :param answers: the captions/answers of the image
-        :return the avg/mean embedding of all the captions
-        """
-        inputs = self.tokenizer(answers,
-                                padding=True,
-                                return_tensors="pt")
-        text_features = self.model.get_text_features(**inputs)
-        return torch.mean(text_features, dim=0)
-
-
-class Searcher(object):
-    """
-    A class to implement any functionality regarding searching in the QDrant DB
-    """
-    def __init__(self,
-                 host: str,
-                 port: int,
-                 collection_name: str,
-                 text_vector_name: str,
-                 img_vector_name: str,
-                 hf_model: str):
-        """
-        Initializa the qdrant client and all the objects for the clip model. Also, define the name of the
-        vector names to be queried to retrieve the top-k candidates
-        :param host: the QDrant host
-        :param port: the port of the QDrant
-        :param collection_name: the collection to query
-        :param text_vector_name: the name of the column where the text vector is stored
-        :param img_vector_name: the name of the image vector column where the image vector is stored
-        :param hf_model: the huggingface model to extract the embedding of the text query
-        """
-        self.qdrant_client = QdrantClient(location=host, port=port)
-        self.collection_name = collection_name
-        self.tokenizer = AutoTokenizer.from_pretrained(hf_model)
-        self.model = CLIPModel.from_pretrained(hf_model)
-        self.text_vector_name = text_vector_name
-        self.img_vector_name = img_vector_name
-        self.possible_vector_names = [text_vector_name, img_vector_name]
-
-    def query(self,
-              text: str,
-              vector_to_search: str,
-              top_k: int = 10) -> list[tuple[str, list[str]]]:
-        """
-        given a text query retrieve the top-k candidates. Based on the vector_to_search parameter, it will retrieve the
-        top-k candidates based on the mentioned vector. It could be either "image" or "text".
-        :param text: the user query
-        :param vector_to_search: the vector column to use in order to retrieve the top-k candidates for the user query
-        :param top_k: the number of retrieved results
-        :return a list with the top-k results. Each instance will be a tuple where the first element will be the img url
-        and the second one will be a list with the captions/answers of the image
-        """
-        if vector_to_search not in self.possible_vector_names:
-            raise ValueError(f"'vector_to_search' parameter must be either {self.text_vector_name} or "
-                             f"{self.img_vector_name}")
-        inputs = self.tokenizer([text], padding=True, return_tensors="pt")
-        text_features = self.model.get_text_features(**inputs).tolist()[0]
-        response = self.qdrant_client.search(collection_name=self.collection_name,
-                                             query_vector=models.NamedVector(
-                                                 name=vector_to_search,
-                                                 vector=text_features
-                                             ),
-                                             append_payload=True,
-                                             limit=top_k)
-        output = [(result.payload["img_url"], result.payload["possible_answers"]) for result in response]
-        return output
+        self.qdrant_client.upsert(collection_name=self.target_collection, points=[point for _, point in points])
+        next_index = points[-1][0] + 1
+        if self.snapshot is not None:
+            next_index = None
+            for index, point in points:
+                if self.snapshot.append(point_id=point.id, vectors=point.vector, payload=point.payload):
+                    next_index = index + 1
+        if self.checkpoint is not None and next_index is not None:
+            self.checkpoint.save(next_index=next_index)
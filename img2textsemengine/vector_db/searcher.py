@@ -0,0 +1,650 @@
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+from typing import Any, Optional, Union
+import numpy as np
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http import models
+from img2textsemengine.utils.metrics import track_stage
+from img2textsemengine.vector_db.cache import SemanticCache, TTLCache
+from img2textsemengine.vector_db.collection_meta import read_collection_meta, read_collection_meta_async
+from img2textsemengine.vector_db.encoders import build_text_encoder
+from img2textsemengine.vector_db.local_index import MANIFEST_FILE as LOCAL_INDEX_MANIFEST, LocalVectorIndex
+from img2textsemengine.vector_db.payload_filter import (CAPTIONS_FIELD, IMG_URL_FIELD, SearchFilter, payload_selector,
+                                                        resolve_fields)
+from img2textsemengine.vector_db.projection import projections_from_meta
+from img2textsemengine.vector_db.qdrant_connection import IN_MEMORY_LOCATION, qdrant_client_args
+
+# The serving path: this module is imported by the API, so it must not import the dependencies of the Importer, i.e.
+# datasets, PIL, requests, tqdm and the full clip model
+
+
+class Searcher(object):
+    """
+    A class to implement any functionality regarding searching in the QDrant DB
+    """
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 collection_name: str,
+                 text_vector_name: str,
+                 img_vector_name: str,
+                 hf_model: str,
+                 encoder_backend: str = "torch",
+                 onnx_model_dir: Optional[str] = None,
+                 prepared_model_dir: Optional[str] = None,
+                 model_dtype: str = "float32",
+                 encoder_threads: Optional[int] = None,
+                 text_encoder=None,
+                 embedding_cache_size: int = 0,
+                 embedding_cache_ttl: float = 3600,
+                 result_cache_size: int = 0,
+                 result_cache_ttl: float = 300,
+                 semantic_cache_size: int = 0,
+                 semantic_cache_ttl: float = 300,
+                 semantic_cache_threshold: float = 0.95,
+                 version_check_interval: float = 5,
+                 search_backend: str = "qdrant",
+                 local_index_dir: Optional[str] = None,
+                 hnsw_ef: Optional[int] = None,
+                 oversampling: Optional[float] = None,
+                 rescore: Optional[bool] = None,
+                 prefer_grpc: bool = False,
+                 grpc_port: int = 6334,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 keepalive_expiry_seconds: float = 30):
+        """
+        Initializa the qdrant client and all the objects for the clip model. Also, define the name of the
+        vector names to be queried to retrieve the top-k candidates
+        :param host: the QDrant host
+        :param port: the port of the QDrant
+        :param collection_name: the collection to query, usually the alias of the live version of the collection, see
+        collection_versions
+        :param text_vector_name: the name of the column where the text vector is stored
+        :param img_vector_name: the name of the image vector column where the image vector is stored
+        :param hf_model: the huggingface model to extract the embedding of the text query
+        :param encoder_backend: the inference backend of the text encoder, one of 'torch', 'onnx' or 'onnx_int8'
+        :param onnx_model_dir: the directory of the ONNX export of the text encoder, used by the onnx backends
+        :param prepared_model_dir: the local text encoder of hf_model saved by model_export.prepare_text_encoder, loaded
+        by the torch backend instead of hf_model when it exists
+        :param model_dtype: the dtype of the weights of the torch text encoder, float32 or bfloat16
+        :param encoder_threads: the intra-op threads of each forward pass of the text encoder, None for the default
+        :param text_encoder: an already loaded text encoder, e.g. the one preloaded by the gunicorn master and shared by
+        its workers. None to load the encoder of encoder_backend
+        :param embedding_cache_size: the maximum number of cached text embeddings, 0 disables the cache
+        :param embedding_cache_ttl: the time to live in seconds of a cached text embedding
+        :param result_cache_size: the maximum number of cached search results, 0 disables the cache
+        :param result_cache_ttl: the time to live in seconds of cached search results
+        :param semantic_cache_size: the maximum number of search results cached by the embedding of their query, served
+        to the queries whose embedding is similar enough. 0 disables the cache
+        :param semantic_cache_ttl: the time to live in seconds of the results of the semantic cache
+        :param semantic_cache_threshold: the minimum cosine similarity between two query embeddings for the results of
+        one to be served to the other
+        :param version_check_interval: how often, in seconds, the collection version is checked to invalidate the
+        cached search results
+        :param search_backend: 'qdrant' to search the QDrant collection, or 'local' to run an exact search over a
+        memory-mapped local copy of its vectors
+        :param local_index_dir: the folder of the local index, used by the 'local' backend
+        :param hnsw_ef: the default size of the candidates list of the HNSW search of QDrant. Higher values give a
+        better recall and a slower search. None for the default of the collection
+        :param oversampling: the default number of candidates per result retrieved from the quantized vectors of QDrant
+        and rescored. None for the QDrant default
+        :param rescore: whether to rescore by default the candidates retrieved from the quantized vectors with the
+        original ones. None for the QDrant default
+        The search parameters are ignored by the 'local' backend, whose search is exact
+        :param prefer_grpc: whether to send the requests to QDrant over gRPC instead of REST
+        :param grpc_port: the gRPC port of the QDrant
+        :param max_connections: the maximum number of concurrent REST connections to QDrant
+        :param max_keepalive_connections: the maximum number of idle REST connections kept open
+        :param keepalive_expiry_seconds: how long an idle connection is kept open
+        """
+        if search_backend not in ("qdrant", "local"):
+            raise ValueError(f"Unknown search backend '{search_backend}', it must be either 'qdrant' or 'local'")
+        if search_backend == "local" and not local_index_dir:
+            raise ValueError("The 'local' search backend requires the folder of the local index")
+        client_args = qdrant_client_args(host, port, prefer_grpc=prefer_grpc, grpc_port=grpc_port,
+                                         max_connections=max_connections,
+                                         max_keepalive_connections=max_keepalive_connections,
+                                         keepalive_expiry_seconds=keepalive_expiry_seconds)
+        self.qdrant_client = QdrantClient(**client_args)
+        # the searches of the API are awaited on the event loop. An in-process QDrant is not shared by two clients, so
+        # its searches keep going through the sync client, on a thread
+        self.async_qdrant_client = AsyncQdrantClient(**client_args) if host != IN_MEMORY_LOCATION else None
+        self.collection_name = collection_name
+        self.hf_model = hf_model
+        self.encoder_backend = encoder_backend
+        self.text_encoder = text_encoder or build_text_encoder(backend=encoder_backend, hf_model=hf_model,
+                                                               onnx_model_dir=onnx_model_dir, dtype=model_dtype,
+                                                               num_threads=encoder_threads,
+                                                               prepared_model_dir=prepared_model_dir)
+        self.text_vector_name = text_vector_name
+        self.img_vector_name = img_vector_name
+        self.possible_vector_names = [text_vector_name, img_vector_name]
+        self.embedding_cache = TTLCache(name="embedding", max_size=embedding_cache_size,
+                                        ttl_seconds=embedding_cache_ttl)
+        self.result_cache = TTLCache(name="results", max_size=result_cache_size, ttl_seconds=result_cache_ttl)
+        self.semantic_cache = SemanticCache(name="semantic", max_size=semantic_cache_size,
+                                            ttl_seconds=semantic_cache_ttl,
+                                            similarity_threshold=semantic_cache_threshold)
+        self.version_check_interval = version_check_interval
+        self._collection_version = None
+        self._version_checked_at = float("-inf")
+        self._version_lock = threading.Lock()
+        self.local_index_dir = local_index_dir
+        self.local_index = LocalVectorIndex(local_index_dir) if search_backend == "local" else None
+        # the projections of the stored vectors, applied to the query embeddings. They come with the collection version
+        self.projections = projections_from_meta(self.local_index.manifest) if self.local_index is not None else {}
+        self.hnsw_ef = hnsw_ef
+        self.oversampling = oversampling
+        self.rescore = rescore
+
+    def __embedding_key(self, text: str) -> tuple[str, str, str]:
+        """
+        :param text: the user query
+        :return: the key of the query in the embedding cache. The text is normalized the same way the CLIP tokenizer
+        does, i.e. whitespace-collapsed and lower-cased, so texts that tokenize the same share an entry
+        """
+        return " ".join(text.split()).lower(), self.hf_model, self.encoder_backend
+
+    def collection_version(self) -> Optional[str]:
+        """
+        Return the version of the collection stored by the Importer, refreshed at most every version_check_interval
+        seconds. The cached search results are dropped, and the projections of the vectors reloaded, when the version
+        changes. With the 'local' backend, it is the version of the local index, which is reopened when it has been
+        rebuilt
+        :return: the version of the collection
+        """
+        if time.monotonic() - self._version_checked_at < self.version_check_interval:
+            return self._collection_version
+        with self._version_lock:
+            if time.monotonic() - self._version_checked_at >= self.version_check_interval:
+                if self.local_index is not None:
+                    version = self.__refresh_local_index()
+                    meta = self.local_index.manifest
+                else:
+                    meta = read_collection_meta(self.qdrant_client, self.collection_name)
+                    # collections imported before the metadata existed fall back to their points count
+                    version = meta.get("version") or str(self.qdrant_client.count(self.collection_name).count)
+                self.__set_collection_version(version, meta)
+        return self._collection_version
+
+    async def collection_version_async(self) -> Optional[str]:
+        """
+        The same as collection_version, with the requests to QDrant awaited on the event loop. While the version is
+        read, the concurrent calls keep returning the previous one
+        :return: the version of the collection
+        """
+        if self.async_qdrant_client is None or self.local_index is not None:
+            return self.collection_version()  # no request to QDrant
+        if time.monotonic() - self._version_checked_at < self.version_check_interval:
+            return self._collection_version
+        checked_at, self._version_checked_at = self._version_checked_at, time.monotonic()
+        try:
+            meta = await read_collection_meta_async(self.async_qdrant_client, self.collection_name)
+            version = meta.get("version") or str((await self.async_qdrant_client.count(self.collection_name)).count)
+        except Exception:
+            self._version_checked_at = checked_at  # read again by the next call, not after the interval
+            raise
+        with self._version_lock:
+            self.__set_collection_version(version, meta)
+        return self._collection_version
+
+    def __set_collection_version(self, version: str, meta: dict[str, Any]) -> None:
+        """
+        store the version read from the collection, dropping the cached results and loading the projections of the
+        vectors if it has changed. It is called with the version lock held
+        :param version: the version of the collection
+        :param meta: the metadata of the collection, or the manifest of the local index
+        :return: None
+        """
+        if version != self._collection_version:
+            self.result_cache.clear()
+            self.semantic_cache.clear()
+            self.projections = projections_from_meta(meta)
+            self._collection_version = version
+        self._version_checked_at = time.monotonic()
+
+    def __refresh_local_index(self) -> str:
+        """
+        reopen the local index if it has been rebuilt since it was opened. The index open so far is kept if the build
+        it points to is deleted by another rebuild meanwhile, the next check opens the latest one
+        :return: the version of the local index
+        """
+        try:
+            with open(os.path.join(self.local_index_dir, LOCAL_INDEX_MANIFEST), "r", encoding="utf-8") as manifest_file:
+                version = json.load(manifest_file)["version"]
+            if version != self.local_index.version:
+                self.local_index = LocalVectorIndex(self.local_index_dir)
+        except FileNotFoundError:
+            pass
+        return self.local_index.version
+
+    def cached_embedding(self, text: str) -> Optional[list[float]]:
+        """
+        :param text: the user query
+        :return: the cached embedding of the query, or None if it has not been embedded recently
+        """
+        return self.embedding_cache.get(self.__embedding_key(text), count_miss=False)  # embed_texts counts the miss
+
+    def check_vector_name(self, vector_to_search: str) -> None:
+        """
+        validate the name of the vector column to be queried
+        :param vector_to_search: the vector column to use in order to retrieve the top-k candidates
+        :return: None
+        """
+        if vector_to_search not in self.possible_vector_names:
+            raise ValueError(f"'vector_to_search' parameter must be either {self.text_vector_name} or "
+                             f"{self.img_vector_name}")
+
+    def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        """
+        extract the clip embeddings of a batch of text queries in a single forward pass. The queries that have been
+        embedded recently are served from the embedding cache
+        :param texts: the user queries
+        :return a list with the embedding of each query
+        """
+        keys = [self.__embedding_key(text) for text in texts]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            with track_stage("tokenize"):
+                inputs = self.text_encoder.tokenize([texts[index] for index in missing])
+            with track_stage("encode"):
+                text_features = self.text_encoder.encode(inputs).tolist()
+            for index, features in zip(missing, text_features):
+                embeddings[index] = features
+                self.embedding_cache.put(keys[index], features)
+        return embeddings
+
+    @staticmethod
+    def __result_cache_key(version: Optional[str],
+                           text_features: list[float],
+                           vector_to_search: str,
+                           top_k: int,
+                           search_params: tuple,
+                           scope: tuple) -> tuple:
+        """
+        :return: the key of a search in the results cache. It includes the collection version, so the results of
+        an older version of the collection are never served
+        """
+        return (version, struct.pack(f"{len(text_features)}f", *text_features), vector_to_search, top_k, search_params,
+                scope)
+
+    def __resolve_search_params(self,
+                                hnsw_ef: Optional[int],
+                                oversampling: Optional[float],
+                                rescore: Optional[bool]) -> tuple[Optional[int], Optional[float], Optional[bool]]:
+        """
+        :return: the search parameters of a call, the ones it does not set fall back to the defaults of the searcher
+        """
+        return (self.hnsw_ef if hnsw_ef is None else hnsw_ef,
+                self.oversampling if oversampling is None else oversampling,
+                self.rescore if rescore is None else rescore)
+
+    @staticmethod
+    def __resolve_scopes(count: int,
+                         filters: Optional[list[Optional[SearchFilter]]],
+                         fields: Optional[list[Optional[list[str]]]]
+                         ) -> tuple[list[Optional[SearchFilter]], list[tuple[str, ...]], list[tuple]]:
+        """
+        :param count: the number of searches
+        :param filters: the payload conditions of each search, None for none
+        :param fields: the result fields asked for by each search, None for all of them
+        :return: the filter of each search, None without conditions, its validated result fields, and its scope, i.e.
+        the key of its filter and its fields, which is part of its cache keys
+        """
+        filters = [None if search_filter is None or search_filter.empty else search_filter
+                   for search_filter in filters or [None] * count]
+        fields = [resolve_fields(selected) for selected in fields or [None] * count]
+        scopes = [(search_filter and search_filter.key, selected) for search_filter, selected in zip(filters, fields)]
+        return filters, fields, scopes
+
+    def search(self,
+               text_features: list[float],
+               vector_to_search: str,
+               top_k: int = 10,
+               hnsw_ef: Optional[int] = None,
+               oversampling: Optional[float] = None,
+               rescore: Optional[bool] = None,
+               search_filter: Optional[SearchFilter] = None,
+               fields: Optional[list[str]] = None) -> list[tuple[Optional[str], Optional[list[str]]]]:
+        """
+        retrieve the top-k candidates for an already embedded query
+        :param text_features: the embedding of the user query
+        :param vector_to_search: the vector column to use in order to retrieve the top-k candidates for the user query
+        :param top_k: the number of retrieved results
+        :param hnsw_ef: the size of the candidates list of the HNSW search, None for the default of the searcher
+        :param oversampling: the candidates per result retrieved from the quantized vectors, None for the default
+        :param rescore: whether to rescore the candidates with the original vectors, None for the default
+        :param search_filter: the payload conditions the results must match, None for none
+        :param fields: the fields of the results to return, a subset of payload_filter.RESULT_FIELDS. None for all
+        :return a list with the top-k results. Each instance will be a tuple where the first element will be the img url
+        and the second one will be a list with the captions/answers of the image. The fields not asked for are None
+        """
+        return self.search_batch(text_features=[text_features], vectors_to_search=[vector_to_search], top_ks=[top_k],
+                                 hnsw_ef=hnsw_ef, oversampling=oversampling, rescore=rescore,
+                                 filters=[search_filter], fields=[fields])[0]
+
+    def search_batch(self,
+                     text_features: list[list[float]],
+                     vectors_to_search: list[str],
+                     top_ks: list[int],
+                     hnsw_ef: Optional[int] = None,
+                     oversampling: Optional[float] = None,
+                     rescore: Optional[bool] = None,
+                     filters: Optional[list[Optional[SearchFilter]]] = None,
+                     fields: Optional[list[Optional[list[str]]]] = None
+                     ) -> list[list[tuple[Optional[str], Optional[list[str]]]]]:
+        """
+        retrieve the top-k candidates for many already embedded queries in a single request to the search backend
+        :param text_features: the embedding of each user query
+        :param vectors_to_search: the vector column to search for each query
+        :param top_ks: the number of retrieved results for each query
+        :param hnsw_ef: the size of the candidates list of the HNSW search, None for the default of the searcher
+        :param oversampling: the candidates per result retrieved from the quantized vectors, None for the default
+        :param rescore: whether to rescore the candidates with the original vectors, None for the default
+        :param filters: the payload conditions of each query, None for the queries without any
+        :param fields: the fields of the results of each query, None for all of them
+        :return a list with the top-k results of each query, in the input order
+        """
+        for vector_to_search in set(vectors_to_search):
+            self.check_vector_name(vector_to_search)
+        search_params = self.__resolve_search_params(hnsw_ef, oversampling, rescore)
+        filters, fields, scopes = self.__resolve_scopes(len(text_features), filters, fields)
+        version = self.collection_version()  # also loads the projections of the vectors
+        outputs, cache_keys = self.__cached_results(version, text_features, vectors_to_search, top_ks, search_params,
+                                                    scopes)
+        missing = [index for index, output in enumerate(outputs) if output is None]
+        if missing:
+            payloads = self.__search_payloads(text_features=[text_features[index] for index in missing],
+                                              vectors_to_search=[vectors_to_search[index] for index in missing],
+                                              top_ks=[top_ks[index] for index in missing],
+                                              search_params=search_params,
+                                              filters=[filters[index] for index in missing],
+                                              fields=[fields[index] for index in missing])
+            self.__store_results(version, outputs, cache_keys, missing, payloads, text_features, vectors_to_search,
+                                 top_ks, search_params, fields, scopes)
+        return outputs
+
+    @property
+    def async_search(self) -> bool:
+        """
+        :return: whether search_batch_async awaits QDrant on the event loop. Otherwise, with the 'local' backend or an
+        in-process QDrant, the search is computed on a thread
+        """
+        return self.async_qdrant_client is not None and self.local_index is None
+
+    async def search_async(self,
+                           text_features: list[float],
+                           vector_to_search: str,
+                           top_k: int = 10,
+                           hnsw_ef: Optional[int] = None,
+                           oversampling: Optional[float] = None,
+                           rescore: Optional[bool] = None,
+                           search_filter: Optional[SearchFilter] = None,
+                           fields: Optional[list[str]] = None) -> list[tuple[Optional[str], Optional[list[str]]]]:
+        """
+        The same as search, awaited on the event loop
+        """
+        return (await self.search_batch_async(text_features=[text_features], vectors_to_search=[vector_to_search],
+                                              top_ks=[top_k], hnsw_ef=hnsw_ef, oversampling=oversampling,
+                                              rescore=rescore, filters=[search_filter], fields=[fields]))[0]
+
+    async def search_batch_async(self,
+                                 text_features: list[list[float]],
+                                 vectors_to_search: list[str],
+                                 top_ks: list[int],
+                                 hnsw_ef: Optional[int] = None,
+                                 oversampling: Optional[float] = None,
+                                 rescore: Optional[bool] = None,
+                                 filters: Optional[list[Optional[SearchFilter]]] = None,
+                                 fields: Optional[list[Optional[list[str]]]] = None
+                                 ) -> list[list[tuple[Optional[str], Optional[list[str]]]]]:
+        """
+        The same as search_batch, with the request to QDrant awaited on the event loop instead of blocking a thread
+        """
+        for vector_to_search in set(vectors_to_search):
+            self.check_vector_name(vector_to_search)
+        search_params = self.__resolve_search_params(hnsw_ef, oversampling, rescore)
+        filters, fields, scopes = self.__resolve_scopes(len(text_features), filters, fields)
+        version = await self.collection_version_async()
+        outputs, cache_keys = self.__cached_results(version, text_features, vectors_to_search, top_ks, search_params,
+                                                    scopes)
+        missing = [index for index, output in enumerate(outputs) if output is None]
+        if missing:
+            missing_features = self.__project_queries([text_features[index] for index in missing],
+                                                      [vectors_to_search[index] for index in missing])
+            missing_vectors = [vectors_to_search[index] for index in missing]
+            missing_top_ks = [top_ks[index] for index in missing]
+            missing_filters = [filters[index] for index in missing]
+            missing_fields = [fields[index] for index in missing]
+            if self.async_search:
+                with track_stage("search"):
+                    responses = await self.async_qdrant_client.search_batch(
+                        collection_name=self.collection_name,
+                        requests=self.__search_requests(missing_features, missing_vectors, missing_top_ks,
+                                                        search_params, missing_filters, missing_fields))
+                payloads = [[result.payload for result in response] for response in responses]
+            else:
+                payloads = await asyncio.to_thread(self.__search_payloads, text_features=missing_features,
+                                                   vectors_to_search=missing_vectors, top_ks=missing_top_ks,
+                                                   search_params=search_params, filters=missing_filters,
+                                                   fields=missing_fields)
+            self.__store_results(version, outputs, cache_keys, missing, payloads, text_features, vectors_to_search,
+                                 top_ks, search_params, fields, scopes)
+        return outputs
+
+    def __cached_results(self,
+                         version: Optional[str],
+                         text_features: list[list[float]],
+                         vectors_to_search: list[str],
+                         top_ks: list[int],
+                         search_params: tuple,
+                         scopes: list[tuple]) -> tuple[list[Optional[list]], list[Optional[tuple]]]:
+        """
+        :param version: the version of the collection, part of the cache keys
+        :param scopes: the filter key and the result fields of each search, part of the cache keys
+        :return: the cached results of each search, None for the ones to run, and the cache key of each search. The
+        searches missing from the results cache are looked up in the semantic cache
+        """
+        outputs = [None] * len(text_features)
+        cache_keys = [None] * len(text_features)
+        for index, (features, vector_to_search, top_k, scope) in enumerate(zip(text_features, vectors_to_search,
+                                                                                top_ks, scopes)):
+            if self.result_cache.enabled:
+                cache_keys[index] = self.__result_cache_key(version, features, vector_to_search, top_k, search_params,
+                                                            scope)
+                outputs[index] = self.result_cache.get(cache_keys[index])
+            if outputs[index] is None and self.semantic_cache.enabled:
+                outputs[index] = self.semantic_cache.get(features, context=(vector_to_search, search_params, scope),
+                                                         top_k=top_k, version=version)
+        return outputs, cache_keys
+
+    def __store_results(self,
+                        version: Optional[str],
+                        outputs: list[Optional[list]],
+                        cache_keys: list[Optional[tuple]],
+                        missing: list[int],
+                        payloads: list[list[dict]],
+                        text_features: list[list[float]],
+                        vectors_to_search: list[str],
+                        top_ks: list[int],
+                        search_params: tuple,
+                        fields: list[tuple[str, ...]],
+                        scopes: list[tuple]) -> None:
+        """
+        fill the outputs of the searches that have been run, and cache them
+        :param version: the version of the collection the searches have run on
+        :param missing: the positions of the searches that have been run
+        :param payloads: the payloads of the top-k points of each search that has been run
+        :param fields: the result fields of each search, the others are None
+        :return: None
+        """
+        for index, response in zip(missing, payloads):
+            with_img_url, with_captions = "img_url" in fields[index], "captions" in fields[index]
+            outputs[index] = [(payload.get(IMG_URL_FIELD) if with_img_url else None,
+                               payload.get(CAPTIONS_FIELD) if with_captions else None) for payload in response]
+            if self.result_cache.enabled:
+                self.result_cache.put(cache_keys[index], outputs[index])
+            if self.semantic_cache.enabled:
+                self.semantic_cache.put(text_features[index],
+                                        context=(vectors_to_search[index], search_params, scopes[index]),
+                                        top_k=top_ks[index], version=version, value=outputs[index])
+
+    def project(self, text_features: Union[np.ndarray, list[list[float]]], vector_name: str) -> np.ndarray:
+        """
+        :param text_features: query embeddings, one row per query
+        :param vector_name: the named vector they are searched in
+        :return: the embeddings in the space of the stored vectors, i.e. reduced with the projection of the vector if
+        the collection stores reduced vectors
+        """
+        self.collection_version()
+        if vector_name not in self.projections:
+            return np.asarray(text_features, dtype=np.float32)
+        return self.projections[vector_name].transform(text_features)
+
+    def __project_queries(self, text_features: list[list[float]], vectors_to_search: list[str]) -> list[list[float]]:
+        """
+        :param text_features: the embedding of each query
+        :param vectors_to_search: the vector each query is searched in
+        :return: the embeddings, the ones searched in a reduced vector projected as the stored vectors
+        """
+        if not self.projections:
+            return text_features
+        projected = list(text_features)
+        for vector_name, projection in self.projections.items():
+            positions = [index for index, name in enumerate(vectors_to_search) if name == vector_name]
+            if positions:
+                rows = projection.transform([text_features[index] for index in positions]).tolist()
+                for index, row in zip(positions, rows):
+                    projected[index] = row
+        return projected
+
+    def __search_requests(self,
+                          text_features: list[list[float]],
+                          vectors_to_search: list[str],
+                          top_ks: list[int],
+                          search_params: tuple[Optional[int], Optional[float], Optional[bool]],
+                          filters: list[Optional[SearchFilter]],
+                          fields: list[tuple[str, ...]]) -> list[models.SearchRequest]:
+        """
+        :param search_params: the hnsw_ef, the oversampling and the rescore of the searches
+        :param filters: the payload conditions of each search
+        :param fields: the result fields of each search. Only their payload fields are sent back by QDrant
+        :return: the QDrant requests of the searches
+        """
+        hnsw_ef, oversampling, rescore = search_params
+        quantization = None
+        if oversampling is not None or rescore is not None:
+            quantization = models.QuantizationSearchParams(oversampling=oversampling, rescore=rescore)
+        params = models.SearchParams(hnsw_ef=hnsw_ef, quantization=quantization)
+        return [models.SearchRequest(vector=models.NamedVector(name=vector_to_search, vector=features),
+                                     filter=search_filter and search_filter.to_qdrant(),
+                                     with_payload=payload_selector(selected),
+                                     limit=top_k,
+                                     params=params)
+                for features, vector_to_search, top_k, search_filter, selected in zip(text_features, vectors_to_search,
+                                                                                      top_ks, filters, fields)]
+
+    def __search_payloads(self,
+                          text_features: list[list[float]],
+                          vectors_to_search: list[str],
+                          top_ks: list[int],
+                          search_params: tuple[Optional[int], Optional[float], Optional[bool]],
+                          filters: list[Optional[SearchFilter]],
+                          fields: list[tuple[str, ...]]) -> list[list[dict]]:
+        """
+        run the searches on the configured backend: a single search_batch request to QDrant, or an exact search
+        over the memory-mapped local index
+        :param search_params: the hnsw_ef, the oversampling and the rescore of the QDrant searches
+        :param filters: the payload conditions of each search
+        :param fields: the result fields of each search
+        :return the payloads of the top-k points of each query, in the input order
+        """
+        text_features = self.__project_queries(text_features, vectors_to_search)
+        with track_stage("search"):
+            if self.local_index is not None:
+                return [[payload for _, payload in response]
+                        for response in self.local_index.search_batch(vector_names=vectors_to_search,
+                                                                      queries=text_features,
+                                                                      limits=top_ks,
+                                                                      filters=filters)]
+            requests = self.__search_requests(text_features, vectors_to_search, top_ks, search_params, filters, fields)
+            responses = self.qdrant_client.search_batch(collection_name=self.collection_name, requests=requests)
+        return [[result.payload for result in response] for response in responses]
+
+    def query(self,
+              text: str,
+              vector_to_search: str,
+              top_k: int = 10,
+              hnsw_ef: Optional[int] = None,
+              oversampling: Optional[float] = None,
+              rescore: Optional[bool] = None,
+              search_filter: Optional[SearchFilter] = None,
+              fields: Optional[list[str]] = None) -> list[tuple[Optional[str], Optional[list[str]]]]:
+        """
+        given a text query retrieve the top-k candidates. Based on the vector_to_search parameter, it will retrieve the
+        top-k candidates based on the mentioned vector. It could be either "image" or "text".
+        :param text: the user query
+        :param vector_to_search: the vector column to use in order to retrieve the top-k candidates for the user query
+        :param top_k: the number of retrieved results
+        :param hnsw_ef: the size of the candidates list of the HNSW search, None for the default of the searcher.
+        Higher values trade latency for recall
+        :param oversampling: the candidates per result retrieved from the quantized vectors, None for the default
+        :param rescore: whether to rescore the candidates with the original vectors, None for the default
+        :param search_filter: the payload conditions the results must match, None for none
+        :param fields: the fields of the results to return, a subset of payload_filter.RESULT_FIELDS. None for all
+        :return a list with the top-k results. Each instance will be a tuple where the first element will be the img url
+        and the second one will be a list with the captions/answers of the image. The fields not asked for are None
+        """
+        self.check_vector_name(vector_to_search)
+        resolve_fields(fields)  # fail fast, before embedding the query
+        text_features = self.embed_texts([text])[0]
+        return self.search(text_features=text_features, vector_to_search=vector_to_search, top_k=top_k,
+                           hnsw_ef=hnsw_ef, oversampling=oversampling, rescore=rescore, search_filter=search_filter,
+                           fields=fields)
+
+    def query_batch(self,
+                    texts: list[str],
+                    vectors_to_search: list[str],
+                    top_ks: list[int],
+                    hnsw_ef: Optional[int] = None,
+                    oversampling: Optional[float] = None,
+                    rescore: Optional[bool] = None,
+                    filters: Optional[list[Optional[SearchFilter]]] = None,
+                    fields: Optional[list[Optional[list[str]]]] = None
+                    ) -> list[list[tuple[Optional[str], Optional[list[str]]]]]:
+        """
+        given many text queries retrieve the top-k candidates of each one. The queries are embedded in a single forward
+        pass and searched in a single QDrant request
+        :param texts: the user queries
+        :param vectors_to_search: the vector column to search for each query, either "image" or "text"
+        :param top_ks: the number of retrieved results for each query
+        :param hnsw_ef: the size of the candidates list of the HNSW search, None for the default of the searcher
+        :param oversampling: the candidates per result retrieved from the quantized vectors, None for the default
+        :param rescore: whether to rescore the candidates with the original vectors, None for the default
+        :param filters: the payload conditions of each query, None for the queries without any
+        :param fields: the fields of the results of each query, None for all of them
+        :return a list with the top-k results of each query, in the input order. Each result is a tuple of the img url
+        and the captions/answers of the image, None for the fields not asked for
+        """
+        for vector_to_search in set(vectors_to_search):
+            self.check_vector_name(vector_to_search)
+        for selected in fields or []:
+            resolve_fields(selected)  # fail fast, before embedding the queries
+        text_features = self.embed_texts(texts)
+        return self.search_batch(text_features=text_features, vectors_to_search=vectors_to_search, top_ks=top_ks,
+                                 hnsw_ef=hnsw_ef, oversampling=oversampling, rescore=rescore, filters=filters,
+                                 fields=fields)
+
+    async def close(self) -> None:
+        """
+        Close the connections of the async QDrant client
+        :return: None
+        """
+        if self.async_qdrant_client is not None:
+            await self.async_qdrant_client.close()
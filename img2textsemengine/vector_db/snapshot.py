@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Iterator, Optional
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from qdrant_client import QdrantClient
+from img2textsemengine.vector_db.collection import build_vectors_config, create_payload_indexes
+from img2textsemengine.vector_db.collection_meta import write_collection_meta
+from img2textsemengine.vector_db.payload_filter import CAPTIONS_FIELD, with_url_fields
+
+# A snapshot is a folder with a manifest and a list of shards. Each shard stores one float32 .npy matrix per named
+# vector, which can be memory-mapped, and a parquet table with the point ids and payloads, in the same row order.
+# This module must not import torch, so that a snapshot can be loaded on a node without the model.
+MANIFEST_FILE = "manifest.json"
+
+logger = logging.getLogger(__name__)
+
+
+def _vector_file(shard: str, vector_name: str) -> str:
+    return f"{shard}.{vector_name}.npy"
+
+
+def _payload_file(shard: str) -> str:
+    return f"{shard}.payload.parquet"
+
+
+class SnapshotWriter(object):
+    """
+    A class to write the computed points to a snapshot, shard by shard
+    """
+    def __init__(self, snapshot_dir: str, vector_sizes: dict[str, int], shard_size: int = 50_000, reset: bool = False):
+        """
+        :param snapshot_dir: the folder of the snapshot
+        :param vector_sizes: the size of each named vector
+        :param shard_size: the number of points per shard
+        :param reset: whether to replace an existing snapshot instead of appending to it. The new snapshot is written
+        in a temporary folder which replaces snapshot_dir on commit, so a failed import keeps the previous snapshot
+        """
+        self.final_dir = snapshot_dir
+        self.snapshot_dir = f"{snapshot_dir.rstrip(os.sep)}.tmp-{uuid.uuid4().hex}" if reset else snapshot_dir
+        self.shard_size = shard_size
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        self.manifest = {"vectors": vector_sizes, "shards": []}
+        manifest_path = os.path.join(self.snapshot_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+                self.manifest = json.load(manifest_file)
+            if self.manifest["vectors"] != vector_sizes:
+                raise ValueError(f"The snapshot in {snapshot_dir} stores vectors {self.manifest['vectors']}, "
+                                 f"not {vector_sizes}")
+        # the ids of the points already in the snapshot, durable or buffered
+        self.point_ids = {point_id for shard in self.manifest["shards"]
+                          for point_id in pq.read_table(os.path.join(self.snapshot_dir, _payload_file(shard["name"])),
+                                                        columns=["id"]).column("id").to_pylist()}
+        self._ids: list[str] = []
+        self._vectors: dict[str, list[list[float]]] = {name: [] for name in vector_sizes}
+        self._payloads: list[dict[str, Any]] = []
+
+    def set_projection(self, projection: Optional[dict[str, str]]) -> None:
+        """
+        Record the projections the vectors of the snapshot are reduced with, written with the next shard
+        :param projection: the 'projection' field of the metadata of the collection, see projection.projections_to_meta
+        :return: None
+        """
+        self.manifest["projection"] = projection
+
+    def append(self, point_id: str, vectors: dict[str, list[float]], payload: dict[str, Any]) -> bool:
+        """
+        Add a point to the snapshot
+        :param point_id: the id of the point
+        :param vectors: the named vectors of the point
+        :param payload: the payload of the point
+        :return: True if a shard was flushed to disk, i.e. every point appended so far is durable
+        """
+        self._ids.append(str(point_id))
+        self.point_ids.add(str(point_id))
+        for name, vector in vectors.items():
+            self._vectors[name].append(vector)
+        self._payloads.append(payload)
+        if len(self._ids) >= self.shard_size:
+            self.flush()
+            return True
+        return False
+
+    def flush(self) -> None:
+        """
+        Write the buffered points as a new shard and update the manifest
+        :return: None
+        """
+        if not self._ids:
+            return
+        shard = f"{len(self.manifest['shards']):05d}"
+        for name, vectors in self._vectors.items():
+            np.save(os.path.join(self.snapshot_dir, _vector_file(shard, name)), np.asarray(vectors, dtype=np.float32))
+        table = pa.Table.from_pylist([{"id": point_id, **payload} for point_id, payload in zip(self._ids, self._payloads)])
+        pq.write_table(table, os.path.join(self.snapshot_dir, _payload_file(shard)))
+        self.manifest["shards"].append({"name": shard, "count": len(self._ids)})
+        # the manifest is replaced atomically, so a shard is only visible to the readers once it is complete
+        manifest_path = os.path.join(self.snapshot_dir, MANIFEST_FILE)
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+        self._ids = []
+        self._vectors = {name: [] for name in self._vectors}
+        self._payloads = []
+
+    def commit(self) -> None:
+        """
+        Flush the buffered points and, for a reset snapshot, replace the previous snapshot with the new one
+        :return: None
+        """
+        self.flush()
+        if self.snapshot_dir == self.final_dir:
+            return
+        old_dir = f"{self.final_dir.rstrip(os.sep)}.old-{uuid.uuid4().hex}"
+        if os.path.exists(self.final_dir):
+            os.rename(self.final_dir, old_dir)
+        os.rename(self.snapshot_dir, self.final_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        self.snapshot_dir = self.final_dir
+
+    def discard(self) -> None:
+        """
+        Drop a reset snapshot that will not be committed, the previous snapshot is kept
+        :return: None
+        """
+        if self.snapshot_dir != self.final_dir:
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+
+
+class SnapshotReader(object):
+    """
+    A class to read a snapshot without loading it in memory
+    """
+    def __init__(self, snapshot_dir: str):
+        """
+        :param snapshot_dir: the folder of the snapshot
+        """
+        self.snapshot_dir = snapshot_dir
+        with open(os.path.join(snapshot_dir, MANIFEST_FILE), "r", encoding="utf-8") as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+    @property
+    def vector_sizes(self) -> dict[str, int]:
+        return self.manifest["vectors"]
+
+    def __len__(self) -> int:
+        return sum(shard["count"] for shard in self.manifest["shards"])
+
+    def shards(self) -> Iterator[tuple[list[str], dict[str, np.ndarray], pa.Table]]:
+        """
+        Iterate over the shards of the snapshot
+        :return: an iterator over the point ids, the memory-mapped named vectors and the payload table of each shard
+        """
+        for shard in self.manifest["shards"]:
+            name = shard["name"]
+            vectors = {vector_name: np.load(os.path.join(self.snapshot_dir, _vector_file(name, vector_name)),
+                                            mmap_mode="r")
+                       for vector_name in self.vector_sizes}
+            table = pq.read_table(os.path.join(self.snapshot_dir, _payload_file(name)), memory_map=True)
+            yield table.column("id").to_pylist(), vectors, table.drop(["id"])
+
+
+def upload_snapshot(qdrant_client: QdrantClient,
+                    snapshot_dir: str,
+                    collection_name: str,
+                    recreate: bool = False,
+                    batch_size: int = 512,
+                    parallel: int = 4,
+                    vector_params: Optional[dict[str, dict]] = None,
+                    caption_payload_name: str = CAPTIONS_FIELD) -> int:
+    """
+    Bulk upload a snapshot into a QDrant collection, without computing any embedding. The payload fields the searches
+    are filtered on are indexed before the upload, and the points of the snapshots written before the url fields
+    existed get them on the way
+    :param qdrant_client: the qdrant client
+    :param snapshot_dir: the folder of the snapshot
+    :param collection_name: the collection to populate
+    :param recreate: whether to drop and recreate the collection, otherwise the points are upserted to it
+    :param batch_size: the number of points per upload request
+    :param parallel: the number of parallel upload processes
+    :param vector_params: the index parameters of each named vector of a created collection, see
+    collection.build_vectors_config
+    :param caption_payload_name: the payload field that stores the captions/answers
+    :return: the number of uploaded points
+    """
+    reader = SnapshotReader(snapshot_dir)
+    vectors_config = build_vectors_config(reader.vector_sizes, vector_params)
+    if recreate:
+        qdrant_client.recreate_collection(collection_name=collection_name, vectors_config=vectors_config)
+    elif not qdrant_client.collection_exists(collection_name):
+        qdrant_client.create_collection(collection_name=collection_name, vectors_config=vectors_config)
+    create_payload_indexes(qdrant_client, collection_name, caption_payload_name=caption_payload_name)
+    start = time.perf_counter()
+    for ids, vectors, payloads in reader.shards():
+        qdrant_client.upload_collection(collection_name=collection_name,
+                                        vectors=vectors,
+                                        payload=[with_url_fields(payload) for payload in payloads.to_pylist()],
+                                        ids=ids,
+                                        batch_size=batch_size,
+                                        parallel=parallel)
+    seconds = time.perf_counter() - start
+    logger.info("Uploaded %d points in %.1fs (%.0f points/s)", len(reader), seconds, len(reader) / max(seconds, 1e-9))
+    # the vectors of a snapshot are stored reduced, the searchers need their projections
+    write_collection_meta(qdrant_client, collection_name, version=uuid.uuid4().hex, updated_at=time.time(),
+                          projection=reader.manifest.get("projection"))
+    return len(reader)
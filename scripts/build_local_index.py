@@ -0,0 +1,27 @@
+import argparse
+import logging
+import os
+from qdrant_client import QdrantClient
+from img2textsemengine.api.config import load_config
+from img2textsemengine.vector_db.local_index import build_local_index_from_qdrant, build_local_index_from_snapshot
+
+# Build the memory-mapped local index of the 'local' search backend, either by scrolling through the QDrant collection
+# or from a snapshot written by the Importer. The searchers reopen the index when it is rebuilt.
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    parser = argparse.ArgumentParser(description="Build the local index of the exact search backend")
+    parser.add_argument("--source", choices=["qdrant", "snapshot"], default="qdrant")
+    parser.add_argument("--snapshot-dir", default="dataset/snapshot", help="the snapshot to index, with --source snapshot")
+    args = parser.parse_args()
+    if args.source == "qdrant":
+        count = build_local_index_from_qdrant(
+            qdrant_client=QdrantClient(location=configs.qdrant.host, port=configs.qdrant.port),
+            collection_name=configs.qdrant.collection_name,
+            index_dir=configs.search.local_index_dir,
+            dtype=configs.search.local_index_dtype)
+    else:
+        count = build_local_index_from_snapshot(snapshot_dir=args.snapshot_dir,
+                                                index_dir=configs.search.local_index_dir,
+                                                dtype=configs.search.local_index_dtype)
+    logging.info("Indexed %d points in %s", count, configs.search.local_index_dir)
@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from img2textsemengine.api.config import load_config
+from img2textsemengine.dataset.sample_file import iter_records
+from img2textsemengine.vector_db.collection_meta import read_collection_meta
+from img2textsemengine.vector_db.encoders import build_text_encoder, compare_embeddings, top_k_overlap
+from img2textsemengine.vector_db.pipeline import batched
+from img2textsemengine.vector_db.projection import projections_from_meta
+
+
+def embed(encoder, texts: list[str], batch_size: int) -> np.ndarray:
+    # a batch at a time, the activations of all the captions at once do not fit in memory
+    return np.concatenate([encoder.embed(batch) for batch in batched(texts, batch_size)])
+
+
+def search_ids(qdrant_client: QdrantClient, collection_name: str, vector_name: str, vectors, k: int,
+               batch_size: int) -> list[list]:
+    ids = []
+    for batch in batched(vectors, batch_size):
+        requests = [models.SearchRequest(vector=models.NamedVector(name=vector_name, vector=vector.tolist()), limit=k)
+                    for vector in batch]
+        ids.extend([point.id for point in points]
+                   for points in qdrant_client.search_batch(collection_name=collection_name, requests=requests))
+    return ids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare a text encoder backend against the torch one")
+    parser.add_argument("--backend", default="onnx_int8", help="the backend to check: onnx or onnx_int8")
+    parser.add_argument("--dataset", default="dataset/sample.parquet", help="the captions used as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64, help="the captions embedded, and searched, per call")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="the minimum cosine similarity per query")
+    parser.add_argument("--min-overlap", type=float, default=0.9, help="the minimum mean top-k overlap")
+    args = parser.parse_args()
+
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    texts = [answer for _, record in iter_records(args.dataset) for answer in record["answer"]]
+    reference = build_text_encoder(backend="torch", hf_model=configs.model.hf_model)
+    candidate = build_text_encoder(backend=args.backend, hf_model=configs.model.hf_model,
+                                   onnx_model_dir=configs.model.onnx_model_dir)
+    reference_embeddings = embed(reference, texts, args.batch_size)
+    candidate_embeddings = embed(candidate, texts, args.batch_size)
+    cosine = compare_embeddings(reference_embeddings, candidate_embeddings)
+    print(f"cosine similarity over {len(texts)} queries: min {cosine.min():.5f}, mean {cosine.mean():.5f}")
+
+    qdrant_client = QdrantClient(location=configs.qdrant.host, port=configs.qdrant.port)
+    # the stored vectors may be reduced, the embeddings are then projected the way the Searcher projects the queries
+    projections = projections_from_meta(read_collection_meta(qdrant_client, configs.qdrant.collection_name))
+    passed = bool(cosine.min() >= args.min_cosine)
+    for vector_name in (configs.vector_names.text_vector_name, configs.vector_names.img_vector_name):
+        if vector_name in projections:
+            searched = [projections[vector_name].transform(embeddings)
+                        for embeddings in (reference_embeddings, candidate_embeddings)]
+        else:
+            searched = [reference_embeddings, candidate_embeddings]
+        overlap = top_k_overlap(
+            search_ids(qdrant_client, configs.qdrant.collection_name, vector_name, searched[0], args.k,
+                       args.batch_size),
+            search_ids(qdrant_client, configs.qdrant.collection_name, vector_name, searched[1], args.k,
+                       args.batch_size))
+        print(f"top-{args.k} overlap on '{vector_name}': min {overlap.min():.3f}, mean {overlap.mean():.3f}")
+        passed = passed and bool(overlap.mean() >= args.min_overlap)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,57 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# the dependencies of the Importer and of the model loading. None of them may be imported by the serving path, since
+# they add seconds to the start of every replica
+FORBIDDEN_MODULES = ["datasets", "PIL", "requests", "tqdm", "pyarrow", "pandas", "sklearn", "torch", "transformers",
+                     "onnxruntime"]
+
+
+def measure_import(module: str, forbidden: list[str]) -> tuple[float, list[str], list[tuple[float, str]]]:
+    """
+    Import a module in a fresh interpreter, with -X importtime
+    :param module: the module to import
+    :param forbidden: the modules that must not be imported along with it
+    :return: the import time of the module in seconds, the forbidden modules that have been imported, and the
+    cumulative import time in seconds of every imported module
+    """
+    code = (f"import json, sys\nimport {module}\n"
+            f"print(json.dumps([name for name in {forbidden!r} if name in sys.modules]))")
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                             check=True)
+    timings = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings.append((int(cumulative) / 1e6, name.strip()))
+    total = next(seconds for seconds, name in timings if name == module)
+    return total, json.loads(process.stdout.splitlines()[-1]), timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that importing the API stays within its time budget and "
+                                                 "does not pull in the heavy dependencies of the Importer")
+    parser.add_argument("--module", default="img2textsemengine.api.main")
+    parser.add_argument("--budget-seconds", type=float, default=2.0)
+    parser.add_argument("--top", type=int, default=15, help="the number of slowest top-level imports to print")
+    args = parser.parse_args()
+
+    total, imported, timings = measure_import(args.module, FORBIDDEN_MODULES)
+    print(f"import {args.module}: {total:.2f}s, budget {args.budget_seconds:.2f}s")
+    top_level = {}
+    for seconds, name in timings:
+        root = name.split(".")[0]
+        top_level[root] = max(top_level.get(root, 0), seconds)
+    for root, seconds in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {seconds:6.3f}s  {root}")
+    passed = True
+    if imported:
+        print(f"FAILED: the forbidden modules {imported} are imported")
+        passed = False
+    if total > args.budget_seconds:
+        print(f"FAILED: the import takes more than {args.budget_seconds:.2f}s")
+        passed = False
+    sys.exit(0 if passed else 1)
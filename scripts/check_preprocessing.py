@@ -0,0 +1,37 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from img2textsemengine.benchmark.preprocessing_benchmark import benchmark_preprocessing, synthetic_photos
+from img2textsemengine.utils.config import load_configurations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the fast image preprocessing of the import against the "
+                                                 "image processor of the model, and check that it stays within the "
+                                                 "tolerances")
+    parser.add_argument("--hf-model", default=None, help="the clip model, by default the one of the import")
+    parser.add_argument("--images-dir", default=None, help="a folder of jpegs, e.g. COCO images")
+    parser.add_argument("--count", type=int, default=128, help="the synthetic images used without --images-dir")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-pixel-diff", type=float, default=1e-4,
+                        help="the maximum absolute difference of the pixel values of the 'fast' preprocessing")
+    parser.add_argument("--min-cosine", type=float, default=0.99,
+                        help="the minimum cosine similarity of the image embeddings of the 'fast_draft' preprocessing")
+    args = parser.parse_args()
+
+    hf_model = args.hf_model or load_configurations("config/data/import.yaml").hf_model
+    if args.images_dir:
+        paths = sorted(glob.glob(os.path.join(args.images_dir, "*.jp*g")))
+        contents = []
+        for path in paths:
+            with open(path, "rb") as image_file:
+                contents.append(image_file.read())
+    else:
+        contents = synthetic_photos(args.count)
+    results = benchmark_preprocessing(hf_model=hf_model, contents=contents, batch_size=args.batch_size)
+    print(json.dumps(results, indent=2))
+    passed = (results["fast"]["max_abs_pixel_diff"] <= args.max_pixel_diff
+              and results["fast_draft"]["min_cosine"] >= args.min_cosine)
+    sys.exit(0 if passed else 1)
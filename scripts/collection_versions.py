@@ -0,0 +1,33 @@
+import argparse
+import logging
+from qdrant_client import QdrantClient
+from img2textsemengine.utils.config import load_configurations
+from img2textsemengine.vector_db.collection_versions import (list_versions, migrate_to_alias, prune_versions,
+                                                             resolve_alias, rollback)
+
+# List the versioned collections built by the 'shadow' imports, point the alias back to a previous one, or delete the
+# oldest ones. The searchers follow the alias at their next query. A collection imported before the aliases existed is
+# copied into a first version, and replaced by the alias, once with --migrate.
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    configs = load_configurations("config/data/import.yaml")
+    parser = argparse.ArgumentParser(description="Manage the versioned collections behind the collection alias")
+    parser.add_argument("--alias", default=configs.qdrant.collection_name)
+    parser.add_argument("--rollback", action="store_true", help="point the alias to the previous version")
+    parser.add_argument("--to", default=None, help="with --rollback, the version to point the alias to")
+    parser.add_argument("--prune", type=int, default=None, help="delete all but this number of previous versions")
+    parser.add_argument("--migrate", action="store_true",
+                        help="copy the collection named like the alias into a first version and replace it by the alias")
+    args = parser.parse_args()
+    qdrant_client = QdrantClient(location=configs.qdrant.host, port=configs.qdrant.port)
+    if args.migrate:
+        logging.info("'%s' now points to '%s'", args.alias,
+                     migrate_to_alias(qdrant_client, args.alias,
+                                      index_timeout_seconds=configs.shadow.index_timeout_seconds))
+    if args.rollback:
+        logging.info("'%s' now points to '%s'", args.alias, rollback(qdrant_client, args.alias, args.to))
+    if args.prune is not None:
+        prune_versions(qdrant_client, args.alias, keep_versions=args.prune)
+    live = resolve_alias(qdrant_client, args.alias)
+    for name in list_versions(qdrant_client, args.alias):
+        print(f"{name} {qdrant_client.count(name).count} points{' (live)' if name == live else ''}")
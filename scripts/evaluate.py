@@ -0,0 +1,64 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+from img2textsemengine.api.config import load_config
+from img2textsemengine.benchmark.report import write_report
+from img2textsemengine.evaluation.harness import evaluate
+from img2textsemengine.vector_db.searcher import Searcher
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Evaluate the recall, MRR and NDCG of the searches against an exact "
+                                                 "search, using every stored caption as a query for its own image")
+    parser.add_argument("--vectors", nargs="+", default=["image", "text"], help="the named vectors to evaluate")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64, help="the queries embedded and searched together")
+    parser.add_argument("--max-queries", type=int, default=None, help="a seeded sample of the captions, default all")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hnsw-ef", type=int, nargs="+", default=[None], help="the hnsw_ef values to compare")
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[None],
+                        help="the oversampling values to compare, for quantized vectors")
+    parser.add_argument("--rescore", choices=["true", "false"], nargs="+", default=[None],
+                        help="whether to rescore the candidates of quantized vectors")
+    parser.add_argument("--caption-payload-name", default="possible_answers")
+    parser.add_argument("--output", default="evaluation_results/latest.json")
+    args = parser.parse_args()
+
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    # no caches, every query is embedded and searched
+    searcher = Searcher(host=configs.qdrant.host,
+                        port=configs.qdrant.port,
+                        collection_name=configs.qdrant.collection_name,
+                        text_vector_name=configs.vector_names.text_vector_name,
+                        img_vector_name=configs.vector_names.img_vector_name,
+                        hf_model=configs.model.hf_model,
+                        encoder_backend=configs.model.backend,
+                        onnx_model_dir=configs.model.onnx_model_dir,
+                        prepared_model_dir=configs.model.prepared_model_dir,
+                        model_dtype=configs.model.dtype,
+                        encoder_threads=configs.executor.torch_threads,
+                        search_backend=configs.search.backend,
+                        local_index_dir=configs.search.local_index_dir,
+                        hnsw_ef=configs.search.hnsw_ef,
+                        oversampling=configs.search.oversampling,
+                        rescore=configs.search.rescore,
+                        prefer_grpc=configs.qdrant.prefer_grpc,
+                        grpc_port=configs.qdrant.grpc_port)
+    settings = [{name: value for name, value in zip(("hnsw_ef", "oversampling", "rescore"), values)
+                 if value is not None}
+                for values in itertools.product(args.hnsw_ef, args.oversampling,
+                                                [None if rescore is None else rescore == "true"
+                                                 for rescore in args.rescore])]
+    results = {vector_name: evaluate(searcher, vector_name, k=args.k, batch_size=args.batch_size,
+                                     max_queries=args.max_queries, seed=args.seed, search_settings=settings,
+                                     caption_payload_name=args.caption_payload_name)
+               for vector_name in args.vectors}
+    report = write_report(results, parameters={**vars(args),
+                                               "collection_name": configs.qdrant.collection_name,
+                                               "hf_model": configs.model.hf_model,
+                                               "encoder_backend": configs.model.backend,
+                                               "search_backend": configs.search.backend}, path=args.output)
+    print(json.dumps(report["results"], indent=2))
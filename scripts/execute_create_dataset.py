@@ -1,6 +1,30 @@
-from img2textsemengine.dataset.create_dataset import sample_coco_dataset
+import argparse
+import logging
+from img2textsemengine.dataset.create_dataset import SAMPLING_METHODS, sample_coco_dataset
 
 if __name__ == '__main__':
-    sample_coco_dataset(hf_card="lmms-lab/COCO-Caption",
-                        limit=100,
-                        sample_path="dataset/sample.jsonl")
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Sample the records of the COCO captions dataset, without their "
+                                                 "images, into a parquet file")
+    parser.add_argument("--hf-card", default="lmms-lab/COCO-Caption")
+    parser.add_argument("--split", default="val")
+    parser.add_argument("--method", choices=SAMPLING_METHODS, default="head",
+                        help="head: the first records, reservoir: a uniform sample of exactly --limit records, "
+                             "bernoulli: every record with probability --fraction")
+    parser.add_argument("--limit", type=int, default=100, help="the maximum number of sampled records")
+    parser.add_argument("--fraction", type=float, default=None, help="the probability to keep a record (bernoulli)")
+    parser.add_argument("--seed", type=int, default=0, help="the same seed gives the same sample")
+    parser.add_argument("--num-proc", type=int, default=1, help="the processes streaming the shards of the dataset")
+    parser.add_argument("--row-group-size", type=int, default=10_000)
+    parser.add_argument("--output", default="dataset/sample.parquet")
+    args = parser.parse_args()
+
+    sample_coco_dataset(hf_card=args.hf_card,
+                        limit=args.limit,
+                        sample_path=args.output,
+                        method=args.method,
+                        fraction=args.fraction,
+                        seed=args.seed,
+                        num_proc=args.num_proc,
+                        split=args.split,
+                        row_group_size=args.row_group_size)
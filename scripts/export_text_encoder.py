@@ -0,0 +1,8 @@
+import os
+from img2textsemengine.api.config import load_config
+from img2textsemengine.vector_db.model_export import export_onnx_text_encoder
+
+if __name__ == '__main__':
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    export_onnx_text_encoder(hf_model=configs.model.hf_model,
+                             output_dir=configs.model.onnx_model_dir)
@@ -1,14 +1,42 @@
+import logging
 import os
+from prometheus_client import start_http_server
 from img2textsemengine.vector_db.qdrant_util import Importer
 from img2textsemengine.utils.config import load_configurations
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     configs = load_configurations("config/data/import.yaml")
+    if configs.metrics.port:
+        start_http_server(configs.metrics.port)  # the stage timings of the import can be scraped while it runs
     data_path = os.path.join(configs.data.dataset_folder, configs.data.dataset_file)
     importer = Importer(host=configs.qdrant.host,
                         port=configs.qdrant.port,
                         collection_name=configs.qdrant.collection_name,
                         image_vector_size=configs.vectors.image_vector_size,
                         hf_model=configs.hf_model,
-                        dataset_path=data_path.__str__())  # to avoid expect type warnings
+                        dataset_path=data_path.__str__(),  # to avoid expect type warnings
+                        batch_size=configs.pipeline.batch_size,
+                        download_workers=configs.pipeline.download_workers,
+                        download_timeout=configs.pipeline.download_timeout,
+                        queue_depth=configs.pipeline.queue_depth,
+                        upsert_batch_size=configs.pipeline.upsert_batch_size,
+                        mode=configs.refresh.mode,
+                        id_field=configs.refresh.id_field,
+                        checkpoint_path=configs.refresh.checkpoint_path,
+                        snapshot_dir=configs.snapshot.snapshot_dir,
+                        snapshot_shard_size=configs.snapshot.shard_size,
+                        vector_params=configs.vectors.index,
+                        embedding_workers=configs.pipeline.embedding_workers,
+                        worker_threads=configs.pipeline.worker_threads,
+                        preprocessing=configs.pipeline.preprocessing,
+                        prefer_grpc=configs.qdrant.prefer_grpc,
+                        grpc_port=configs.qdrant.grpc_port,
+                        keep_versions=configs.shadow.keep_versions,
+                        index_timeout=configs.shadow.index_timeout_seconds,
+                        check_sample_size=configs.shadow.check_sample_size,
+                        min_self_recall=configs.shadow.min_self_recall,
+                        reduced_dim=configs.projection.reduced_dim,
+                        whiten=configs.projection.whiten,
+                        projection_sample_size=configs.projection.sample_size)
     importer.import_data(caption_payload_name=configs.qdrant.caption_payload_name)
@@ -0,0 +1,39 @@
+import argparse
+import logging
+from qdrant_client import QdrantClient
+from img2textsemengine.utils.config import load_configurations
+from img2textsemengine.vector_db.collection import VECTOR_NAMES
+from img2textsemengine.vector_db.collection_versions import check_alias, new_version_name, publish_version
+from img2textsemengine.vector_db.snapshot import upload_snapshot
+
+# Rebuild a collection from a snapshot written by the Importer. It neither downloads images nor loads torch.
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    configs = load_configurations("config/data/import.yaml")
+    parser = argparse.ArgumentParser(description="Bulk upload an embeddings snapshot into QDrant")
+    parser.add_argument("--snapshot-dir", default=configs.snapshot.snapshot_dir)
+    parser.add_argument("--collection", default=configs.qdrant.collection_name)
+    parser.add_argument("--recreate", action="store_true", help="drop and recreate the collection first")
+    parser.add_argument("--shadow", action="store_true",
+                        help="upload into a new versioned collection and switch the --collection alias to it")
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--parallel", type=int, default=4, help="the number of parallel upload processes")
+    args = parser.parse_args()
+    qdrant_client = QdrantClient(location=configs.qdrant.host, port=configs.qdrant.port)
+    if args.shadow:
+        check_alias(qdrant_client, args.collection)
+    collection_name = new_version_name(args.collection) if args.shadow else args.collection
+    upload_snapshot(qdrant_client=qdrant_client,
+                    snapshot_dir=args.snapshot_dir,
+                    collection_name=collection_name,
+                    recreate=args.recreate,
+                    batch_size=args.batch_size,
+                    parallel=args.parallel,
+                    vector_params=configs.vectors.index,
+                    caption_payload_name=configs.qdrant.caption_payload_name)
+    if args.shadow:
+        publish_version(qdrant_client, alias=args.collection, collection_name=collection_name,
+                        vector_names=list(VECTOR_NAMES), keep_versions=configs.shadow.keep_versions,
+                        index_timeout_seconds=configs.shadow.index_timeout_seconds,
+                        check_sample_size=configs.shadow.check_sample_size,
+                        min_self_recall=configs.shadow.min_self_recall)
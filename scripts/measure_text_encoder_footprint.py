@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+from img2textsemengine.api.config import load_config
+
+# Each variant runs in a fresh interpreter, so the resident memory of one does not leak into the next. "clip_full" is
+# how the Searcher loaded the model before, the other variants load only the text tower.
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import torch
+from transformers import AutoTokenizer, CLIPModel
+from img2textsemengine.vector_db.encoders import TorchTextEncoder
+hf_model, variant = sys.argv[1], sys.argv[2]
+if variant == "clip_full":
+    tokenizer = AutoTokenizer.from_pretrained(hf_model)
+    model = CLIPModel.from_pretrained(hf_model)
+    with torch.inference_mode():
+        model.get_text_features(**tokenizer(["a photo of a dog"], return_tensors="pt"))
+else:
+    TorchTextEncoder(hf_model=hf_model, dtype=variant.split(":")[1]).embed(["a photo of a dog"])
+ready_seconds = time.perf_counter() - start
+with open("/proc/self/status") as status:
+    rss_kb = int(next(line for line in status if line.startswith("VmRSS")).split()[1])
+print(json.dumps({"variant": variant, "ready_seconds": round(ready_seconds, 2), "rss_mb": round(rss_kb / 1024, 1),
+                  "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}))
+"""
+
+if __name__ == '__main__':
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    for variant in ("clip_full", "text_tower:float32", "text_tower:bfloat16"):
+        output = subprocess.run([sys.executable, "-c", _PROBE, configs.model.hf_model, variant],
+                                check=True, capture_output=True, text=True).stdout
+        print(json.loads(output.strip().splitlines()[-1]))
@@ -0,0 +1,8 @@
+import os
+from img2textsemengine.api.config import load_config
+from img2textsemengine.vector_db.model_export import prepare_text_encoder
+
+if __name__ == '__main__':
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    prepare_text_encoder(hf_model=configs.model.hf_model,
+                         output_dir=configs.model.prepared_model_dir)
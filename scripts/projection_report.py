@@ -0,0 +1,63 @@
+import argparse
+import json
+import logging
+import os
+import numpy as np
+from img2textsemengine.api.config import load_config
+from img2textsemengine.benchmark.report import write_report
+from img2textsemengine.evaluation.ground_truth import load_stored_vectors
+from img2textsemengine.evaluation.harness import caption_queries
+from img2textsemengine.evaluation.projection_report import projection_report, smallest_dim
+from img2textsemengine.vector_db.searcher import Searcher
+
+
+# The recall of the searches when the stored vectors are reduced to fewer dimensions, to pick the reduced_dim of the
+# projection section of config/data/import.yaml. It runs over a collection whose vectors are not reduced yet.
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Report the recall of the searches against the dimension of the "
+                                                 "stored vectors, reduced by PCA")
+    parser.add_argument("--vectors", nargs="+", default=["image", "text"], help="the named vectors to evaluate")
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--no-whiten", action="store_true", help="only compare the projections without whitening")
+    parser.add_argument("--sample-size", type=int, default=10_000, help="the vectors each projection is fitted on")
+    parser.add_argument("--max-queries", type=int, default=10_000, help="a seeded sample of the captions")
+    parser.add_argument("--min-recall-vs-full", type=float, default=0.95,
+                        help="the recall@k against the full vectors of the recommended dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=64, help="the queries embedded together")
+    parser.add_argument("--caption-payload-name", default="possible_answers")
+    parser.add_argument("--output", default="evaluation_results/projection.json")
+    args = parser.parse_args()
+
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    # only its text encoder and its QDrant client are used
+    searcher = Searcher(host=configs.qdrant.host,
+                        port=configs.qdrant.port,
+                        collection_name=configs.qdrant.collection_name,
+                        text_vector_name=configs.vector_names.text_vector_name,
+                        img_vector_name=configs.vector_names.img_vector_name,
+                        hf_model=configs.model.hf_model,
+                        encoder_backend=configs.model.backend,
+                        onnx_model_dir=configs.model.onnx_model_dir,
+                        prepared_model_dir=configs.model.prepared_model_dir,
+                        model_dtype=configs.model.dtype,
+                        encoder_threads=configs.executor.torch_threads)
+    results = {}
+    for vector_name in args.vectors:
+        stored = load_stored_vectors(searcher.qdrant_client, searcher.collection_name, vector_name,
+                                     caption_payload_name=args.caption_payload_name)
+        texts, targets = caption_queries(stored, max_queries=args.max_queries, seed=args.seed)
+        queries = np.concatenate([np.asarray(searcher.embed_texts(texts[offset:offset + args.batch_size]),
+                                             dtype=np.float32)
+                                  for offset in range(0, len(texts), args.batch_size)])
+        results[vector_name] = projection_report(stored, queries, targets, dims=args.dims, k=args.k,
+                                                 whiten_options=(False,) if args.no_whiten else (False, True),
+                                                 sample_size=args.sample_size, seed=args.seed)
+        results[vector_name]["recommended"] = smallest_dim(results[vector_name], k=args.k,
+                                                           min_recall_vs_full=args.min_recall_vs_full)
+    report = write_report(results, parameters={**vars(args),
+                                               "collection_name": configs.qdrant.collection_name,
+                                               "hf_model": configs.model.hf_model}, path=args.output)
+    print(json.dumps(report["results"], indent=2))
@@ -0,0 +1,91 @@
+import os
+os.environ.setdefault("HF_HUB_OFFLINE", "1")  # the benchmark runs offline, against the locally cached model
+import argparse
+import asyncio
+import json
+import tempfile
+from img2textsemengine.api.config import load_config
+from img2textsemengine.benchmark.app_benchmark import benchmark_app_query
+from img2textsemengine.benchmark.import_benchmark import benchmark_import, write_synthetic_dataset
+from img2textsemengine.benchmark.report import compare_reports, write_report
+from img2textsemengine.benchmark.search_benchmark import (benchmark_searcher_phases, benchmark_searcher_query,
+                                                          dataset_queries, load_synthetic_collection,
+                                                          synthetic_queries)
+from img2textsemengine.vector_db.searcher import Searcher
+from img2textsemengine.vector_db.snapshot import upload_snapshot
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the search service and the import offline, against an "
+                                                 "in-memory QDrant")
+    parser.add_argument("--points", type=int, default=10_000, help="the number of synthetic points to search")
+    parser.add_argument("--snapshot-dir", default=None, help="search the points of an import snapshot instead")
+    parser.add_argument("--queries", type=int, default=200, help="the number of measured queries per run")
+    parser.add_argument("--queries-dataset", default=None, help="use the captions of a jsonl dataset as queries")
+    parser.add_argument("--warmup", type=int, default=10, help="the number of queries run before measuring")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--vector", default="image", help="the vector to search: text or image")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--import-records", type=int, default=256, help="0 skips the import benchmark")
+    parser.add_argument("--embedding-workers", type=int, nargs="+", default=[1],
+                        help="the embedding worker processes of the import benchmark, one import per value")
+    parser.add_argument("--output", default="benchmark_results/latest.json")
+    parser.add_argument("--baseline", default=None, help="a previous report to compare the p95 latencies with")
+    args = parser.parse_args()
+
+    configs = load_config(path=os.environ.get("config_file", "config/api/api_configs.yaml"))
+    # no caches, every query is embedded and searched
+    searcher = Searcher(host=":memory:",
+                        port=configs.qdrant.port,
+                        collection_name=configs.qdrant.collection_name,
+                        text_vector_name=configs.vector_names.text_vector_name,
+                        img_vector_name=configs.vector_names.img_vector_name,
+                        hf_model=configs.model.hf_model,
+                        encoder_backend=configs.model.backend,
+                        onnx_model_dir=configs.model.onnx_model_dir,
+                        prepared_model_dir=configs.model.prepared_model_dir,
+                        model_dtype=configs.model.dtype,
+                        encoder_threads=configs.executor.torch_threads,
+                        hnsw_ef=configs.search.hnsw_ef,
+                        oversampling=configs.search.oversampling,
+                        rescore=configs.search.rescore,
+                        prefer_grpc=configs.qdrant.prefer_grpc,
+                        grpc_port=configs.qdrant.grpc_port)
+    if args.snapshot_dir:
+        points = upload_snapshot(searcher.qdrant_client, args.snapshot_dir, configs.qdrant.collection_name,
+                                 recreate=True, parallel=1)
+    else:
+        points = load_synthetic_collection(searcher.qdrant_client, configs.qdrant.collection_name, args.points)
+    if args.queries_dataset:
+        texts = dataset_queries(args.queries_dataset, args.warmup + args.queries)
+    else:
+        texts = synthetic_queries(args.warmup + args.queries)
+    warmup, texts = texts[:args.warmup], texts[args.warmup:]
+    benchmark_searcher_query(searcher, warmup, args.vector, args.k, concurrency=1)
+
+    results = {"searcher_phases": {}, "searcher_query": {}, "app_query": {}}
+    for concurrency in args.concurrency:
+        name = f"concurrency_{concurrency}"
+        results["searcher_phases"][name] = benchmark_searcher_phases(searcher, texts, args.vector, args.k, concurrency)
+        results["searcher_query"][name] = benchmark_searcher_query(searcher, texts, args.vector, args.k, concurrency)
+        results["app_query"][name] = asyncio.run(benchmark_app_query(searcher, configs, texts, args.vector, args.k,
+                                                                     concurrency))
+    if args.import_records:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dataset_path = os.path.join(tmp_dir, "dataset.jsonl")
+            write_synthetic_dataset(dataset_path, args.import_records)
+            results["import"] = {f"workers_{workers}": benchmark_import(hf_model=configs.model.hf_model,
+                                                                       dataset_path=dataset_path,
+                                                                       embedding_workers=workers)
+                                 for workers in args.embedding_workers}
+
+    report = write_report(results, parameters={**vars(args), "collection_points": points,
+                                               "hf_model": configs.model.hf_model,
+                                               "encoder_backend": configs.model.backend}, path=args.output)
+    print(json.dumps(report["results"], indent=2))
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            ratios = compare_reports(json.load(baseline_file), report)
+        print("p95 latency, current / baseline:")
+        for name, ratio in ratios.items():
+            print(f"  {name}: {ratio:.3f}")